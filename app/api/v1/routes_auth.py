@@ -39,7 +39,7 @@ async def send_verification_code(request: SendCodeRequest):
         
         # 保存验证码到 Redis
         print(f"💾 正在保存验证码到 Redis...")
-        save_result = auth_service.save_verification_code(request.email, code)
+        save_result = await auth_service.save_verification_code_async(request.email, code)
         print(f"💾 保存结果: {save_result}")
         
         if not save_result:
@@ -118,14 +118,14 @@ async def login_with_code(request: LoginRequest):
         auth_service = get_auth_service()
         
         # 验证验证码
-        if not auth_service.verify_code(request.email, request.code):
+        if not await auth_service.verify_code_async(request.email, request.code):
             raise HTTPException(
                 status_code=400,
                 detail="验证码错误或已过期"
             )
         
         # 获取或创建用户
-        user = auth_service.get_or_create_user(request.email)
+        user = await auth_service.get_or_create_user_async(request.email)
         
         # 创建访问令牌
         access_token = auth_service.create_access_token(user)
@@ -185,7 +185,7 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
         
         # 获取用户
         user_id = payload.get("sub")
-        user = auth_service.get_user_by_id(user_id)
+        user = await auth_service.get_user_by_id_async(user_id)
         
         if not user:
             raise HTTPException(
@@ -36,7 +36,7 @@ async def get_my_billing_info(
     Authorization: Bearer <token>
     ```
     """
-    billing_info = billing_service.get_user_billing_info(current_user_id)
+    billing_info = await billing_service.get_user_billing_info_async(current_user_id)
     
     if not billing_info:
         raise HTTPException(
@@ -75,7 +75,7 @@ async def change_plan(
     ```
     """
     try:
-        result = billing_service.change_plan(
+        result = await billing_service.change_plan_async(
             user_id=current_user_id,
             new_plan_id=request.plan_id,
             reset_credits=True
@@ -111,7 +111,7 @@ async def consume_credits(
     - success: 是否成功
     - remaining_credits: 剩余算力
     """
-    success = billing_service.consume_credits(current_user_id, amount)
+    success = await billing_service.consume_credits_async(current_user_id, amount)
     
     if not success:
         raise HTTPException(
@@ -120,7 +120,7 @@ async def consume_credits(
         )
     
     # 获取更新后的信息
-    billing_info = billing_service.get_user_billing_info(current_user_id)
+    billing_info = await billing_service.get_user_billing_info_async(current_user_id)
     
     return {
         "success": True,
@@ -145,7 +145,7 @@ async def add_credits(
     - success: 是否成功
     - total_credits: 总算力
     """
-    success = billing_service.add_credits(current_user_id, amount)
+    success = await billing_service.add_credits_async(current_user_id, amount)
     
     if not success:
         raise HTTPException(
@@ -154,7 +154,7 @@ async def add_credits(
         )
     
     # 获取更新后的信息
-    billing_info = billing_service.get_user_billing_info(current_user_id)
+    billing_info = await billing_service.get_user_billing_info_async(current_user_id)
     
     return {
         "success": True,
@@ -0,0 +1,64 @@
+"""
+图片按需缩放相关路由
+"""
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+
+from app.core.config import settings
+from app.services.image.variants import VARIANT_FORMATS, get_image_variant_cache
+
+router = APIRouter()
+
+
+@router.get("/images/{image_id}")
+async def get_image_variant(
+    image_id: str,
+    request: Request,
+    w: Optional[int] = Query(default=None, ge=1, description="目标宽度（向上取到最近的允许宽度）"),
+    fmt: str = Query(default="webp", description="输出格式: webp / jpeg")
+):
+    """
+    获取图片缩放图
+
+    宽度限定在 IMAGE_VARIANT_WIDTHS 内，缩放结果缓存在磁盘；
+    响应带 ETag 与 Cache-Control，If-None-Match 匹配时返回 304。
+
+    Args:
+        image_id: 结果文件名（不含扩展名，如 task_xxx_output）或上传 file_id
+        w: 目标宽度（缺省为最大允许宽度）
+        fmt: 输出格式
+
+    Returns:
+        FileResponse: 缩放图
+    """
+    fmt = fmt.lower()
+    if fmt not in VARIANT_FORMATS:
+        raise HTTPException(status_code=400, detail="不支持的输出格式。支持的格式: webp, jpeg")
+
+    cache = get_image_variant_cache()
+    source = await run_in_threadpool(cache.find_original, image_id)
+    if not source:
+        raise HTTPException(status_code=404, detail=f"图片不存在: {image_id}")
+
+    width = cache.snap_width(w or settings.get_image_variant_widths[-1])
+    try:
+        variant = await run_in_threadpool(cache.get_variant, source, width, fmt)
+    except Exception as e:
+        print(f"[Images] 生成缩放图失败: {image_id} w={width} fmt={fmt}: {e}")
+        raise HTTPException(status_code=500, detail="生成缩放图失败")
+
+    headers = {
+        "ETag": variant.etag,
+        "Cache-Control": f"public, max-age={settings.IMAGE_VARIANT_MAX_AGE}",
+        "X-Image-Width": str(variant.width),
+        "X-Cache": "HIT" if variant.cache_hit else "MISS",
+    }
+
+    if_none_match = request.headers.get("if-none-match") or ""
+    if variant.etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(variant.path, media_type=variant.media_type, headers=headers)
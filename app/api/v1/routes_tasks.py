@@ -1,7 +1,11 @@
 """
 任务相关路由
 """
-from fastapi import APIRouter, HTTPException, Query, Depends
+import json
+
+from fastapi import APIRouter, HTTPException, Query, Depends, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from typing import Optional
 
 from app.schemas.task import (
@@ -10,10 +14,13 @@ from app.schemas.task import (
     TaskListResponse,
     TaskStatus
 )
-from app.services.tasks.manager import TaskService
+from app.services.tasks.manager import TaskService, referenced_file_ids
+from app.services.tasks.events import get_task_event_hub
 from app.services.billing import billing_service
 from app.services.auth.auth_service import get_current_user_id
+from app.services.storage import verify_direct_upload
 from app.config.credits_cost import calculate_task_credits
+from app.utils.id_generator import generate_task_id
 
 router = APIRouter()
 
@@ -38,10 +45,10 @@ async def create_task(
     创建新任务（需要登录）
     
     流程：
-    1. 检查用户算力是否足够
-    2. 预扣除算力
+    1. 校验客户端直传的文件（大小与文件头），未通过时不扣算力
+    2. 按任务ID原子预扣算力（Lua 脚本一次往返完成余额检查与扣除，并发请求不会超扣）
     3. 创建任务
-    4. 如果创建失败，返还算力
+    4. 如果创建失败，退还预扣的算力
     
     Args:
         request: 任务创建请求
@@ -51,11 +58,23 @@ async def create_task(
         TaskInfo: 任务信息
         
     Raises:
+        400: 直传文件未上传或内容不合法
         402: 算力不足
         500: 创建失败
     """
+    # 预扣算力的幂等键
+    task_id = generate_task_id()
+    reserved = False
+    
     try:
-        # 1. 计算所需算力
+        # 1. 校验客户端直传的文件（字节未经过 API 进程，使用前检查对象大小与文件头）
+        for file_id in referenced_file_ids(request.source_image, request.config):
+            try:
+                await run_in_threadpool(verify_direct_upload, file_id, current_user_id)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        
+        # 2. 计算所需算力
         required_credits = calculate_task_credits(
             mode=request.mode,
             quality=getattr(request.config, 'quality', 'standard') if request.config else 'standard',
@@ -64,42 +83,39 @@ async def create_task(
         
         print(f"用户 {current_user_id} 创建任务，需要 {required_credits} 算力")
         
-        # 2. 检查用户算力
-        user_billing = billing_service.get_user_billing_info(current_user_id)
-        if not user_billing:
+        # 3. 预扣算力（同时返回当前套餐，决定排队优先级）
+        reserve_status, balance, plan_id = await billing_service.reserve_credits_async(
+            current_user_id, required_credits, task_id
+        )
+        if reserve_status == "not_found":
             raise HTTPException(
                 status_code=404,
                 detail="用户信息不存在，请先登录"
             )
         
-        if user_billing.current_credits < required_credits:
+        if reserve_status == "insufficient":
             raise HTTPException(
                 status_code=402,  # Payment Required
                 detail={
                     "error": "CREDIT_NOT_ENOUGH",
-                    "message": f"算力不足。需要 {required_credits} 算力，当前剩余 {user_billing.current_credits} 算力",
+                    "message": f"算力不足。需要 {required_credits} 算力，当前剩余 {balance} 算力",
                     "required": required_credits,
-                    "current": user_billing.current_credits,
-                    "deficit": required_credits - user_billing.current_credits
+                    "current": balance,
+                    "deficit": required_credits - balance
                 }
             )
         
-        # 3. 预扣除算力
-        consume_success = billing_service.consume_credits(current_user_id, required_credits)
-        if not consume_success:
-            raise HTTPException(
-                status_code=500,
-                detail="算力扣除失败"
-            )
+        reserved = True
+        print(f"✓ 算力预扣成功，剩余 {balance} 算力")
         
-        print(f"✓ 算力扣除成功，剩余 {user_billing.current_credits - required_credits} 算力")
-        
-        # 4. 创建任务 - 传递 user_id 和消耗的积分
+        # 4. 创建任务 - 传递 user_id、消耗的积分和套餐（决定排队优先级）
         task_service = get_task_service()
-        task_info = task_service.create_task(
+        task_info = await task_service.create_task_async(
             request, 
             user_id=current_user_id,
-            credits_consumed=required_credits
+            credits_consumed=required_credits,
+            plan_id=plan_id,
+            task_id=task_id
         )
         
         # 在任务信息中记录消耗的算力（可选）
@@ -116,12 +132,12 @@ async def create_task(
         # 其他异常，尝试返还算力
         print(f"❌ 创建任务失败: {e}")
         
-        # 如果已经扣除了算力，尝试返还
+        # 如果已经预扣了算力，退还（按任务ID幂等）
         try:
-            if 'required_credits' in locals() and 'consume_success' in locals() and consume_success:
-                billing_service.add_credits(current_user_id, required_credits)
+            if reserved:
+                await billing_service.refund_credits_async(task_id, current_user_id, required_credits)
                 print(f"✓ 算力已返还")
-        except:
+        except Exception:
             pass
         
         raise HTTPException(
@@ -130,6 +146,55 @@ async def create_task(
         )
 
 
+@router.get("/tasks/mine", response_model=TaskListResponse)
+async def list_my_tasks(
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor）"),
+    limit: int = Query(20, ge=1, le=100, description="每页数量"),
+    current_user_id: str = Depends(get_current_user_id)
+):
+    """
+    获取当前用户的任务历史（需要登录）
+    
+    基于用户任务索引的游标分页，按创建时间倒序。
+    
+    Args:
+        cursor: 分页游标
+        limit: 每页数量
+        current_user_id: 当前用户ID（从 token 获取）
+        
+    Returns:
+        TaskListResponse: 任务列表（pagination 中包含 next_cursor）
+    """
+    task_service = get_task_service()
+    
+    try:
+        tasks, next_cursor = await task_service.get_user_tasks_async(
+            user_id=current_user_id,
+            cursor=cursor,
+            limit=limit
+        )
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail=f"无效的分页游标: {cursor}"
+        )
+    except Exception as e:
+        print(f"获取用户任务列表失败: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"获取用户任务列表失败: {str(e)}"
+        )
+    
+    return TaskListResponse(
+        tasks=tasks,
+        pagination={
+            "limit": limit,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None
+        }
+    )
+
+
 @router.get("/tasks/{task_id}", response_model=TaskInfo)
 async def get_task(task_id: str):
     """
@@ -142,7 +207,7 @@ async def get_task(task_id: str):
         TaskInfo: 任务信息
     """
     task_service = get_task_service()
-    task_info = task_service.get_task(task_id)
+    task_info = await task_service.get_task_async(task_id)
     
     if not task_info:
         raise HTTPException(
@@ -153,6 +218,72 @@ async def get_task(task_id: str):
     return task_info
 
 
+@router.get("/tasks/{task_id}/events")
+async def stream_task_events(task_id: str, request: Request):
+    """
+    任务进度事件流（Server-Sent Events）
+    
+    连接后先推送当前状态，之后每次状态 / 进度更新推送一条事件，任务结束后关闭连接；
+    无事件时每 TASK_EVENTS_KEEPALIVE 秒发送一次保活注释。
+    事件 data 为 JSON：task_id / status / progress / current_step / result / error / updated_at
+    
+    Args:
+        task_id: 任务ID
+        
+    Returns:
+        StreamingResponse: text/event-stream
+    """
+    if not await get_task_service().queue.is_task_exists_async(task_id):
+        raise HTTPException(
+            status_code=404,
+            detail=f"任务不存在: {task_id}"
+        )
+    
+    async def event_source():
+        yield "retry: 3000\n\n"
+        async for event in get_task_event_hub().stream(task_id):
+            if await request.is_disconnected():
+                break
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {event['status']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # 关闭 Nginx 缓冲
+        }
+    )
+
+
+@router.websocket("/tasks/{task_id}/ws")
+async def task_events_websocket(websocket: WebSocket, task_id: str):
+    """
+    任务进度事件流（WebSocket 版本）
+    
+    每条消息为一个状态事件（格式同 SSE 的 data）；无事件时发送 {"type": "keepalive"}。
+    任务结束后服务端关闭连接，任务不存在时以 4404 关闭。
+    
+    Args:
+        websocket: WebSocket 连接
+        task_id: 任务ID
+    """
+    await websocket.accept()
+    if not await get_task_service().queue.is_task_exists_async(task_id):
+        await websocket.close(code=4404, reason="task not found")
+        return
+    
+    try:
+        async for event in get_task_event_hub().stream(task_id):
+            await websocket.send_json(event if event is not None else {"type": "keepalive"})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+
 @router.get("/tasks", response_model=TaskListResponse)
 async def list_tasks(
     status: Optional[str] = Query(None, description="状态筛选"),
@@ -174,27 +305,25 @@ async def list_tasks(
     """
     try:
         task_service = get_task_service()
-        tasks = task_service.get_task_list(
+        task_ids = await task_service.get_task_ids_async(
             status_filter=status,
             mode_filter=mode,
             page=page,
             page_size=page_size
         )
         
-        # 将 TaskSummary 转换为 TaskInfo（简化版）
-        task_infos = []
-        for task_summary in tasks:
-            # 获取完整任务信息
-            full_task = task_service.get_task(task_summary.task_id)
-            if full_task:
-                task_infos.append(full_task)
+        # 批量获取完整任务信息（单次 Redis 往返）
+        task_infos = await task_service.get_tasks_async(task_ids)
+        
+        # 基于索引统计真实总数
+        total = await task_service.count_tasks_async(status_filter=status, mode_filter=mode)
         
         return TaskListResponse(
             tasks=task_infos,
             pagination={
                 "page": page,
                 "page_size": page_size,
-                "total": len(task_infos)
+                "total": total
             }
         )
         
@@ -219,7 +348,7 @@ async def cancel_task(task_id: str):
     """
     try:
         task_service = get_task_service()
-        success = task_service.cancel_task(task_id)
+        success = await task_service.cancel_task_async(task_id)
         
         if not success:
             raise HTTPException(
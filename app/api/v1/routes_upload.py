@@ -1,27 +1,44 @@
 """
 文件上传相关路由
 """
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from datetime import datetime
+import hashlib
 from pathlib import Path
 
-from app.schemas.image import UploadImageResponse
-from app.services.storage import get_local_storage
+from app.core.config import settings
+from app.schemas.image import PresignedUploadResponse, UploadImageResponse
+from app.services.auth.auth_service import get_current_user_id
+from app.services.storage import get_storage, get_file_index, verify_direct_upload
 from app.utils.id_generator import generate_file_id
+from app.utils.image_io import WEB_IMAGE_FORMATS, probe_image_header, sniff_image_format
 
 router = APIRouter()
 
 
-# 允许的文件类型
-ALLOWED_TYPES = {
+# 客户端直传允许的文件类型
+DIRECT_UPLOAD_TYPES = {
     "image/jpeg": ".jpg",
-    "image/jpg": ".jpg",
     "image/png": ".png",
     "image/webp": ".webp",
 }
 
-# 最大文件大小（10MB）
-MAX_FILE_SIZE = 10 * 1024 * 1024
+# 最大文件大小（默认 10MB）
+MAX_FILE_SIZE = settings.MAX_UPLOAD_SIZE
+
+# 分块读取大小
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# 解析图片尺寸时最多缓存的文件头字节数（超过后不再尝试解析）
+HEADER_PROBE_LIMIT = 512 * 1024
+
+
+def _size_limit_error() -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail=f"文件大小超过限制（最大 {MAX_FILE_SIZE // (1024 * 1024)}MB）"
+    )
 
 
 @router.post("/upload", response_model=UploadImageResponse)
@@ -32,44 +49,67 @@ async def upload_image(
     """
     上传图片
     
+    分块写入存储，累计大小超过限制时立即中止；
+    文件格式按首个数据块的魔数识别，尺寸从文件头解析（不解码像素）。
+    
     Args:
         file: 上传的文件
         purpose: 用途（source: 原图, reference: 参考图）
-        
+    
     Returns:
         UploadImageResponse: 上传结果
     """
-    # 1. 验证文件类型
-    if file.content_type not in ALLOWED_TYPES:
-        raise HTTPException(
-            status_code=400,
-            detail=f"不支持的文件格式。支持的格式: JPG, PNG, WEBP"
-        )
+    # 1. 已知大小时提前拒绝
+    if file.size is not None and file.size > MAX_FILE_SIZE:
+        raise _size_limit_error()
     
-    # 2. 读取文件数据
-    file_data = await file.read()
-    file_size = len(file_data)
-    
-    # 3. 验证文件大小
-    if file_size > MAX_FILE_SIZE:
+    # 2. 读取首个数据块，按魔数识别文件类型（不信任 Content-Type）
+    first_chunk = await file.read(UPLOAD_CHUNK_SIZE)
+    image_format = sniff_image_format(first_chunk)
+    if image_format is None:
         raise HTTPException(
             status_code=400,
-            detail=f"文件大小超过限制（最大 10MB）"
+            detail=f"不支持的文件格式。支持的格式: JPG, PNG, WEBP"
         )
     
-    # 4. 生成文件名
+    # 3. 生成文件名（扩展名以实际格式为准）
     file_id = generate_file_id()
-    file_extension = ALLOWED_TYPES[file.content_type]
+    file_extension = WEB_IMAGE_FORMATS[image_format]
     new_filename = f"{file_id}{file_extension}"
     
-    # 5. 根据用途确定子目录
+    # 4. 根据用途确定子目录
     subdirectory = purpose if purpose in ["source", "reference"] else "other"
     
+    # 5. 分块读取：累计大小检查 + 文件头尺寸解析 + 内容哈希
+    header = {"data": bytearray(), "info": None}
+    digest = hashlib.sha256()
+    
+    async def iter_chunks():
+        size = 0
+        chunk = first_chunk
+        while chunk:
+            size += len(chunk)
+            if size > MAX_FILE_SIZE:
+                raise _size_limit_error()
+            
+            if header["info"] is None and len(header["data"]) < HEADER_PROBE_LIMIT:
+                header["data"].extend(chunk)
+                header["info"] = probe_image_header(bytes(header["data"]))
+                if header["info"]:
+                    header["data"] = bytearray()
+            
+            digest.update(chunk)
+            yield chunk
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        
+        if header["info"] is None and len(header["data"]) < HEADER_PROBE_LIMIT:
+            raise HTTPException(status_code=400, detail="无法解析图片文件头，文件可能已损坏")
+    
     # 6. 保存文件
     try:
-        storage = get_local_storage()
-        relative_path = await storage.save_file(
-            file_data=file_data,
+        storage = get_storage()
+        relative_path, file_size = await storage.save_stream(
+            iter_chunks(),
             filename=new_filename,
             subdirectory=subdirectory
         )
@@ -77,15 +117,34 @@ async def upload_image(
         # 7. 获取访问 URL
         file_url = storage.get_url(relative_path)
         
-        # 8. 返回响应
+        # 8. 记录文件索引（解析 file_id 时直接查询，无需扫描目录）
+        _, width, height = header["info"] or (image_format, None, None)
+        await run_in_threadpool(
+            get_file_index().record,
+            file_id,
+            relative_path,
+            size=file_size,
+            width=width,
+            height=height,
+            image_format=image_format.lower(),
+            sha256=digest.hexdigest(),
+            purpose=subdirectory
+        )
+        
+        # 9. 返回响应
         return UploadImageResponse(
             file_id=file_id,
             filename=file.filename or new_filename,
             size=file_size,
             url=file_url,
-            uploaded_at=datetime.now().isoformat()
+            uploaded_at=datetime.now().isoformat(),
+            width=width,
+            height=height,
+            format=image_format.lower()
         )
-        
+    
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"文件保存失败: {e}")
         raise HTTPException(
@@ -93,3 +152,102 @@ async def upload_image(
             detail=f"文件保存失败: {str(e)}"
         )
 
+
+@router.post("/upload/presign", response_model=PresignedUploadResponse)
+async def presign_upload(
+    content_type: str = Form(...),
+    size: int = Form(..., gt=0),
+    purpose: str = Form(default="source"),
+    current_user_id: str = Depends(get_current_user_id)
+):
+    """
+    获取客户端直传表单（仅对象存储，需要登录）
+    
+    客户端把返回的 fields 与文件（file 字段放在最后）以 multipart/form-data POST 到 upload_url，
+    上传的字节不经过 API 进程；大小范围与 Content-Type 写在签名策略中，由对象存储强制。
+    上传完成后调用 POST /upload/presign/{file_id}/complete（或直接创建任务）校验文件内容，
+    校验通过前 file_id 不能用于任务。
+    
+    Args:
+        content_type: 文件类型（image/jpeg、image/png、image/webp）
+        size: 文件大小（字节，用于提前检查大小限制）
+        purpose: 用途（source: 原图, reference: 参考图）
+        current_user_id: 当前用户ID（从 token 获取）
+        
+    Returns:
+        PresignedUploadResponse: 直传信息
+    """
+    if content_type not in DIRECT_UPLOAD_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的文件格式。支持的格式: JPG, PNG, WEBP"
+        )
+    if size > MAX_FILE_SIZE:
+        raise _size_limit_error()
+    
+    file_id = generate_file_id()
+    new_filename = f"{file_id}{DIRECT_UPLOAD_TYPES[content_type]}"
+    subdirectory = purpose if purpose in ["source", "reference"] else "other"
+    
+    storage = get_storage()
+    try:
+        presigned = storage.generate_upload_url(
+            new_filename, subdirectory, content_type=content_type, max_size=MAX_FILE_SIZE
+        )
+    except NotImplementedError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # 记录待校验的文件索引（大小、尺寸在校验时按对象实际内容写入）
+    await run_in_threadpool(
+        get_file_index().record,
+        file_id,
+        presigned["path"],
+        purpose=subdirectory,
+        pending=True,
+        user_id=current_user_id
+    )
+    
+    return PresignedUploadResponse(
+        file_id=file_id,
+        upload_url=presigned["upload_url"],
+        method=presigned["method"],
+        fields=presigned["fields"],
+        expires_in=presigned["expires_in"],
+        url=storage.get_url(presigned["path"])
+    )
+
+
+@router.post("/upload/presign/{file_id}/complete", response_model=UploadImageResponse)
+async def complete_presigned_upload(
+    file_id: str,
+    current_user_id: str = Depends(get_current_user_id)
+):
+    """
+    确认客户端直传完成（需要登录）
+    
+    读取对象大小与文件头，按魔数识别格式并解析尺寸；不合法的对象会被删除。
+    
+    Args:
+        file_id: presign 返回的文件ID
+        current_user_id: 当前用户ID（从 token 获取）
+        
+    Returns:
+        UploadImageResponse: 校验后的文件信息
+    """
+    try:
+        info = await run_in_threadpool(verify_direct_upload, file_id, current_user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not info:
+        raise HTTPException(status_code=404, detail=f"文件不存在: {file_id}")
+    
+    return UploadImageResponse(
+        file_id=file_id,
+        filename=Path(info["path"]).name,
+        size=int(info.get("size") or 0),
+        url=get_storage().get_url(info["path"]),
+        uploaded_at=info.get("uploaded_at") or datetime.now().isoformat(),
+        width=int(info["width"]) if info.get("width") else None,
+        height=int(info["height"]) if info.get("height") else None,
+        format=info.get("format")
+    )
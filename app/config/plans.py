@@ -3,7 +3,7 @@
 套餐配置数据
 官方套餐列表（硬编码）
 """
-from typing import List
+from typing import Dict, List, Optional
 from app.schemas.plan import Plan
 
 
@@ -85,6 +85,18 @@ OFFICIAL_PLANS: List[Plan] = [
 ]
 
 
+# 套餐 → 任务队列优先级通道（需与 settings.TASK_QUEUE_LANE_WEIGHTS 中的通道名一致）
+PLAN_QUEUE_LANES: Dict[str, str] = {
+    "starter": "normal",
+    "basic": "normal",
+    "pro": "high",
+    "ultimate": "high",
+}
+
+# 免费用户（无套餐）使用的通道
+FREE_QUEUE_LANE = "low"
+
+
 def get_all_plans() -> List[Plan]:
     """
     获取所有套餐配置
@@ -123,3 +135,17 @@ def get_featured_plan() -> Plan | None:
             return plan
     return None
 
+
+def get_queue_lane(plan_id: Optional[str]) -> str:
+    """
+    根据套餐获取任务队列优先级通道
+    
+    Args:
+        plan_id: 套餐ID（免费用户为 None）
+        
+    Returns:
+        通道名称（high / normal / low）
+    """
+    if not plan_id:
+        return FREE_QUEUE_LANE
+    return PLAN_QUEUE_LANES.get(plan_id, FREE_QUEUE_LANE)
@@ -35,6 +35,11 @@ class Settings(BaseSettings):
     REDIS_PORT: int = 6379
     REDIS_DB: int = 0
     REDIS_PASSWORD: Optional[str] = None
+    # 进程内共享连接池：同步（Worker / 后台线程）与异步（API 请求处理，应用启动时创建）各一个
+    REDIS_MAX_CONNECTIONS: int = 50  # 同步连接池最大连接数
+    REDIS_ASYNC_MAX_CONNECTIONS: int = 50  # 异步连接池最大连接数
+    REDIS_POOL_TIMEOUT: float = 5  # 连接数达到上限时等待空闲连接的时间（秒，超时抛出 ConnectionError）
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30  # 连接空闲超过该时间后，使用前先 PING 检查（秒，0 表示不检查）
     
     @property
     def get_redis_url(self) -> str:
@@ -72,18 +77,82 @@ class Settings(BaseSettings):
     RESULT_DIR: str = "./results"
     MAX_UPLOAD_SIZE: int = 10 * 1024 * 1024  # 10MB
     ALLOWED_EXTENSIONS: set = {".jpg", ".jpeg", ".png", ".webp"}
+    UPLOAD_SHARD_DEPTH: int = 2  # 上传目录分片层数（source/ab/cd/file_xxx.jpg；0 表示平铺）
+    FILE_INDEX_CACHE_SIZE: int = 10000  # file_id -> 路径 进程内 LRU 容量（索引存于 Redis）
+    FILE_INDEX_MISS_TTL: float = 30.0  # 未找到的 file_id 在进程内缓存的时间（秒；0 表示不缓存）
     
-    # 阿里云 OSS 配置（当 STORAGE_TYPE=oss 时使用）
+    # 结果衍生图（一次解码生成）：thumbnail（缩略图）/ comparison（对比图）/ preview（WebP 预览图），原图总是保留
+    RESULT_RENDITIONS: str = "thumbnail,comparison,preview"
+    THUMBNAIL_SIZE: int = 256  # 缩略图最长边（像素）
+    PREVIEW_MAX_SIZE: int = 1024  # 预览图最长边（像素）
+    PREVIEW_QUALITY: int = 80  # 预览图 WebP 质量
+    COMPARISON_MAX_HEIGHT: int = 1536  # 对比图最大高度（像素）
+    
+    # 按需缩放接口（GET /api/v1/images/{id}?w=&fmt=）
+    IMAGE_VARIANT_WIDTHS: str = "256,512,768,1024,1536"  # 允许的宽度（请求宽度向上取到最近的允许值）
+    IMAGE_VARIANT_QUALITY: int = 82  # WebP/JPEG 质量
+    IMAGE_VARIANT_CACHE_DIR: str = "./cache/variants"
+    IMAGE_VARIANT_CACHE_MAX_MB: int = 512  # 磁盘缓存上限（超出时按最近最少使用淘汰）
+    IMAGE_VARIANT_MAX_AGE: int = 86400  # Cache-Control max-age（秒）
+    
+    # 对象存储配置（当 STORAGE_TYPE=oss / s3 时使用，S3 兼容协议：阿里云 OSS / AWS S3 / MinIO）
     OSS_ENDPOINT: Optional[str] = None
     OSS_ACCESS_KEY_ID: Optional[str] = None
     OSS_ACCESS_KEY_SECRET: Optional[str] = None
     OSS_BUCKET_NAME: Optional[str] = None
     OSS_BUCKET_DOMAIN: Optional[str] = None  # 自定义域名（可选）
+    OSS_REGION: Optional[str] = None  # 区域（S3 / MinIO 需要，OSS 可留空）
+    OSS_ADDRESSING_STYLE: Optional[str] = None  # virtual / path（默认 oss 为 virtual，s3 为 path，MinIO 需 path）
+    STORAGE_PRESIGN_EXPIRES: int = 3600  # 预签名 URL 有效期（秒）
+    STORAGE_MULTIPART_CHUNK_SIZE: int = 8 * 1024 * 1024  # 分片上传的分片大小（不小于 5MB）
     
     # ==================== 任务配置 ====================
-    TASK_RETENTION_DAYS: int = 7
-    MAX_CONCURRENT_TASKS_PER_USER: int = 3
+    # 保留期清理：结束超过保留天数的任务归档为 gzip JSONL 并删除 Redis 数据、结果图与上传文件
+    TASK_RETENTION_DAYS: int = 7  # 结束任务保留天数（0 表示永久保留）
+    TASK_ARCHIVE_DIR: str = "./archive/tasks"  # 任务记录归档目录（tasks-YYYYMMDD.jsonl.gz）
+    TASK_CLEANUP_INTERVAL: int = 3600  # Worker 内清理间隔（秒；0 表示不在 Worker 内运行，改由定时任务执行）
+    TASK_CLEANUP_BATCH_SIZE: int = 100  # 每批清理的任务数
+    TASK_CLEANUP_BATCH_PAUSE: float = 0.5  # 批次之间暂停时间（秒，限制删除文件的磁盘压力）
+    MAX_CONCURRENT_TASKS_PER_USER: int = 3  # 每用户同时处理的任务上限（出队时强制，超限任务暂缓排队；0 表示不限制）
     TASK_QUEUE_NAME: str = "formy:tasks"
+    TASK_PROGRESS_MIN_INTERVAL: float = 1.0  # 同一任务进度写入的最小间隔（秒，期间的更新合并为最新一次；0 表示每次直接写入）
+    TASK_EVENTS_KEEPALIVE: int = 15  # 任务事件流（SSE / WebSocket）无事件时的保活间隔（秒）
+    
+    # 可靠出队：LMOVE 到 Worker 私有处理列表 + 任务租约（需要 Redis >= 6.2）
+    TASK_RELIABLE_QUEUE: bool = True
+    TASK_LEASE_SECONDS: int = 60  # 任务租约时长（秒），Worker 每 1/3 租约时长续租一次
+    TASK_MAX_RETRIES: int = 3  # 租约过期后最多重新排队次数，超过则标记失败并退款
+    TASK_REAPER_INTERVAL: int = 30  # 孤儿任务回收间隔（秒）
+    
+    # 优先级通道及出队权重（"通道:权重"，逗号分隔）
+    # 通道由用户套餐决定（见 app/config/plans.py），Worker 按权重随机决定通道顺序，低优先级通道不会饿死
+    TASK_QUEUE_LANE_WEIGHTS: str = "high:6,normal:3,low:1"
+    TASK_QUEUE_DEFAULT_LANE: str = "normal"
+    TASK_WAIT_SAMPLES: int = 1000  # 每个通道保留的排队耗时样本数（用于统计分位数）
+    
+    # Worker 并发槽位数：单个 Worker 进程同时处理的任务数（共享 Redis 连接池与 Engine 注册表）
+    WORKER_CONCURRENCY: int = 1
+    
+    @property
+    def get_task_queue_lanes(self) -> dict:
+        """解析优先级通道权重配置"""
+        lanes = {}
+        for item in self.TASK_QUEUE_LANE_WEIGHTS.split(","):
+            if not item.strip():
+                continue
+            name, _, weight = item.partition(":")
+            lanes[name.strip()] = max(1, int(weight or 1))
+        return lanes
+    
+    @property
+    def get_result_renditions(self) -> list:
+        """解析结果衍生图配置"""
+        return [item.strip() for item in self.RESULT_RENDITIONS.split(",") if item.strip()]
+    
+    @property
+    def get_image_variant_widths(self) -> list:
+        """解析按需缩放允许的宽度（升序）"""
+        return sorted({int(item) for item in self.IMAGE_VARIANT_WIDTHS.split(",") if item.strip()})
     
     # ==================== JWT 认证配置 ====================
     # 支持 JWT_SECRET 和 SECRET_KEY（向后兼容）
@@ -92,6 +161,11 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24  # 24 小时
     
+    # 鉴权缓存：进程内缓存 JWT 声明与用户对象，用户数据写入时经 Redis Pub/Sub 通知各节点失效
+    AUTH_CACHE_SIZE: int = 10000  # 每类缓存的最大条目数
+    AUTH_CLAIMS_CACHE_TTL: int = 300  # JWT 声明缓存时间（秒，不超过令牌过期时间）
+    AUTH_USER_CACHE_TTL: int = 60  # 用户对象缓存时间（秒，失效通知丢失时的兜底）
+    
     @property
     def get_jwt_secret(self) -> str:
         """获取 JWT 密钥（优先使用 JWT_SECRET，否则使用 SECRET_KEY）"""
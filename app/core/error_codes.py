@@ -18,6 +18,7 @@ class TaskErrorCode(str, Enum):
     TASK_DATA_NOT_FOUND = "TASK_DATA_NOT_FOUND"
     TASK_ALREADY_PROCESSING = "TASK_ALREADY_PROCESSING"
     TASK_CANCELLED = "TASK_CANCELLED"
+    TASK_RETRY_EXHAUSTED = "TASK_RETRY_EXHAUSTED"
     
     # ==================== 参数验证错误 (3xxx) ====================
     INVALID_MODE = "INVALID_MODE"
@@ -81,6 +82,7 @@ class ErrorMessage:
         TaskErrorCode.TASK_DATA_NOT_FOUND: "任务数据不存在",
         TaskErrorCode.TASK_ALREADY_PROCESSING: "任务正在处理中",
         TaskErrorCode.TASK_CANCELLED: "任务已取消",
+        TaskErrorCode.TASK_RETRY_EXHAUSTED: "任务处理多次中断，已停止重试",
         
         # 参数验证错误
         TaskErrorCode.INVALID_MODE: "编辑模式无效",
@@ -140,6 +142,7 @@ class ErrorMessage:
         TaskErrorCode.NO_FACE_DETECTED: "请确保图片中包含清晰可见的人脸",
         TaskErrorCode.MULTIPLE_FACES_DETECTED: "请上传只包含单个人脸的图片",
         TaskErrorCode.INSUFFICIENT_CREDITS: "请充值算力或升级套餐",
+        TaskErrorCode.TASK_RETRY_EXHAUSTED: "算力已退还，请稍后重新提交任务",
     }
     
     @classmethod
@@ -1,19 +1,35 @@
 """
 FastAPI 应用入口
 """
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 
 from app.core.config import settings
-from app.api.v1 import routes_upload, routes_tasks, routes_auth, routes_plans, routes_billing
+from app.services.storage.local_storage import ShardedStaticFiles
+from app.services.tasks.events import get_task_event_hub
+from app.utils.redis_client import init_async_redis, close_async_redis, get_redis_pool_metrics
+from app.api.v1 import routes_upload, routes_tasks, routes_auth, routes_plans, routes_billing, routes_images
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建异步 Redis 连接池，关闭时释放连接"""
+    init_async_redis()
+    yield
+    await get_task_event_hub().close()
+    await close_async_redis()
+
 
 # 创建 FastAPI 应用
 app = FastAPI(
     title=settings.APP_NAME,
     version=settings.APP_VERSION,
-    debug=settings.DEBUG
+    debug=settings.DEBUG,
+    lifespan=lifespan
 )
 
 # 配置 CORS
@@ -37,8 +53,8 @@ app.add_middleware(
 Path(settings.UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
 Path(settings.RESULT_DIR).mkdir(parents=True, exist_ok=True)
 
-# 挂载静态文件服务（用于访问上传的图片）
-app.mount("/uploads", StaticFiles(directory=settings.UPLOAD_DIR), name="uploads")
+# 挂载静态文件服务（用于访问上传的图片；旧的平铺路径自动映射到分片目录）
+app.mount("/uploads", ShardedStaticFiles(directory=settings.UPLOAD_DIR), name="uploads")
 app.mount("/results", StaticFiles(directory=settings.RESULT_DIR), name="results")
 
 # 注册 API 路由
@@ -47,6 +63,7 @@ app.include_router(routes_tasks.router, prefix=settings.API_V1_PREFIX, tags=["ta
 app.include_router(routes_auth.router, prefix=settings.API_V1_PREFIX, tags=["auth"])
 app.include_router(routes_plans.router, prefix=settings.API_V1_PREFIX, tags=["plans"])
 app.include_router(routes_billing.router, prefix=settings.API_V1_PREFIX, tags=["billing"])
+app.include_router(routes_images.router, prefix=settings.API_V1_PREFIX, tags=["images"])
 
 
 @app.get("/")
@@ -65,6 +82,12 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/health/redis")
+async def redis_pool_health():
+    """Redis 连接池统计（本进程的使用中 / 空闲连接数与等待次数，用于评估 Redis 连接数上限）"""
+    return {"pools": get_redis_pool_metrics()}
+
+
 if __name__ == "__main__":
     import uvicorn
     import os
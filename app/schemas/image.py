@@ -3,7 +3,7 @@
 """
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import Dict, Optional
 
 
 class UploadImageResponse(BaseModel):
@@ -13,6 +13,9 @@ class UploadImageResponse(BaseModel):
     size: int = Field(..., description="文件大小（字节）")
     url: str = Field(..., description="访问URL")
     uploaded_at: str = Field(..., description="上传时间")
+    width: Optional[int] = Field(None, description="图片宽度（像素）")
+    height: Optional[int] = Field(None, description="图片高度（像素）")
+    format: Optional[str] = Field(None, description="图片格式（按文件头识别）")
 
     class Config:
         json_encoders = {
@@ -20,6 +23,16 @@ class UploadImageResponse(BaseModel):
         }
 
 
+class PresignedUploadResponse(BaseModel):
+    """客户端直传响应（对象存储）"""
+    file_id: str = Field(..., description="文件ID")
+    upload_url: str = Field(..., description="预签名上传URL")
+    method: str = Field("POST", description="上传请求方法")
+    fields: Dict[str, str] = Field(default_factory=dict, description="POST 表单字段（放在 file 字段之前）")
+    expires_in: int = Field(..., description="上传URL有效期（秒）")
+    url: str = Field(..., description="上传完成后的访问URL")
+
+
 class ImageInfo(BaseModel):
     """图片信息"""
     file_id: str
@@ -14,8 +14,9 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from app.core.config import settings
 from app.models.user import User, VerificationCode
+from app.services.auth.user_cache import get_user_cache
 from app.utils.id_generator import generate_user_id
-from app.utils.redis_client import get_redis_client
+from app.utils.redis_client import get_redis_client, get_async_redis_client
 
 
 class AuthService:
@@ -71,23 +72,26 @@ class AuthService:
             bool: 是否保存成功
         """
         try:
-            key = f"verification_code:{email}"
-            data = {
-                "code": code,
-                "created_at": datetime.now().isoformat(),
-                "is_used": False
-            }
             # 设置 10 分钟过期
             self.redis_client.setex(
-                key,
+                f"verification_code:{email}",
                 self.code_expiry,
-                json.dumps(data)
+                self._new_code_data(code)
             )
             return True
         except Exception as e:
             print(f"保存验证码失败: {e}")
             return False
     
+    @staticmethod
+    def _new_code_data(code: str) -> str:
+        """序列化新验证码"""
+        return json.dumps({
+            "code": code,
+            "created_at": datetime.now().isoformat(),
+            "is_used": False
+        })
+    
     def verify_code(self, email: str, code: str) -> bool:
         """
         验证验证码
@@ -101,36 +105,43 @@ class AuthService:
         """
         try:
             key = f"verification_code:{email}"
-            data_str = self.redis_client.get(key)
-            
-            if not data_str:
-                print(f"验证码不存在或已过期: {email}")
-                return False
-            
-            data = json.loads(data_str)
-            
-            if data.get("is_used"):
-                print(f"验证码已使用: {email}")
-                return False
-            
-            if data.get("code") != code:
-                print(f"验证码错误: {email}")
+            used_data = self._use_code(email, self.redis_client.get(key), code)
+            if used_data is None:
                 return False
             
             # 标记为已使用
-            data["is_used"] = True
-            self.redis_client.setex(
-                key,
-                self.code_expiry,
-                json.dumps(data)
-            )
-            
+            self.redis_client.setex(key, self.code_expiry, used_data)
             return True
             
         except Exception as e:
             print(f"验证验证码失败: {e}")
             return False
     
+    @staticmethod
+    def _use_code(email: str, data_str: Optional[str], code: str) -> Optional[str]:
+        """
+        校验验证码
+        
+        Returns:
+            Optional[str]: 校验通过时返回标记为已使用的验证码数据，否则返回 None
+        """
+        if not data_str:
+            print(f"验证码不存在或已过期: {email}")
+            return None
+        
+        data = json.loads(data_str)
+        
+        if data.get("is_used"):
+            print(f"验证码已使用: {email}")
+            return None
+        
+        if data.get("code") != code:
+            print(f"验证码错误: {email}")
+            return None
+        
+        data["is_used"] = True
+        return json.dumps(data)
+    
     def get_or_create_user(self, email: str) -> User:
         """
         获取或创建用户
@@ -144,26 +155,7 @@ class AuthService:
         try:
             # 尝试从 Redis 获取用户
             user_key = f"user:email:{email}"
-            user_data_str = self.redis_client.get(user_key)
-            
-            if user_data_str:
-                user_data = json.loads(user_data_str)
-                user = User(**user_data)
-                # 更新最后登录时间
-                user.last_login = datetime.now()
-            else:
-                # 创建新用户，分配免费算力
-                user = User(
-                    user_id=generate_user_id(),
-                    email=email,
-                    username=email.split('@')[0],
-                    created_at=datetime.now(),
-                    last_login=datetime.now(),
-                    # 新用户默认赠送 100 免费算力（约 2-3 次换姿势）
-                    current_plan_id=None,  # 免费用户没有套餐
-                    current_credits=100,  # 赠送 100 算力
-                    plan_renew_at=None
-                )
+            user = self._login_user(email, self.redis_client.get(user_key))
             
             # 保存用户信息
             self.save_user(user)
@@ -174,6 +166,29 @@ class AuthService:
             print(f"获取或创建用户失败: {e}")
             raise
     
+    @staticmethod
+    def _login_user(email: str, user_data_str: Optional[str]) -> User:
+        """已有用户更新最后登录时间，否则创建新用户"""
+        if user_data_str:
+            user_data = json.loads(user_data_str)
+            user = User(**user_data)
+            # 更新最后登录时间
+            user.last_login = datetime.now()
+            return user
+        
+        # 创建新用户，分配免费算力
+        return User(
+            user_id=generate_user_id(),
+            email=email,
+            username=email.split('@')[0],
+            created_at=datetime.now(),
+            last_login=datetime.now(),
+            # 新用户默认赠送 100 免费算力（约 2-3 次换姿势）
+            current_plan_id=None,  # 免费用户没有套餐
+            current_credits=100,  # 赠送 100 算力
+            plan_renew_at=None
+        )
+    
     def save_user(self, user: User) -> bool:
         """
         保存用户信息到 Redis
@@ -190,12 +205,13 @@ class AuthService:
             # 按 ID 索引
             user_id_key = f"user:id:{user.user_id}"
             
-            user_data = user.model_dump(mode='json')
-            user_data_str = json.dumps(user_data, default=str)
+            user_data_str = self._dump_user(user)
+            
+            # 保存用户数据（不过期，两个键一次写入）
+            self.redis_client.mset({user_key: user_data_str, user_id_key: user_data_str})
             
-            # 保存用户数据（不过期）
-            self.redis_client.set(user_key, user_data_str)
-            self.redis_client.set(user_id_key, user_data_str)
+            # 通知所有节点失效该用户的缓存
+            get_user_cache().invalidate(user.user_id)
             
             return True
             
@@ -203,9 +219,14 @@ class AuthService:
             print(f"保存用户失败: {e}")
             return False
     
+    @staticmethod
+    def _dump_user(user: User) -> str:
+        """序列化用户对象"""
+        return json.dumps(user.model_dump(mode='json'), default=str)
+    
     def get_user_by_id(self, user_id: str) -> Optional[User]:
         """
-        根据 ID 获取用户
+        根据 ID 获取用户（优先读取进程内缓存，用户数据写入时经 Pub/Sub 失效）
         
         Args:
             user_id: 用户 ID
@@ -213,7 +234,13 @@ class AuthService:
         Returns:
             Optional[User]: 用户对象
         """
+        user_cache = get_user_cache()
+        user = user_cache.get_user(user_id)
+        if user is not None:
+            return user
+        
         try:
+            generation = user_cache.generation
             user_id_key = f"user:id:{user_id}"
             user_data_str = self.redis_client.get(user_id_key)
             
@@ -221,7 +248,88 @@ class AuthService:
                 return None
             
             user_data = json.loads(user_data_str)
-            return User(**user_data)
+            user = User(**user_data)
+            user_cache.put_user(user, generation)
+            return user
+            
+        except Exception as e:
+            print(f"获取用户失败: {e}")
+            return None
+    
+    # ==================== 异步接口（API 请求处理使用） ====================
+    
+    async def save_verification_code_async(self, email: str, code: str) -> bool:
+        """保存验证码到 Redis（异步版本）"""
+        try:
+            await get_async_redis_client().setex(
+                f"verification_code:{email}",
+                self.code_expiry,
+                self._new_code_data(code)
+            )
+            return True
+        except Exception as e:
+            print(f"保存验证码失败: {e}")
+            return False
+    
+    async def verify_code_async(self, email: str, code: str) -> bool:
+        """验证验证码（异步版本）"""
+        try:
+            redis_client = get_async_redis_client()
+            key = f"verification_code:{email}"
+            used_data = self._use_code(email, await redis_client.get(key), code)
+            if used_data is None:
+                return False
+            
+            await redis_client.setex(key, self.code_expiry, used_data)
+            return True
+            
+        except Exception as e:
+            print(f"验证验证码失败: {e}")
+            return False
+    
+    async def get_or_create_user_async(self, email: str) -> User:
+        """获取或创建用户（异步版本）"""
+        try:
+            user_data_str = await get_async_redis_client().get(f"user:email:{email}")
+            user = self._login_user(email, user_data_str)
+            await self.save_user_async(user)
+            return user
+            
+        except Exception as e:
+            print(f"获取或创建用户失败: {e}")
+            raise
+    
+    async def save_user_async(self, user: User) -> bool:
+        """保存用户信息到 Redis（异步版本）"""
+        try:
+            user_data_str = self._dump_user(user)
+            await get_async_redis_client().mset({
+                f"user:email:{user.email}": user_data_str,
+                f"user:id:{user.user_id}": user_data_str
+            })
+            await get_user_cache().invalidate_async(user.user_id)
+            return True
+            
+        except Exception as e:
+            print(f"保存用户失败: {e}")
+            return False
+    
+    async def get_user_by_id_async(self, user_id: str) -> Optional[User]:
+        """根据 ID 获取用户（异步版本，优先读取进程内缓存）"""
+        user_cache = get_user_cache()
+        user = user_cache.get_user(user_id)
+        if user is not None:
+            return user
+        
+        try:
+            generation = user_cache.generation
+            user_data_str = await get_async_redis_client().get(f"user:id:{user_id}")
+            if not user_data_str:
+                return None
+            
+            user = User(**json.loads(user_data_str))
+            user_cache.put_user(user, generation)
+            return user
             
         except Exception as e:
             print(f"获取用户失败: {e}")
@@ -256,7 +364,7 @@ class AuthService:
     
     def decode_access_token(self, token: str) -> Optional[Dict]:
         """
-        解码访问令牌
+        解码访问令牌（验证通过的声明在进程内缓存，缓存时间不超过令牌的过期时间）
         
         Args:
             token: JWT 令牌
@@ -264,12 +372,18 @@ class AuthService:
         Returns:
             Optional[Dict]: 解码后的数据
         """
+        user_cache = get_user_cache()
+        payload = user_cache.get_claims(token)
+        if payload is not None:
+            return payload
+        
         try:
             payload = jwt.decode(
                 token,
                 self.jwt_secret,
                 algorithms=[self.jwt_algorithm]
             )
+            user_cache.put_claims(token, payload)
             return payload
         except JWTError as e:
             print(f"JWT 解码失败: {e}")
@@ -0,0 +1,227 @@
+"""
+认证缓存
+进程内缓存已验证的 JWT 声明与用户对象（TTL + LRU），鉴权热路径（前端轮询任务状态）无需访问 Redis；
+用户数据写入（save_user、算力变动）后通过 Redis Pub/Sub 通知所有 API 节点失效对应用户
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.models.user import User
+from app.utils.redis_client import get_redis_client, get_async_redis_client
+
+
+class UserCache:
+    """JWT 声明 + 用户对象缓存"""
+    
+    CHANNEL = "formy:user:invalidate"  # 用户失效通知频道（消息内容为 user_id）
+    
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        claims_ttl: Optional[int] = None,
+        user_ttl: Optional[int] = None
+    ):
+        """
+        初始化缓存（参数缺省时读取配置）
+        
+        Args:
+            max_size: 每类缓存的最大条目数
+            claims_ttl: JWT 声明缓存时间（秒，不超过令牌自身的过期时间）
+            user_ttl: 用户对象缓存时间（秒，失效通知丢失时的兜底）
+        """
+        self.max_size = max_size or settings.AUTH_CACHE_SIZE
+        self.claims_ttl = settings.AUTH_CLAIMS_CACHE_TTL if claims_ttl is None else claims_ttl
+        self.user_ttl = settings.AUTH_USER_CACHE_TTL if user_ttl is None else user_ttl
+        
+        self._claims: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()  # token -> (声明, 过期时间)
+        self._users: "OrderedDict[str, Tuple[User, float]]" = OrderedDict()  # user_id -> (用户, 过期时间)
+        self._lock = threading.Lock()
+        
+        # 每次失效递增：加载期间发生失效的用户对象不写入缓存
+        self._generation = 0
+        
+        # 只有订阅成功后才缓存用户对象（订阅中断期间会错过失效通知）
+        self._subscribed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._redis = None
+    
+    @property
+    def redis_client(self):
+        """懒加载 Redis 客户端"""
+        if self._redis is None:
+            self._redis = get_redis_client()
+        return self._redis
+    
+    @staticmethod
+    def _get(cache: OrderedDict, key: str) -> Optional[Any]:
+        """读取未过期的条目（调用方持有锁）"""
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.time():
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return value
+    
+    def _put(self, cache: OrderedDict, key: str, value: Any, expires_at: float):
+        """写入条目并按 LRU 淘汰（调用方持有锁）"""
+        cache[key] = (value, expires_at)
+        cache.move_to_end(key)
+        while len(cache) > self.max_size:
+            cache.popitem(last=False)
+    
+    # ==================== JWT 声明 ====================
+    
+    def get_claims(self, token: str) -> Optional[Dict[str, Any]]:
+        """
+        获取已验证的令牌声明
+        
+        Args:
+            token: JWT 令牌
+        
+        Returns:
+            Optional[Dict]: 声明，未缓存或已过期返回 None
+        """
+        with self._lock:
+            return self._get(self._claims, token)
+    
+    def put_claims(self, token: str, claims: Dict[str, Any]):
+        """
+        缓存已验证的令牌声明（缓存时间不超过令牌的 exp）
+        
+        Args:
+            token: JWT 令牌
+            claims: 解码后的声明
+        """
+        expires_at = time.time() + self.claims_ttl
+        if claims.get("exp"):
+            expires_at = min(expires_at, float(claims["exp"]))
+        with self._lock:
+            self._put(self._claims, token, claims, expires_at)
+    
+    # ==================== 用户对象 ====================
+    
+    @property
+    def generation(self) -> int:
+        """当前失效代数（加载用户前读取，写入缓存时传回）"""
+        return self._generation
+    
+    def get_user(self, user_id: str) -> Optional[User]:
+        """
+        获取缓存的用户对象
+        
+        Args:
+            user_id: 用户ID
+        
+        Returns:
+            Optional[User]: 用户对象，未缓存或已过期返回 None
+        """
+        self.start()
+        with self._lock:
+            return self._get(self._users, user_id)
+    
+    def put_user(self, user: User, generation: int):
+        """
+        缓存用户对象
+        
+        Args:
+            user: 用户对象
+            generation: 开始加载前读取的失效代数（加载期间发生过失效则不缓存）
+        """
+        if not self._subscribed.is_set():
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._put(self._users, user.user_id, user, time.time() + self.user_ttl)
+    
+    def invalidate(self, user_id: str, publish: bool = True):
+        """
+        失效用户缓存
+        
+        Args:
+            user_id: 用户ID
+            publish: 是否通知其他节点（已在 Lua 脚本中发布通知时传 False）
+        """
+        self._drop_user(user_id)
+        if publish:
+            try:
+                self.redis_client.publish(self.CHANNEL, user_id)
+            except Exception as e:
+                print(f"[UserCache] 发布失效通知失败: {user_id}: {e}")
+    
+    async def invalidate_async(self, user_id: str):
+        """
+        失效用户缓存并通知其他节点（异步版本）
+        
+        Args:
+            user_id: 用户ID
+        """
+        self._drop_user(user_id)
+        try:
+            await get_async_redis_client().publish(self.CHANNEL, user_id)
+        except Exception as e:
+            print(f"[UserCache] 发布失效通知失败: {user_id}: {e}")
+    
+    def _drop_user(self, user_id: Optional[str]):
+        """本地删除用户缓存（user_id 为 None 时清空全部）"""
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_id, None)
+    
+    # ==================== 失效订阅 ====================
+    
+    def start(self):
+        """启动失效订阅线程（首次读取用户时自动启动）"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._listen, name="user-cache-invalidation", daemon=True)
+            self._thread.start()
+    
+    def _listen(self):
+        """订阅失效频道；连接中断时清空用户缓存并重连"""
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.CHANNEL)
+                self._subscribed.set()
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message["type"] == "message":
+                        self._drop_user(message["data"])
+            except Exception as e:
+                print(f"[UserCache] 失效订阅中断，1 秒后重连: {e}")
+            finally:
+                # 订阅中断期间可能错过通知，停止缓存并清空已缓存的用户
+                self._subscribed.clear()
+                self._drop_user(None)
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+            time.sleep(1)
+
+
+# 全局单例
+_user_cache_instance: Optional[UserCache] = None
+
+
+def get_user_cache() -> UserCache:
+    """获取认证缓存单例"""
+    global _user_cache_instance
+    if _user_cache_instance is None:
+        _user_cache_instance = UserCache()
+    return _user_cache_instance
@@ -6,26 +6,153 @@
 import redis
 import json
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 
 from app.core.config import settings
 from app.models.user import User
 from app.schemas.billing import UserBillingInfo, ChangePlanResponse
 from app.config.plans import get_plan_by_id
-from app.utils.redis_client import get_redis_client
+from app.services.auth.user_cache import UserCache, get_user_cache
+from app.utils.redis_client import get_redis_client, get_async_redis_client
 
 
 class BillingService:
     """计费服务"""
     
+    # 算力余额（Hash: balance / used），所有增减都在 Lua 脚本中原子完成，并在脚本内发布用户缓存失效通知；
+    # 用户 JSON 中的 current_credits / total_credits_used 仅作首次迁移来源，读取时以余额 Hash 为准
+    CREDITS_KEY_PREFIX = "user:credits:"
+    # 任务预扣记录（Hash: user_id / amount / state），按 task_id 幂等
+    RESERVATION_KEY_PREFIX = "billing:reservation:"
+    RESERVATION_TTL = 30 * 86400
+    
+    # 读取余额（Lua 片段）：余额 Hash 不存在时从用户 JSON 迁移，用户不存在返回 nil
+    _LOAD_BALANCE_LUA = """
+    local function load_balance(user_key, credits_key, user)
+        local balance = redis.call('HGET', credits_key, 'balance')
+        if balance then
+            return tonumber(balance)
+        end
+        if not user then
+            local user_json = redis.call('GET', user_key)
+            if not user_json then
+                return nil
+            end
+            user = cjson.decode(user_json)
+        end
+        balance = tonumber(user.current_credits) or 0
+        redis.call('HSET', credits_key, 'balance', balance, 'used', tonumber(user.total_credits_used) or 0)
+        return balance
+    end
+    """
+    
+    # 预扣算力
+    # KEYS: 用户键、余额键、预扣记录键（可选，缺省时直接扣除）
+    # ARGV: 用户ID、数量、预扣记录过期时间、失效通知频道
+    # 返回: {状态, 余额, 套餐ID}，状态 1=已预扣 2=该任务已预扣过 0=算力不足 -1=用户不存在
+    _RESERVE_SCRIPT = _LOAD_BALANCE_LUA + """
+    local user_json = redis.call('GET', KEYS[1])
+    if not user_json then
+        return {-1, 0, ''}
+    end
+    local user = cjson.decode(user_json)
+    local plan_id = user.current_plan_id
+    if type(plan_id) ~= 'string' then
+        plan_id = ''
+    end
+    
+    local balance = load_balance(KEYS[1], KEYS[2], user)
+    if KEYS[3] and redis.call('EXISTS', KEYS[3]) == 1 then
+        return {2, balance, plan_id}
+    end
+    
+    local amount = tonumber(ARGV[2])
+    if balance < amount then
+        return {0, balance, plan_id}
+    end
+    
+    redis.call('HINCRBY', KEYS[2], 'balance', -amount)
+    redis.call('HINCRBY', KEYS[2], 'used', amount)
+    if KEYS[3] then
+        redis.call('HSET', KEYS[3], 'user_id', ARGV[1], 'amount', amount, 'state', 'reserved')
+        redis.call('EXPIRE', KEYS[3], ARGV[3])
+    end
+    redis.call('PUBLISH', ARGV[4], ARGV[1])
+    return {1, balance - amount, plan_id}
+    """
+    
+    # 结算预扣（任务完成）：仅 reserved 状态可结算
+    # KEYS: 预扣记录键；返回 1=已结算 0=无需结算
+    _COMMIT_SCRIPT = """
+    if redis.call('HGET', KEYS[1], 'state') ~= 'reserved' then
+        return 0
+    end
+    redis.call('HSET', KEYS[1], 'state', 'committed')
+    return 1
+    """
+    
+    # 退还预扣（任务失败/创建失败）：仅 reserved 状态可退还，重复调用不会重复退款；
+    # 没有预扣记录的旧任务按 ARGV 中的数量退还并写入记录
+    # KEYS: 预扣记录键、用户键、余额键
+    # ARGV: 用户ID、数量、预扣记录过期时间、失效通知频道
+    # 返回: 1=已退还 0=已退还过或已结算 -1=用户不存在
+    _REFUND_SCRIPT = _LOAD_BALANCE_LUA + """
+    local state = redis.call('HGET', KEYS[1], 'state')
+    if state and state ~= 'reserved' then
+        return 0
+    end
+    if not load_balance(KEYS[2], KEYS[3]) then
+        return -1
+    end
+    
+    local amount = tonumber(redis.call('HGET', KEYS[1], 'amount') or ARGV[2])
+    redis.call('HINCRBY', KEYS[3], 'balance', amount)
+    redis.call('HINCRBY', KEYS[3], 'used', -amount)
+    redis.call('HSET', KEYS[1], 'user_id', ARGV[1], 'amount', amount, 'state', 'refunded')
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    redis.call('PUBLISH', ARGV[4], ARGV[1])
+    return 1
+    """
+    
+    # 调整余额（充值/赠送为 add，套餐切换/续费重置为 set）
+    # KEYS: 用户键、余额键；ARGV: add/set、数量、用户ID、失效通知频道
+    # 返回调整后余额，用户不存在返回 -1
+    _ADJUST_SCRIPT = _LOAD_BALANCE_LUA + """
+    if not load_balance(KEYS[1], KEYS[2]) then
+        return -1
+    end
+    local balance
+    if ARGV[1] == 'set' then
+        redis.call('HSET', KEYS[2], 'balance', ARGV[2])
+        balance = tonumber(ARGV[2])
+    else
+        balance = redis.call('HINCRBY', KEYS[2], 'balance', ARGV[2])
+    end
+    redis.call('PUBLISH', ARGV[4], ARGV[3])
+    return balance
+    """
+    
     def __init__(self):
         # 使用统一的 Redis 客户端（基于 REDIS_URL）
         self.redis_client = get_redis_client()
+        self._reserve_script = self.redis_client.register_script(self._RESERVE_SCRIPT)
+        self._commit_script = self.redis_client.register_script(self._COMMIT_SCRIPT)
+        self._refund_script = self.redis_client.register_script(self._REFUND_SCRIPT)
+        self._adjust_script = self.redis_client.register_script(self._ADJUST_SCRIPT)
+        self._async_scripts = {}
     
     def _get_user_key(self, user_id: str) -> str:
         """获取用户在 Redis 中的键"""
         return f"user:id:{user_id}"
     
+    def _get_credits_key(self, user_id: str) -> str:
+        """获取用户算力余额键"""
+        return f"{self.CREDITS_KEY_PREFIX}{user_id}"
+    
+    def _get_reservation_key(self, task_id: str) -> str:
+        """获取任务预扣记录键"""
+        return f"{self.RESERVATION_KEY_PREFIX}{task_id}"
+    
     def get_user(self, user_id: str) -> Optional[User]:
         """
         从 Redis 获取用户信息
@@ -36,13 +163,23 @@ class BillingService:
         Returns:
             用户对象，如果不存在则返回 None
         """
-        user_key = self._get_user_key(user_id)
-        user_data = self.redis_client.get(user_key)
-        
+        # 用户 JSON 与算力余额一次往返读取
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.get(self._get_user_key(user_id))
+        pipe.hmget(self._get_credits_key(user_id), "balance", "used")
+        user_data, (balance, used) = pipe.execute()
+        return self._parse_user(user_data, balance, used)
+    
+    @staticmethod
+    def _parse_user(user_data: Optional[str], balance: Optional[str], used: Optional[str]) -> Optional[User]:
+        """解析用户 JSON（以算力余额 Hash 覆盖 JSON 中的算力字段）"""
         if not user_data:
             return None
         
         user_dict = json.loads(user_data)
+        if balance is not None:
+            user_dict["current_credits"] = int(balance)
+            user_dict["total_credits_used"] = int(used or 0)
         # 转换日期时间字符串为 datetime 对象
         if user_dict.get("created_at"):
             user_dict["created_at"] = datetime.fromisoformat(user_dict["created_at"])
@@ -55,12 +192,21 @@ class BillingService:
     
     def save_user(self, user: User) -> None:
         """
-        保存用户信息到 Redis
+        保存用户信息到 Redis（按 ID / 邮箱两个键一次写入；算力余额不在此处修改）
         
         Args:
             user: 用户对象
         """
-        user_key = self._get_user_key(user.user_id)
+        user_data = self._dump_user(user)
+        self.redis_client.mset({
+            self._get_user_key(user.user_id): user_data,
+            f"user:email:{user.email}": user_data
+        })
+        get_user_cache().invalidate(user.user_id)
+    
+    @staticmethod
+    def _dump_user(user: User) -> str:
+        """序列化用户对象"""
         user_dict = user.model_dump()
         
         # 转换 datetime 对象为字符串
@@ -71,7 +217,7 @@ class BillingService:
         if user_dict.get("plan_renew_at"):
             user_dict["plan_renew_at"] = user_dict["plan_renew_at"].isoformat()
         
-        self.redis_client.set(user_key, json.dumps(user_dict))
+        return json.dumps(user_dict)
     
     def get_user_billing_info(self, user_id: str) -> Optional[UserBillingInfo]:
         """
@@ -83,7 +229,11 @@ class BillingService:
         Returns:
             用户计费信息，如果用户不存在则返回 None
         """
-        user = self.get_user(user_id)
+        return self._build_billing_info(self.get_user(user_id))
+    
+    @staticmethod
+    def _build_billing_info(user: Optional[User]) -> Optional[UserBillingInfo]:
+        """根据用户对象构建计费信息"""
         if not user:
             return None
         
@@ -130,24 +280,35 @@ class BillingService:
         Raises:
             ValueError: 如果套餐不存在或用户不存在
         """
-        # 获取用户
+        # 获取用户和新套餐
         user = self.get_user(user_id)
+        new_plan = self._check_plan_change(user_id, user, new_plan_id)
+        
+        # 更新用户套餐并重置算力
+        self._apply_plan(user, new_plan_id)
+        if reset_credits:
+            user.current_credits = self._adjust_balance(user_id, "set", new_plan.monthly_credits)
+        
+        # 保存用户
+        self.save_user(user)
+        return self._plan_changed_response(user, new_plan)
+    
+    @staticmethod
+    def _check_plan_change(user_id: str, user: Optional[User], new_plan_id: str):
+        """检查用户与新套餐是否存在，返回新套餐"""
         if not user:
             raise ValueError(f"用户 {user_id} 不存在")
         
-        # 获取新套餐
         new_plan = get_plan_by_id(new_plan_id)
         if not new_plan:
             raise ValueError(f"套餐 {new_plan_id} 不存在")
-        
-        # 更新用户套餐
+        return new_plan
+    
+    @staticmethod
+    def _apply_plan(user: User, new_plan_id: str):
+        """更新用户套餐，并设置下次续费时间（下个月 1 日）"""
         user.current_plan_id = new_plan_id
         
-        # 重置算力
-        if reset_credits:
-            user.current_credits = new_plan.monthly_credits
-        
-        # 设置下次续费时间（当前时间 + 1 个月）
         now = datetime.now()
         # 计算下个月的同一天
         if now.month == 12:
@@ -156,10 +317,11 @@ class BillingService:
             next_month = now.replace(month=now.month + 1, day=1, hour=0, minute=0, second=0, microsecond=0)
         
         user.plan_renew_at = next_month
-        
-        # 保存用户
-        self.save_user(user)
-        
+    
+    @staticmethod
+    def _plan_changed_response(user: User, new_plan) -> ChangePlanResponse:
+        """构建套餐切换结果"""
+        new_plan_id = user.current_plan_id
         return ChangePlanResponse(
             success=True,
             message=f"成功切换到 {new_plan.name} 套餐",
@@ -169,32 +331,88 @@ class BillingService:
             plan_renew_at=user.plan_renew_at
         )
     
-    def consume_credits(self, user_id: str, amount: int) -> bool:
+    def reserve_credits(
+        self,
+        user_id: str,
+        amount: int,
+        task_id: str
+    ) -> Tuple[str, int, Optional[str]]:
         """
-        消耗用户算力
+        为任务预扣算力（Lua 脚本一次往返完成余额检查与扣除，按 task_id 幂等）
         
         Args:
             user_id: 用户ID
-            amount: 消耗的算力数量
+            amount: 预扣的算力数量
+            task_id: 任务ID（幂等键，同一任务重复预扣不会重复扣除）
             
         Returns:
-            是否成功
+            Tuple[str, int, Optional[str]]: (状态, 余额, 当前套餐ID)
+                状态: reserved（已预扣）/ duplicate（该任务已预扣过）/ insufficient（算力不足）/ not_found（用户不存在）
         """
-        user = self.get_user(user_id)
-        if not user:
-            return False
+        status, balance, plan_id = self._reserve_script(
+            keys=[self._get_user_key(user_id), self._get_credits_key(user_id), self._get_reservation_key(task_id)],
+            args=[user_id, amount, self.RESERVATION_TTL, UserCache.CHANNEL]
+        )
+        return self._reserve_result(user_id, status, balance, plan_id)
+    
+    @staticmethod
+    def _reserve_result(user_id: str, status, balance, plan_id) -> Tuple[str, int, Optional[str]]:
+        """解析预扣脚本返回值"""
+        status_name = {1: "reserved", 2: "duplicate", 0: "insufficient", -1: "not_found"}[int(status)]
+        if status_name == "reserved":
+            get_user_cache().invalidate(user_id, publish=False)
+        return status_name, int(balance), plan_id or None
+    
+    def commit_credits(self, task_id: str) -> bool:
+        """
+        结算任务预扣的算力（任务完成后调用，之后不能再退还）
         
-        # 检查算力是否足够
-        if user.current_credits < amount:
-            return False
+        Args:
+            task_id: 任务ID
+            
+        Returns:
+            是否进行了结算（没有预扣记录或已结算/已退还时返回 False）
+        """
+        return bool(self._commit_script(keys=[self._get_reservation_key(task_id)]))
+    
+    def refund_credits(self, task_id: str, user_id: str, amount: int) -> bool:
+        """
+        退还任务预扣的算力（重复调用只退还一次）
         
-        # 扣除算力
-        user.current_credits -= amount
-        user.total_credits_used += amount
+        Args:
+            task_id: 任务ID
+            user_id: 用户ID
+            amount: 预扣数量（以预扣记录为准，仅用于没有预扣记录的旧任务）
+            
+        Returns:
+            是否进行了退还（已退还/已结算/用户不存在时返回 False）
+        """
+        refunded = self._refund_script(
+            keys=[self._get_reservation_key(task_id), self._get_user_key(user_id), self._get_credits_key(user_id)],
+            args=[user_id, amount, self.RESERVATION_TTL, UserCache.CHANNEL]
+        )
+        if refunded == 1:
+            get_user_cache().invalidate(user_id, publish=False)
+        return refunded == 1
+    
+    def consume_credits(self, user_id: str, amount: int) -> bool:
+        """
+        消耗用户算力（不关联任务，直接扣除）
         
-        # 保存
-        self.save_user(user)
-        return True
+        Args:
+            user_id: 用户ID
+            amount: 消耗的算力数量
+            
+        Returns:
+            是否成功（算力不足或用户不存在时返回 False）
+        """
+        status, _, _ = self._reserve_script(
+            keys=[self._get_user_key(user_id), self._get_credits_key(user_id)],
+            args=[user_id, amount, self.RESERVATION_TTL, UserCache.CHANNEL]
+        )
+        if status == 1:
+            get_user_cache().invalidate(user_id, publish=False)
+        return status == 1
     
     def add_credits(self, user_id: str, amount: int) -> bool:
         """
@@ -207,13 +425,131 @@ class BillingService:
         Returns:
             是否成功
         """
-        user = self.get_user(user_id)
-        if not user:
-            return False
+        return self._adjust_balance(user_id, "add", amount) >= 0
+    
+    def _adjust_balance(self, user_id: str, mode: str, amount: int) -> int:
+        """
+        原子调整算力余额
         
-        user.current_credits += amount
-        self.save_user(user)
-        return True
+        Args:
+            user_id: 用户ID
+            mode: add（增加）/ set（重置为指定值）
+            amount: 数量
+            
+        Returns:
+            调整后的余额，用户不存在返回 -1
+        """
+        balance = int(self._adjust_script(
+            keys=[self._get_user_key(user_id), self._get_credits_key(user_id)],
+            args=[mode, amount, user_id, UserCache.CHANNEL]
+        ))
+        if balance >= 0:
+            get_user_cache().invalidate(user_id, publish=False)
+        return balance
+    
+    # ==================== 异步接口（API 请求处理使用） ====================
+    
+    async def _eval_async(self, script_name: str, keys: list, args: list):
+        """在共享异步客户端上执行 Lua 脚本（脚本对象按需注册）"""
+        script = self._async_scripts.get(script_name)
+        if script is None:
+            script = get_async_redis_client().register_script(getattr(self, script_name))
+            self._async_scripts[script_name] = script
+        return await script(keys=keys, args=args)
+    
+    async def get_user_async(self, user_id: str) -> Optional[User]:
+        """从 Redis 获取用户信息（异步版本）"""
+        pipe = get_async_redis_client().pipeline(transaction=False)
+        pipe.get(self._get_user_key(user_id))
+        pipe.hmget(self._get_credits_key(user_id), "balance", "used")
+        user_data, (balance, used) = await pipe.execute()
+        return self._parse_user(user_data, balance, used)
+    
+    async def save_user_async(self, user: User) -> None:
+        """保存用户信息到 Redis（异步版本）"""
+        user_data = self._dump_user(user)
+        await get_async_redis_client().mset({
+            self._get_user_key(user.user_id): user_data,
+            f"user:email:{user.email}": user_data
+        })
+        await get_user_cache().invalidate_async(user.user_id)
+    
+    async def get_user_billing_info_async(self, user_id: str) -> Optional[UserBillingInfo]:
+        """获取用户的计费信息（异步版本）"""
+        return self._build_billing_info(await self.get_user_async(user_id))
+    
+    async def change_plan_async(
+        self,
+        user_id: str,
+        new_plan_id: str,
+        reset_credits: bool = True
+    ) -> ChangePlanResponse:
+        """
+        切换用户套餐（异步版本，参数同 change_plan）
+        
+        Raises:
+            ValueError: 如果套餐不存在或用户不存在
+        """
+        user = await self.get_user_async(user_id)
+        new_plan = self._check_plan_change(user_id, user, new_plan_id)
+        
+        self._apply_plan(user, new_plan_id)
+        if reset_credits:
+            user.current_credits = await self._adjust_balance_async(user_id, "set", new_plan.monthly_credits)
+        
+        await self.save_user_async(user)
+        return self._plan_changed_response(user, new_plan)
+    
+    async def reserve_credits_async(
+        self,
+        user_id: str,
+        amount: int,
+        task_id: str
+    ) -> Tuple[str, int, Optional[str]]:
+        """为任务预扣算力（异步版本，参数与返回值同 reserve_credits）"""
+        status, balance, plan_id = await self._eval_async(
+            "_RESERVE_SCRIPT",
+            keys=[self._get_user_key(user_id), self._get_credits_key(user_id), self._get_reservation_key(task_id)],
+            args=[user_id, amount, self.RESERVATION_TTL, UserCache.CHANNEL]
+        )
+        return self._reserve_result(user_id, status, balance, plan_id)
+    
+    async def refund_credits_async(self, task_id: str, user_id: str, amount: int) -> bool:
+        """退还任务预扣的算力（异步版本，参数同 refund_credits）"""
+        refunded = await self._eval_async(
+            "_REFUND_SCRIPT",
+            keys=[self._get_reservation_key(task_id), self._get_user_key(user_id), self._get_credits_key(user_id)],
+            args=[user_id, amount, self.RESERVATION_TTL, UserCache.CHANNEL]
+        )
+        if refunded == 1:
+            get_user_cache().invalidate(user_id, publish=False)
+        return refunded == 1
+    
+    async def consume_credits_async(self, user_id: str, amount: int) -> bool:
+        """消耗用户算力（异步版本）"""
+        status, _, _ = await self._eval_async(
+            "_RESERVE_SCRIPT",
+            keys=[self._get_user_key(user_id), self._get_credits_key(user_id)],
+            args=[user_id, amount, self.RESERVATION_TTL, UserCache.CHANNEL]
+        )
+        if status == 1:
+            get_user_cache().invalidate(user_id, publish=False)
+        return status == 1
+    
+    async def add_credits_async(self, user_id: str, amount: int) -> bool:
+        """增加用户算力（异步版本）"""
+        return await self._adjust_balance_async(user_id, "add", amount) >= 0
+    
+    async def _adjust_balance_async(self, user_id: str, mode: str, amount: int) -> int:
+        """原子调整算力余额（异步版本）"""
+        balance = int(await self._eval_async(
+            "_ADJUST_SCRIPT",
+            keys=[self._get_user_key(user_id), self._get_credits_key(user_id)],
+            args=[mode, amount, user_id, UserCache.CHANNEL]
+        ))
+        if balance >= 0:
+            get_user_cache().invalidate(user_id, publish=False)
+        return balance
     
     def check_and_renew_plan(self, user_id: str) -> bool:
         """
@@ -235,7 +571,7 @@ class BillingService:
             # 重置算力
             plan = get_plan_by_id(user.current_plan_id)
             if plan:
-                user.current_credits = plan.monthly_credits
+                user.current_credits = self._adjust_balance(user_id, "set", plan.monthly_credits)
                 
                 # 设置下次续费时间
                 if user.plan_renew_at.month == 12:
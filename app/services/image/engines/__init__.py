@@ -4,6 +4,7 @@ Engine 模块
 from app.services.image.engines.base import EngineBase, EngineType
 from app.services.image.engines.external_api import ExternalApiEngine
 from app.services.image.engines.comfyui_engine import ComfyUIEngine
+from app.services.image.engines.comfyui_async_engine import AsyncComfyUIEngine
 from app.services.image.engines.registry import EngineRegistry, get_engine_registry
 
 __all__ = [
@@ -11,6 +12,7 @@ __all__ = [
     "EngineType",
     "ExternalApiEngine",
     "ComfyUIEngine",
+    "AsyncComfyUIEngine",
     "EngineRegistry",
     "get_engine_registry"
 ]
@@ -6,6 +6,8 @@ from abc import ABC, abstractmethod
 from typing import Any, Dict, Optional
 from enum import Enum
 
+from app.services.image.engines.http_session import HttpConnectionStats, create_engine_session
+
 
 class EngineType(str, Enum):
     """引擎类型枚举"""
@@ -27,6 +29,10 @@ class EngineBase(ABC):
         self.config = config or {}
         self.engine_type: Optional[EngineType] = None
         self.engine_name: str = self.__class__.__name__
+        
+        # 每个 Engine 实例独享一个带连接池的 HTTP Session（配置见 config.http）
+        self.http_stats = HttpConnectionStats()
+        self.session = create_engine_session(self.get_config("http"), self.http_stats)
     
     @abstractmethod
     def execute(self, input_data: Any, **kwargs) -> Any:
@@ -65,6 +71,15 @@ class EngineBase(ABC):
         # TODO: 子类可重写以实现具体的健康检查逻辑
         return True
     
+    def get_http_stats(self) -> Dict[str, Any]:
+        """
+        获取连接级耗时统计
+        
+        Returns:
+            Dict[str, Any]: 请求数、新建/复用连接数、建连与请求平均耗时
+        """
+        return self.http_stats.snapshot()
+    
     def get_config(self, key: str, default: Any = None) -> Any:
         """
         获取配置项
@@ -0,0 +1,219 @@
+"""
+ComfyUI 异步 Engine
+通过 ComfyUI 的 WebSocket 事件流（/ws?clientId=）等待工作流完成，替代 HTTP 轮询
+"""
+import asyncio
+import json
+import uuid
+from typing import Any, Callable, Dict, Optional, Set
+
+import websockets
+
+from app.services.image.engines.comfyui_engine import ComfyUIEngine
+
+
+# 进度回调：(进度百分比 0-100, 步骤描述)
+ProgressCallback = Callable[[int, str], None]
+
+
+class AsyncComfyUIEngine(ComfyUIEngine):
+    """ComfyUI 异步 Engine（WebSocket 事件驱动）"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        初始化 ComfyUI 异步 Engine
+
+        Args:
+            config: ComfyUI 配置（在 ComfyUIEngine 基础上可选 ws_url）
+        """
+        super().__init__(config)
+
+        # WebSocket 地址（默认由 comfyui_url 推导：http -> ws, https -> wss）
+        base_url = (self.comfyui_url or "").rstrip("/")
+        default_ws_url = "ws" + base_url[len("http"):] if base_url.startswith("http") else base_url
+        self.ws_url = (self.get_config("ws_url") or default_ws_url).rstrip("/")
+
+    def execute(self, input_data: Any, progress_callback: Optional[ProgressCallback] = None, **kwargs) -> Any:
+        """
+        执行 ComfyUI 工作流（同步入口，供 Worker 线程调用）
+
+        Args:
+            input_data: 输入数据
+            progress_callback: 节点级进度回调（进度为本次工作流的 0-100）
+            **kwargs: 其他参数
+
+        Returns:
+            Any: 工作流执行结果
+        """
+        return asyncio.run(self.execute_async(input_data, progress_callback=progress_callback, **kwargs))
+
+    async def execute_async(
+        self,
+        input_data: Any,
+        progress_callback: Optional[ProgressCallback] = None,
+        **kwargs
+    ) -> Any:
+        """
+        执行 ComfyUI 工作流（异步）
+
+        先订阅 WebSocket 再提交工作流，保证不会错过任何事件；
+        收到完成事件后立即读取一次执行历史获取输出。
+        WebSocket 不可用时回退为 HTTP 轮询。
+
+        Args:
+            input_data: 输入数据
+            progress_callback: 节点级进度回调（进度为本次工作流的 0-100）
+            **kwargs: 其他参数
+
+        Returns:
+            Any: 工作流执行结果
+        """
+        self._log(f"执行 ComfyUI 工作流（WebSocket）: {self.workflow_path}")
+
+        # 1. 验证输入
+        if not self.validate_input(input_data):
+            raise ValueError("输入数据验证失败")
+
+        # 2. 获取已编译的工作流并注入输入（上传图片为阻塞 IO，放到线程中执行）
+        workflow = self._get_compiled_workflow()
+        prompt = await asyncio.to_thread(self._inject_input, workflow, input_data, **kwargs)
+
+        # 3. 订阅事件流（每次执行使用独立的 clientId：ComfyUI 每个 clientId 只保留一个连接，
+        #    多个任务槽共用同一 Engine 时共用 clientId 会互相顶掉事件流）
+        client_id = str(uuid.uuid4())
+        ws_endpoint = f"{self.ws_url}/ws?clientId={client_id}"
+        try:
+            ws = await websockets.connect(ws_endpoint, max_size=None, open_timeout=10)
+        except Exception as e:
+            self._log(f"WebSocket 连接失败，回退为 HTTP 轮询: {e}", "WARNING")
+            prompt_id = await asyncio.to_thread(self._submit_workflow, prompt, client_id)
+            return await asyncio.to_thread(self._wait_for_completion, prompt_id)
+
+        try:
+            # 4. 提交工作流（复用 Engine 的 HTTP 连接池）
+            prompt_id = await asyncio.to_thread(self._submit_workflow, prompt, client_id)
+
+            # 5. 等待完成事件
+            try:
+                await asyncio.wait_for(
+                    self._wait_for_events(ws, prompt_id, prompt, progress_callback),
+                    timeout=self.timeout
+                )
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"工作流执行超时: {self.timeout}秒")
+            except websockets.ConnectionClosed as e:
+                self._log(f"WebSocket 连接中断，回退为 HTTP 轮询: {e}", "WARNING")
+                return await asyncio.to_thread(self._wait_for_completion, prompt_id)
+
+            # 6. 读取一次执行历史获取输出
+            result = await asyncio.to_thread(self._get_output, prompt_id)
+        finally:
+            await ws.close()
+
+        self._log("ComfyUI 工作流执行成功")
+        return result
+
+    async def _wait_for_events(
+        self,
+        ws: Any,
+        prompt_id: str,
+        prompt: Dict,
+        progress_callback: Optional[ProgressCallback] = None
+    ):
+        """
+        消费 WebSocket 事件直到工作流结束
+
+        完成条件：executing 事件的 node 为空，或 execution_success 事件。
+        节点进度按 (已完成节点 + 当前节点步骤比例) / 节点总数 折算为 0-100。
+
+        Args:
+            ws: WebSocket 连接
+            prompt_id: Prompt ID
+            prompt: 已提交的工作流（用于统计节点数与节点标题）
+            progress_callback: 进度回调
+        """
+        total_nodes = max(1, len(prompt))
+        finished_nodes: Set[str] = set()
+        current_node: Optional[str] = None
+        last_progress = -1
+
+        def report(fraction: float, message: str):
+            nonlocal last_progress
+            progress = min(99, int(fraction * 100))
+            if progress_callback and progress > last_progress:
+                last_progress = progress
+                try:
+                    progress_callback(progress, message)
+                except Exception as e:
+                    self._log(f"进度回调失败: {e}", "WARNING")
+
+        async for message in ws:
+            # 二进制消息为预览图，忽略
+            if not isinstance(message, str):
+                continue
+
+            try:
+                event = json.loads(message)
+            except ValueError:
+                continue
+
+            event_type = event.get("type")
+            data = event.get("data") or {}
+            if data.get("prompt_id") not in (None, prompt_id):
+                continue
+
+            if event_type == "execution_cached":
+                finished_nodes.update(str(node) for node in data.get("nodes") or [])
+                report(len(finished_nodes) / total_nodes, "ComfyUI 正在复用缓存节点...")
+
+            elif event_type == "executing":
+                if data.get("prompt_id") != prompt_id:
+                    continue
+                node = data.get("node")
+                if current_node:
+                    finished_nodes.add(current_node)
+                if node is None:
+                    return
+                current_node = str(node)
+                report(
+                    len(finished_nodes) / total_nodes,
+                    f"ComfyUI 正在执行节点: {self._node_label(prompt, current_node)}"
+                )
+
+            elif event_type == "progress":
+                maximum = data.get("max") or 0
+                if maximum > 0:
+                    node = str(data.get("node") or current_node or "")
+                    step_ratio = min(1.0, (data.get("value") or 0) / maximum)
+                    report(
+                        (len(finished_nodes) + step_ratio) / total_nodes,
+                        f"ComfyUI 正在执行节点: {self._node_label(prompt, node)} "
+                        f"({data.get('value')}/{maximum})"
+                    )
+
+            elif event_type == "executed":
+                if data.get("node") is not None:
+                    finished_nodes.add(str(data.get("node")))
+
+            elif event_type == "execution_success":
+                if data.get("prompt_id") == prompt_id:
+                    return
+
+            elif event_type == "execution_error":
+                if data.get("prompt_id") == prompt_id:
+                    detail = data.get("exception_message") or data.get("exception_type") or "未知错误"
+                    raise Exception(f"工作流执行失败: {detail}")
+
+            elif event_type == "execution_interrupted":
+                if data.get("prompt_id") == prompt_id:
+                    raise Exception("工作流执行被中断")
+
+        # 迭代正常结束说明服务端关闭了连接
+        raise websockets.ConnectionClosed(None, None)
+
+    @staticmethod
+    def _node_label(prompt: Dict, node_id: str) -> str:
+        """节点显示名称（优先使用标题，其次节点类型）"""
+        node = prompt.get(node_id) or {}
+        meta = node.get("_meta") or {}
+        return node.get("title") or meta.get("title") or node.get("class_type") or node.get("type") or node_id
@@ -2,14 +2,20 @@
 ComfyUI Engine
 负责调用本地 ComfyUI 工作流
 """
+import hashlib
 import json
+import os
 import requests
 import time
 import uuid
 from pathlib import Path
+from urllib.parse import urlparse
 from typing import Any, Dict, Optional, Callable
 
 from app.services.image.engines.base import EngineBase, EngineType
+from app.services.image.engines.workflow_cache import CompiledWorkflow, get_compiled_workflow
+from app.services.image.engines.upload_cache import ComfyUIUploadCache
+from app.utils.image_io import STREAM_CHUNK_SIZE, stream_to_file
 
 
 class ComfyUIEngine(EngineBase):
@@ -33,6 +39,14 @@ class ComfyUIEngine(EngineBase):
         
         # 客户端 ID（用于识别）
         self.client_id = str(uuid.uuid4())
+        
+        # 上传去重缓存（按内容哈希 + ComfyUI 主机记录远端文件名）
+        self.upload_cache: Optional[ComfyUIUploadCache] = None
+        if self.get_config("upload_cache", True) not in (False, "false", "0"):
+            self.upload_cache = ComfyUIUploadCache(
+                host=urlparse(self.comfyui_url or "").netloc or str(self.comfyui_url),
+                ttl=int(self.get_config("upload_cache_ttl", 7 * 24 * 3600))
+            )
     
     def execute(self, input_data: Any, **kwargs) -> Any:
         """
@@ -51,8 +65,8 @@ class ComfyUIEngine(EngineBase):
         if not self.validate_input(input_data):
             raise ValueError("输入数据验证失败")
         
-        # 2. 加载工作流定义
-        workflow = self._load_workflow()
+        # 2. 获取已编译的工作流模板（按文件修改时间缓存）
+        workflow = self._get_compiled_workflow()
         
         # 3. 注入输入数据
         workflow_with_input = self._inject_input(workflow, input_data, **kwargs)
@@ -89,19 +103,23 @@ class ComfyUIEngine(EngineBase):
         加载工作流定义
         
         Returns:
-            Dict: 工作流 JSON
+            Dict: 工作流 JSON（缓存中的原始定义，请勿修改）
+        """
+        return self._get_compiled_workflow().workflow
+    
+    def _get_compiled_workflow(self) -> CompiledWorkflow:
+        """
+        获取已编译的工作流模板（文件未变化时直接使用缓存）
+        
+        Returns:
+            CompiledWorkflow: prompt 格式节点图 + 节点标题索引
         """
         try:
-            with open(self.workflow_path, 'r', encoding='utf-8') as f:
-                workflow = json.load(f)
-            
-            self._log(f"工作流加载成功: {self.workflow_path}")
-            return workflow
-            
+            return get_compiled_workflow(self.workflow_path)
         except Exception as e:
             raise Exception(f"加载工作流失败: {e}")
     
-    def _inject_input(self, workflow: Dict, input_data: Any, **kwargs) -> Dict:
+    def _inject_input(self, workflow: Any, input_data: Any, **kwargs) -> Dict:
         """
         注入输入数据到工作流
         
@@ -109,16 +127,18 @@ class ComfyUIEngine(EngineBase):
         - input:raw_image:1 -> 原始图片
         - input:pose_image:2 -> 姿势参考图
         
+        节点标题索引在编译时已生成，这里只浅拷贝节点图并写入输入节点的 image 字段。
+        
         Args:
-            workflow: 工作流定义（可能是节点列表格式或 prompt 格式）
+            workflow: 已编译的工作流模板（也接受节点列表格式或 prompt 格式的工作流 JSON）
             input_data: 输入数据（可以是文件路径或字典）
             **kwargs: 其他参数（如 raw_image_path, pose_image_path）
             
         Returns:
             Dict: 注入后的工作流（prompt 格式，以节点 ID 为键）
         """
-        import os
-        from pathlib import Path
+        if not isinstance(workflow, CompiledWorkflow):
+            workflow = CompiledWorkflow(workflow)
         
         # 处理输入数据
         if isinstance(input_data, dict):
@@ -134,50 +154,19 @@ class ComfyUIEngine(EngineBase):
         raw_image_path = kwargs.get("raw_image_path") or kwargs.get("source_image") or raw_image_path
         pose_image_path = kwargs.get("pose_image_path") or kwargs.get("reference_image") or pose_image_path
         
-        # 转换工作流格式：从节点列表格式转换为 prompt 格式（以节点 ID 为键）
-        prompt = {}
-        nodes = workflow.get("nodes", [])
-        
-        # 如果 workflow 已经是 prompt 格式（以节点 ID 为键），直接使用
-        if not nodes and isinstance(workflow, dict):
-            # 检查是否是 prompt 格式
-            is_prompt_format = all(isinstance(k, (int, str)) and isinstance(v, dict) for k, v in workflow.items() if k not in ["nodes", "links", "extra", "config"])
-            if is_prompt_format:
-                prompt = workflow.copy()
-            else:
-                # 从节点列表构建 prompt
-                for node in workflow.get("nodes", []):
-                    node_id = node.get("id")
-                    if node_id is not None:
-                        prompt[str(node_id)] = node
-        else:
-            # 从节点列表构建 prompt
-            for node in nodes:
-                node_id = node.get("id")
-                if node_id is not None:
-                    prompt[str(node_id)] = node.copy()
-        
         # 查找输入节点
-        raw_image_node_id = None
-        pose_image_node_id = None
+        raw_image_node_id = workflow.node_id("input:raw_image:1")
+        pose_image_node_id = workflow.node_id("input:pose_image:2")
         
-        for node_id, node in prompt.items():
-            title = node.get("title", "")
-            if title == "input:raw_image:1":
-                raw_image_node_id = node_id
-            elif title == "input:pose_image:2":
-                pose_image_node_id = node_id
+        # {节点 ID: {输入字段: 值}}
+        node_inputs: Dict[str, Dict[str, Any]] = {}
         
-        # 注入原始图片
+        # 注入原始图片（LoadImage 节点使用 "image" 字段）
         if raw_image_path and raw_image_node_id:
             # 上传图片到 ComfyUI
             uploaded_filename = self._upload_image_to_comfyui(raw_image_path)
             if uploaded_filename:
-                # 设置节点输入
-                if "inputs" not in prompt[raw_image_node_id]:
-                    prompt[raw_image_node_id]["inputs"] = {}
-                # LoadImage 节点使用 "image" 字段
-                prompt[raw_image_node_id]["inputs"]["image"] = uploaded_filename
+                node_inputs[raw_image_node_id] = {"image": uploaded_filename}
                 self._log(f"已注入原始图片到节点 {raw_image_node_id}: {uploaded_filename}")
         
         # 注入姿势参考图
@@ -185,20 +174,18 @@ class ComfyUIEngine(EngineBase):
             # 上传图片到 ComfyUI
             uploaded_filename = self._upload_image_to_comfyui(pose_image_path)
             if uploaded_filename:
-                # 设置节点输入
-                if "inputs" not in prompt[pose_image_node_id]:
-                    prompt[pose_image_node_id]["inputs"] = {}
-                prompt[pose_image_node_id]["inputs"]["image"] = uploaded_filename
+                node_inputs[pose_image_node_id] = {"image": uploaded_filename}
                 self._log(f"已注入姿势参考图到节点 {pose_image_node_id}: {uploaded_filename}")
         
-        return prompt
+        return workflow.instantiate(node_inputs)
     
-    def _submit_workflow(self, workflow: Dict) -> str:
+    def _submit_workflow(self, workflow: Dict, client_id: Optional[str] = None) -> str:
         """
         提交工作流到 ComfyUI
         
         Args:
             workflow: 工作流定义
+            client_id: 接收事件的客户端 ID（WebSocket 执行时每次调用独立生成；默认使用 Engine 的 client_id）
             
         Returns:
             str: Prompt ID
@@ -207,12 +194,12 @@ class ComfyUIEngine(EngineBase):
             # 构建提交数据
             payload = {
                 "prompt": workflow,
-                "client_id": self.client_id
+                "client_id": client_id or self.client_id
             }
             
             # 发送请求
             url = f"{self.comfyui_url}/prompt"
-            response = requests.post(url, json=payload, timeout=30)
+            response = self.session.post(url, json=payload, timeout=30)
             response.raise_for_status()
             
             # 解析响应
@@ -280,7 +267,7 @@ class ComfyUIEngine(EngineBase):
         try:
             # 查询历史记录
             url = f"{self.comfyui_url}/history/{prompt_id}"
-            response = requests.get(url, timeout=10)
+            response = self.session.get(url, timeout=10)
             
             if response.status_code == 200:
                 history = response.json()
@@ -319,7 +306,7 @@ class ComfyUIEngine(EngineBase):
         try:
             # 查询历史记录
             url = f"{self.comfyui_url}/history/{prompt_id}"
-            response = requests.get(url, timeout=10)
+            response = self.session.get(url, timeout=10)
             response.raise_for_status()
             
             history = response.json()
@@ -330,33 +317,45 @@ class ComfyUIEngine(EngineBase):
             prompt_history = history[prompt_id]
             outputs = prompt_history.get("outputs", {})
             
-            # 提取输出图片
-            output_images = self._extract_output_images(outputs)
-            
-            # 分离输出图片和对比图片
-            output_image = None
-            comparison_image = None
-            
-            for img in output_images:
-                if img.get("type") == "output":
-                    output_image = img
-                elif img.get("type") == "comparison":
-                    comparison_image = img
-            
-            # 如果没有找到分类的图片，使用第一个作为输出图片
-            if not output_image and output_images:
-                output_image = output_images[0]
-            
-            return {
-                "output_image": output_image,
-                "comparison_image": comparison_image,
-                "images": output_images,
-                "outputs": outputs
-            }
+            return self._build_output(outputs)
             
         except Exception as e:
             raise Exception(f"获取输出失败: {e}")
     
+    def _build_output(self, outputs: Dict) -> Dict[str, Any]:
+        """
+        根据节点输出构建执行结果
+        
+        Args:
+            outputs: 执行历史中的输出数据（节点 ID 为键）
+            
+        Returns:
+            Dict: 包含 output_image、comparison_image、images、outputs
+        """
+        # 提取输出图片
+        output_images = self._extract_output_images(outputs)
+        
+        # 分离输出图片和对比图片
+        output_image = None
+        comparison_image = None
+        
+        for img in output_images:
+            if img.get("type") == "output":
+                output_image = img
+            elif img.get("type") == "comparison":
+                comparison_image = img
+        
+        # 如果没有找到分类的图片，使用第一个作为输出图片
+        if not output_image and output_images:
+            output_image = output_images[0]
+        
+        return {
+            "output_image": output_image,
+            "comparison_image": comparison_image,
+            "images": output_images,
+            "outputs": outputs
+        }
+    
     def _extract_output_images(self, outputs: Dict) -> list:
         """
         从输出中提取图片信息
@@ -373,22 +372,11 @@ class ComfyUIEngine(EngineBase):
         """
         images = []
         
-        # 需要查询工作流定义来找到输出节点
+        # 通过已编译工作流的标题索引找到输出节点
         try:
-            workflow = self._load_workflow()
-            nodes = workflow.get("nodes", [])
-            
-            # 查找输出节点
-            output_image_node_id = None
-            comparer_image_node_id = None
-            
-            for node in nodes:
-                title = node.get("title", "")
-                node_id = node.get("id")
-                if title == "output:image:1":
-                    output_image_node_id = str(node_id)
-                elif title == "output:image_comparer:2":
-                    comparer_image_node_id = str(node_id)
+            workflow = self._get_compiled_workflow()
+            output_image_node_id = workflow.node_id("output:image:1")
+            comparer_image_node_id = workflow.node_id("output:image_comparer:2")
             
             # 提取输出图片
             if output_image_node_id and output_image_node_id in outputs:
@@ -481,13 +469,16 @@ class ComfyUIEngine(EngineBase):
         
         return images
     
-    def download_image(self, image_info: Dict, save_path: str) -> str:
+    def download_image(self, image_info: Dict, save_path: str, timeout: int = 30) -> str:
         """
         下载 ComfyUI 生成的图片
         
+        分块流式写入临时文件后原子重命名，不在内存中缓存整张图片。
+        
         Args:
             image_info: 图片信息
             save_path: 保存路径
+            timeout: 请求超时（秒）
             
         Returns:
             str: 保存路径
@@ -497,16 +488,12 @@ class ComfyUIEngine(EngineBase):
             if not url:
                 raise ValueError("图片信息中没有 URL")
             
-            # 下载图片
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            
-            # 保存图片
-            Path(save_path).parent.mkdir(parents=True, exist_ok=True)
-            with open(save_path, 'wb') as f:
-                f.write(response.content)
+            # 流式下载图片
+            with self.session.get(url, timeout=timeout, stream=True) as response:
+                response.raise_for_status()
+                size = stream_to_file(response.iter_content(chunk_size=STREAM_CHUNK_SIZE), save_path)
             
-            self._log(f"图片已下载: {save_path}")
+            self._log(f"图片已下载: {save_path} ({size} bytes)")
             
             return save_path
             
@@ -517,15 +504,15 @@ class ComfyUIEngine(EngineBase):
         """
         上传图片到 ComfyUI
         
+        以内容哈希命名上传（overwrite），相同内容在同一 ComfyUI 上只上传一次：
+        缓存命中时用 HEAD /view 确认远端文件仍存在，不存在则删除缓存并重新上传。
+        
         Args:
             image_path: 本地图片路径
             
         Returns:
             Optional[str]: 上传后的文件名，失败返回 None
         """
-        import os
-        from pathlib import Path
-        
         try:
             # 检查文件是否存在
             if not os.path.exists(image_path):
@@ -536,8 +523,20 @@ class ComfyUIEngine(EngineBase):
             with open(image_path, 'rb') as f:
                 image_data = f.read()
             
-            # 获取文件名
-            filename = os.path.basename(image_path)
+            content_hash = hashlib.sha256(image_data).hexdigest()
+            
+            # 查询上传缓存
+            if self.upload_cache:
+                remote_name = self.upload_cache.get(content_hash)
+                if remote_name:
+                    if self._remote_input_exists(remote_name):
+                        self._log(f"图片已存在于 ComfyUI，跳过上传: {remote_name}")
+                        return remote_name
+                    self._log(f"缓存的远端文件已不存在，重新上传: {remote_name}", "WARNING")
+                    self.upload_cache.invalidate(content_hash)
+            
+            # 以内容哈希命名（保留扩展名），重复上传时覆盖同名文件
+            filename = f"{content_hash[:32]}{Path(image_path).suffix.lower() or '.jpg'}"
             
             # 上传到 ComfyUI
             url = f"{self.comfyui_url}/upload/image"
@@ -545,11 +544,16 @@ class ComfyUIEngine(EngineBase):
                 "image": (filename, image_data, "image/jpeg")
             }
             
-            response = requests.post(url, files=files, timeout=30)
+            response = self.session.post(url, files=files, data={"overwrite": "true"}, timeout=30)
             response.raise_for_status()
             
             result = response.json()
             uploaded_filename = result.get("name") or filename
+            if result.get("subfolder"):
+                uploaded_filename = f"{result['subfolder']}/{uploaded_filename}"
+            
+            if self.upload_cache:
+                self.upload_cache.set(content_hash, uploaded_filename)
             
             self._log(f"图片已上传到 ComfyUI: {uploaded_filename}")
             return uploaded_filename
@@ -558,6 +562,28 @@ class ComfyUIEngine(EngineBase):
             self._log(f"上传图片到 ComfyUI 失败: {e}", "ERROR")
             return None
     
+    def _remote_input_exists(self, remote_name: str) -> bool:
+        """
+        检查 ComfyUI 输入目录中是否存在文件（HEAD 请求，不传输图片内容）
+        
+        Args:
+            remote_name: 远端文件名（可包含子目录）
+            
+        Returns:
+            bool: 是否存在（请求异常时视为不存在，走重新上传）
+        """
+        subfolder, _, filename = remote_name.rpartition("/")
+        params = {"filename": filename, "type": "input"}
+        if subfolder:
+            params["subfolder"] = subfolder
+        
+        try:
+            response = self.session.head(f"{self.comfyui_url}/view", params=params, timeout=10)
+            return response.status_code == 200
+        except Exception as e:
+            self._log(f"检查远端文件失败: {e}", "WARNING")
+            return False
+    
     def health_check(self) -> bool:
         """
         健康检查
@@ -572,7 +598,7 @@ class ComfyUIEngine(EngineBase):
             
             # 尝试访问 ComfyUI
             url = f"{self.comfyui_url}/system_stats"
-            response = requests.get(url, timeout=5)
+            response = self.session.get(url, timeout=5)
             
             return response.status_code == 200
             
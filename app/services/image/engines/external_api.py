@@ -152,14 +152,14 @@ class ExternalApiEngine(EngineBase):
         try:
             # 发送请求
             if self.method == "POST":
-                response = requests.post(
+                response = self.session.post(
                     self.api_url,
                     json=request_data,
                     headers=headers,
                     timeout=self.timeout
                 )
             elif self.method == "GET":
-                response = requests.get(
+                response = self.session.get(
                     self.api_url,
                     params=request_data,
                     headers=headers,
@@ -262,7 +262,7 @@ class ExternalApiEngine(EngineBase):
             # 尝试发送健康检查请求
             health_url = self.get_config("health_check_url")
             if health_url:
-                response = requests.get(health_url, timeout=5)
+                response = self.session.get(health_url, timeout=5)
                 return response.status_code == 200
             
             return True
@@ -0,0 +1,155 @@
+"""
+Engine HTTP 连接池
+每个 Engine 实例持有一个带连接池、keep-alive 与重试策略的 requests.Session，
+并统计连接级耗时（新建连接的 TCP 连接 + TLS 握手时间、连接复用次数）
+"""
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+
+# 默认连接池配置（可在 engine_config.yml 的 global.http 或各 Engine 的 config.http 中覆盖）
+DEFAULT_HTTP_CONFIG: Dict[str, Any] = {
+    "pool_connections": 4,        # 缓存的主机连接池数量
+    "pool_maxsize": 8,            # 每个主机的最大连接数（不小于 Worker 并发槽位数）
+    "keep_alive": True,           # 是否复用连接（False 时每个请求发送 Connection: close）
+    "max_retries": 2,             # 连接错误/指定状态码的重试次数
+    "backoff_factor": 0.5,        # 重试退避系数（秒）
+    "status_forcelist": [502, 503, 504],
+    "retry_methods": ["GET", "HEAD"],  # 只重试幂等请求，避免重复提交工作流
+}
+
+
+class HttpConnectionStats:
+    """连接级耗时统计（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.connect_time_total = 0.0
+        self.request_time_total = 0.0
+
+    def record_connect(self, seconds: float):
+        """记录一次新建连接（TCP 连接 + TLS 握手）"""
+        with self._lock:
+            self.new_connections += 1
+            self.connect_time_total += seconds
+
+    def record_request(self, seconds: float):
+        """记录一次请求（发送请求到收到响应头）"""
+        with self._lock:
+            self.requests += 1
+            self.request_time_total += seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        获取统计快照
+
+        Returns:
+            Dict: 请求数、新建连接数、复用连接数、连接/请求耗时（毫秒）
+        """
+        with self._lock:
+            reused = max(0, self.requests - self.new_connections)
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": reused,
+                "reuse_ratio": round(reused / self.requests, 3) if self.requests else 0.0,
+                "connect_ms_total": round(self.connect_time_total * 1000, 1),
+                "connect_ms_avg": round(self.connect_time_total * 1000 / self.new_connections, 1)
+                if self.new_connections else 0.0,
+                "request_ms_avg": round(self.request_time_total * 1000 / self.requests, 1)
+                if self.requests else 0.0,
+            }
+
+
+def _timed_pool_classes(stats: HttpConnectionStats) -> Dict[str, type]:
+    """构建记录建连耗时的 urllib3 连接池类"""
+
+    class TimedHTTPConnection(HTTPConnection):
+        def connect(self):
+            start = time.perf_counter()
+            super().connect()
+            stats.record_connect(time.perf_counter() - start)
+
+    class TimedHTTPSConnection(HTTPSConnection):
+        def connect(self):
+            # HTTPS 的 connect() 包含 TLS 握手
+            start = time.perf_counter()
+            super().connect()
+            stats.record_connect(time.perf_counter() - start)
+
+    class TimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = TimedHTTPConnection
+
+    class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = TimedHTTPSConnection
+
+    return {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """统计建连耗时的 HTTPAdapter"""
+
+    def __init__(self, stats: HttpConnectionStats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = _timed_pool_classes(self.stats)
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        self.stats.record_request(time.perf_counter() - start)
+        return response
+
+
+def create_engine_session(
+    http_config: Optional[Dict[str, Any]] = None,
+    stats: Optional[HttpConnectionStats] = None
+) -> requests.Session:
+    """
+    创建 Engine 专用的 HTTP Session
+
+    Args:
+        http_config: 连接池配置（缺省项使用 DEFAULT_HTTP_CONFIG）
+        stats: 连接级耗时统计
+
+    Returns:
+        requests.Session: 已挂载连接池适配器的 Session
+    """
+    config = {**DEFAULT_HTTP_CONFIG, **(http_config or {})}
+    stats = stats or HttpConnectionStats()
+
+    retry = Retry(
+        total=int(config["max_retries"]),
+        connect=int(config["max_retries"]),
+        read=int(config["max_retries"]),
+        backoff_factor=float(config["backoff_factor"]),
+        status_forcelist=[int(code) for code in config["status_forcelist"]],
+        allowed_methods=[method.upper() for method in config["retry_methods"]],
+        raise_on_status=False,
+    )
+    adapter = TimedHTTPAdapter(
+        stats,
+        pool_connections=int(config["pool_connections"]),
+        pool_maxsize=int(config["pool_maxsize"]),
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # 配置值可能来自 ${ENV_VAR} 占位符（字符串）
+    if str(config["keep_alive"]).strip().lower() in ("false", "0", "no", "off"):
+        session.headers["Connection"] = "close"
+    return session
@@ -10,6 +10,7 @@ import yaml
 from app.services.image.engines.base import EngineBase, EngineType
 from app.services.image.engines.external_api import ExternalApiEngine
 from app.services.image.engines.comfyui_engine import ComfyUIEngine
+from app.services.image.engines.comfyui_async_engine import AsyncComfyUIEngine
 from app.utils.env_parser import load_yaml_with_env
 
 
@@ -27,7 +28,8 @@ class EngineRegistry:
         self.engines: Dict[str, EngineBase] = {}
         self.engine_classes: Dict[str, Type[EngineBase]] = {
             "external_api": ExternalApiEngine,
-            "comfyui": ComfyUIEngine
+            "comfyui": ComfyUIEngine,
+            "comfyui_async": AsyncComfyUIEngine
         }
         self.config: Dict[str, Any] = {}
         
@@ -44,7 +46,7 @@ class EngineRegistry:
             # 打印已解析的 ComfyUI URL（用于调试）
             engines = self.config.get("engines", {})
             for engine_name, engine_cfg in engines.items():
-                if engine_cfg.get("type") == "comfyui":
+                if engine_cfg.get("type") in ("comfyui", "comfyui_async"):
                     comfyui_url = engine_cfg.get("config", {}).get("comfyui_url")
                     if comfyui_url:
                         print(f"[EngineRegistry] 📍 {engine_name}: {comfyui_url}")
@@ -69,7 +71,7 @@ class EngineRegistry:
         
         Args:
             engine_name: 引擎名称（唯一标识）
-            engine_type: 引擎类型（external_api / comfyui）
+            engine_type: 引擎类型（external_api / comfyui / comfyui_async）
             config: 引擎配置
             
         Returns:
@@ -138,10 +140,13 @@ class EngineRegistry:
     def initialize_from_config(self):
         """从配置文件初始化所有 Engine"""
         engines_config = self.config.get("engines", {})
+        # 全局连接池配置（各 Engine 的 config.http 可逐项覆盖）
+        global_http = (self.config.get("global") or {}).get("http") or {}
         
         for engine_name, engine_cfg in engines_config.items():
             engine_type = engine_cfg.get("type")
-            engine_config = engine_cfg.get("config", {})
+            engine_config = dict(engine_cfg.get("config") or {})
+            engine_config["http"] = {**global_http, **(engine_config.get("http") or {})}
             
             self.register_engine(
                 engine_name=engine_name,
@@ -158,6 +163,20 @@ class EngineRegistry:
         """
         return list(self.engines.keys())
     
+    def get_http_stats_all(self) -> Dict[str, Dict[str, Any]]:
+        """
+        获取所有 Engine 的连接级耗时统计
+        
+        Returns:
+            Dict[str, Dict[str, Any]]: {引擎名称: 统计快照}（仅包含已发出请求的 Engine）
+        """
+        results = {}
+        for engine_name, engine in self.engines.items():
+            stats = engine.get_http_stats()
+            if stats["requests"]:
+                results[engine_name] = stats
+        return results
+    
     def health_check_all(self) -> Dict[str, bool]:
         """
         对所有 Engine 进行健康检查
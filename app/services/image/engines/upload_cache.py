@@ -0,0 +1,81 @@
+"""
+ComfyUI 上传去重缓存
+按图片内容哈希 + ComfyUI 主机记录远端已有的文件名（Redis），相同内容的图片不再重复上传
+"""
+from typing import Optional
+
+from app.utils.redis_client import get_redis_client
+
+
+class ComfyUIUploadCache:
+    """ComfyUI 上传去重缓存"""
+
+    KEY_PREFIX = "formy:comfyui:upload:"  # {host}:{sha256} -> 远端文件名（String）
+
+    def __init__(self, host: str, ttl: int = 7 * 24 * 3600):
+        """
+        初始化缓存
+
+        Args:
+            host: ComfyUI 主机（host:port），不同实例的输入目录互不共享
+            ttl: 记录有效期（秒），每次命中时续期
+        """
+        self.host = host
+        self.ttl = ttl
+        self._redis = None
+
+    @property
+    def redis_client(self):
+        """懒加载 Redis 客户端（Redis 不可用时缓存失效，不影响上传）"""
+        if self._redis is None:
+            self._redis = get_redis_client()
+        return self._redis
+
+    def _key(self, content_hash: str) -> str:
+        return f"{self.KEY_PREFIX}{self.host}:{content_hash}"
+
+    def get(self, content_hash: str) -> Optional[str]:
+        """
+        查询远端文件名（命中时续期）
+
+        Args:
+            content_hash: 图片内容 SHA-256
+
+        Returns:
+            Optional[str]: 远端文件名，未命中返回 None
+        """
+        try:
+            key = self._key(content_hash)
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.expire(key, self.ttl)
+            remote_name, _ = pipe.execute()
+            return remote_name
+        except Exception as e:
+            print(f"[ComfyUIUploadCache] 查询上传缓存失败: {e}")
+            return None
+
+    def set(self, content_hash: str, remote_name: str):
+        """
+        记录远端文件名
+
+        Args:
+            content_hash: 图片内容 SHA-256
+            remote_name: ComfyUI 返回的文件名
+        """
+        try:
+            self.redis_client.set(self._key(content_hash), remote_name, ex=self.ttl)
+        except Exception as e:
+            print(f"[ComfyUIUploadCache] 写入上传缓存失败: {e}")
+
+    def invalidate(self, content_hash: str):
+        """
+        删除记录（远端文件已不存在时调用）
+
+        Args:
+            content_hash: 图片内容 SHA-256
+        """
+        try:
+            self.redis_client.delete(self._key(content_hash))
+        except Exception as e:
+            print(f"[ComfyUIUploadCache] 删除上传缓存失败: {e}")
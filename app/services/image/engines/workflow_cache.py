@@ -0,0 +1,120 @@
+"""
+ComfyUI 工作流模板缓存
+按文件路径 + 修改时间缓存已编译的工作流（prompt 格式节点图 + 节点标题索引），
+文件变化时自动重新加载
+"""
+import json
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+
+# 工作流 JSON 中不属于节点的顶层字段
+_NON_NODE_KEYS = ("nodes", "links", "extra", "config")
+
+
+class CompiledWorkflow:
+    """已编译的工作流模板（只读，注入输入时请使用 instantiate）"""
+
+    def __init__(self, workflow: Dict[str, Any], source: Optional[str] = None, mtime_ns: int = 0):
+        """
+        编译工作流
+
+        Args:
+            workflow: 工作流 JSON（节点列表格式或 prompt 格式）
+            source: 来源文件路径
+            mtime_ns: 来源文件修改时间
+        """
+        self.source = source
+        self.mtime_ns = mtime_ns
+        self.workflow = workflow
+        self.prompt = self._build_prompt(workflow)
+
+        # 节点标题 -> 节点 ID（如 input:raw_image:1、output:image:1）
+        self.title_map: Dict[str, str] = {}
+        for node_id, node in self.prompt.items():
+            title = node.get("title") or (node.get("_meta") or {}).get("title")
+            if title and title not in self.title_map:
+                self.title_map[title] = node_id
+
+    @staticmethod
+    def _build_prompt(workflow: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """将工作流转换为 prompt 格式（以节点 ID 为键）"""
+        nodes = workflow.get("nodes", []) if isinstance(workflow, dict) else []
+        if nodes:
+            return {str(node["id"]): node for node in nodes if node.get("id") is not None}
+
+        # 已经是 prompt 格式
+        if isinstance(workflow, dict) and all(
+            isinstance(value, dict) for key, value in workflow.items() if key not in _NON_NODE_KEYS
+        ):
+            return {str(key): value for key, value in workflow.items() if key not in _NON_NODE_KEYS}
+        return {}
+
+    def node_id(self, title: str) -> Optional[str]:
+        """按标题查找节点 ID"""
+        return self.title_map.get(title)
+
+    def instantiate(self, inputs: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        生成本次任务的 prompt：浅拷贝节点图，只复制被写入的节点
+
+        Args:
+            inputs: {节点 ID: {输入字段: 值}}
+
+        Returns:
+            Dict: 可直接提交的 prompt（未修改的节点与模板共享）
+        """
+        prompt = dict(self.prompt)
+        for node_id, fields in inputs.items():
+            node = dict(prompt[node_id])
+            node_inputs = node.get("inputs")
+            if isinstance(node_inputs, list):
+                # 节点列表格式（UI 导出）：控件值按控件输入的顺序保存在 widgets_values 中
+                widget_names = [item.get("name") for item in node_inputs if item.get("widget")]
+                widgets = list(node.get("widgets_values") or [])
+                for field, value in fields.items():
+                    if field in widget_names and widget_names.index(field) < len(widgets):
+                        widgets[widget_names.index(field)] = value
+                node["widgets_values"] = widgets
+            else:
+                node["inputs"] = {**(node_inputs or {}), **fields}
+            prompt[node_id] = node
+        return prompt
+
+
+_cache: Dict[str, Tuple[int, int, CompiledWorkflow]] = {}
+_cache_lock = threading.Lock()
+
+
+def get_compiled_workflow(path: str) -> CompiledWorkflow:
+    """
+    获取已编译的工作流（按路径 + 修改时间缓存，文件变化后自动重新加载）
+
+    Args:
+        path: 工作流文件路径
+
+    Returns:
+        CompiledWorkflow: 已编译的工作流
+    """
+    real_path = os.path.abspath(path)
+    stat = os.stat(real_path)
+
+    with _cache_lock:
+        cached = _cache.get(real_path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+
+    with open(real_path, "r", encoding="utf-8") as f:
+        workflow = json.load(f)
+    compiled = CompiledWorkflow(workflow, source=real_path, mtime_ns=stat.st_mtime_ns)
+
+    with _cache_lock:
+        _cache[real_path] = (stat.st_mtime_ns, stat.st_size, compiled)
+    return compiled
+
+
+def clear_workflow_cache():
+    """清空工作流缓存"""
+    with _cache_lock:
+        _cache.clear()
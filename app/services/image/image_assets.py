@@ -10,6 +10,9 @@ from typing import Optional
 from PIL import Image, ImageDraw
 
 from app.core.config import settings
+from app.services.storage.file_index import get_file_index
+from app.services.storage.local_storage import get_local_storage
+from app.services.storage.factory import get_storage, is_remote_storage
 
 RESULTS_DIR = Path(settings.RESULT_DIR)
 UPLOAD_DIR = Path(settings.UPLOAD_DIR)
@@ -21,7 +24,8 @@ def resolve_uploaded_file(file_id: str) -> Path:
     根据 file_id 定位上传图片
     
     支持两种方式：
-    1. 标准方式：file_id (如 "img_abc123")，会在 uploads 目录搜索
+    1. 标准方式：file_id (如 "img_abc123")，查询上传文件索引（进程内 LRU + Redis），
+       未记录的旧文件回退为查看分片目录与旧的平铺目录并回填索引；未找到的 file_id 短暂缓存
     2. 测试方式：完整路径或文件名，可以直接使用本地文件
     
     Args:
@@ -38,37 +42,50 @@ def resolve_uploaded_file(file_id: str) -> Path:
         print(f"[resolve_uploaded_file] Using direct path: {file_path}")
         return file_path
     
-    # Standard flow: search in UPLOAD_DIR
-    if not UPLOAD_DIR.exists():
-        raise FileNotFoundError(f"上传目录不存在: {UPLOAD_DIR}")
-
-    search_patterns = [UPLOAD_DIR / sub for sub in UPLOAD_SUBDIRS if (UPLOAD_DIR / sub).exists()]
-    candidates: list[Path] = []
-    for folder in search_patterns:
-        candidates.extend(folder.glob(f"{file_id}.*"))
-
-    if not candidates:
-        candidates = list(UPLOAD_DIR.glob(f"**/{file_id}.*"))
-
-    # If still not found, try test_image directory (for local testing)
-    if not candidates:
-        test_image_dir = Path("test_image")
-        if test_image_dir.exists():
-            # Try exact filename match
-            test_file = test_image_dir / file_id
-            if test_file.exists():
-                print(f"[resolve_uploaded_file] Using test image: {test_file}")
-                return test_file
-            # Try with wildcard (e.g., "test_001" → "test_001.jpg")
-            test_candidates = list(test_image_dir.glob(f"{file_id}.*"))
-            if test_candidates:
-                print(f"[resolve_uploaded_file] Using test image: {test_candidates[0]}")
-                return test_candidates[0]
-
-    if not candidates:
+    # Standard flow: file index lookup (in-process LRU -> Redis), O(1)
+    file_index = get_file_index()
+    if file_index.is_missing(file_id):
         raise FileNotFoundError(f"未找到对应文件: {file_id}")
+    indexed_path = file_index.lookup(file_id)
+    if indexed_path:
+        candidate = UPLOAD_DIR / indexed_path
+        if candidate.is_file():
+            return candidate
+        # 对象存储：下载到本地缓存（API 与 Worker 无需共享磁盘）
+        if is_remote_storage():
+            try:
+                get_storage().download_to_path(indexed_path, str(candidate))
+                return candidate
+            except Exception as e:
+                print(f"[resolve_uploaded_file] 从对象存储下载失败: {indexed_path}: {e}")
+                raise FileNotFoundError(f"未找到对应文件: {file_id}")
+        # 索引过期（文件已被删除或迁移）
+        file_index.forget(file_id)
+
+    # Fallback: uploads from before the index existed
+    # 分片目录由 file_id 决定，只需查看几个小目录；其次是旧的平铺目录（不递归扫描整个上传目录）
+    relative_path = get_local_storage().find_file(file_id, UPLOAD_SUBDIRS)
+    if relative_path:
+        # 回填索引，下次直接命中
+        file_index.record(file_id, relative_path)
+        return UPLOAD_DIR / relative_path
 
-    return candidates[0]
+    # If still not found, try test_image directory (for local testing)
+    test_image_dir = Path("test_image")
+    if test_image_dir.exists():
+        # Try exact filename match
+        test_file = test_image_dir / file_id
+        if test_file.exists():
+            print(f"[resolve_uploaded_file] Using test image: {test_file}")
+            return test_file
+        # Try with wildcard (e.g., "test_001" → "test_001.jpg")
+        test_candidates = list(test_image_dir.glob(f"{file_id}.*"))
+        if test_candidates:
+            print(f"[resolve_uploaded_file] Using test image: {test_candidates[0]}")
+            return test_candidates[0]
+
+    file_index.mark_missing(file_id)
+    raise FileNotFoundError(f"未找到对应文件: {file_id}")
 
 
 def copy_image_to_results(source_path: Path, filename: Optional[str] = None) -> Path:
@@ -101,12 +118,26 @@ def create_comparison_image(before_path: Path, after_path: Path, filename: str)
         Path: 生成文件路径
     """
     RESULTS_DIR.mkdir(parents=True, exist_ok=True)
-    before = Image.open(before_path).convert("RGB")
-    after = Image.open(after_path).convert("RGB")
+    with Image.open(before_path) as before, Image.open(after_path) as after:
+        canvas = compose_comparison(before, after, max(before.height, after.height))
+
+    target_path = RESULTS_DIR / filename
+    canvas.save(target_path, format="JPEG", quality=95)
+    return target_path
 
-    target_height = max(before.height, after.height)
-    before = _resize_with_height(before, target_height)
-    after = _resize_with_height(after, target_height)
+
+def compose_comparison(before: Image.Image, after: Image.Image, target_height: int) -> Image.Image:
+    """
+    拼接对比图（左右拼接，中间分隔线）
+    Args:
+        before: 原图
+        after: 结果图
+        target_height: 对比图高度
+    Returns:
+        Image.Image: 对比图
+    """
+    before = _resize_with_height(before.convert("RGB"), target_height)
+    after = _resize_with_height(after.convert("RGB"), target_height)
 
     canvas = Image.new("RGB", (before.width + after.width, target_height), color=(0, 0, 0))
     canvas.paste(before, (0, 0))
@@ -116,10 +147,7 @@ def create_comparison_image(before_path: Path, after_path: Path, filename: str)
     draw = ImageDraw.Draw(canvas)
     draw.line([(divider_x, 0), (divider_x, target_height)], fill=(255, 255, 255), width=6)
     draw.line([(divider_x, 0), (divider_x, target_height)], fill=(0, 0, 0), width=2)
-
-    target_path = RESULTS_DIR / filename
-    canvas.save(target_path, format="JPEG", quality=95)
-    return target_path
+    return canvas
 
 
 def _resize_with_height(image: Image.Image, target_height: int) -> Image.Image:
@@ -128,5 +156,5 @@ def _resize_with_height(image: Image.Image, target_height: int) -> Image.Image:
         return image
     ratio = target_height / image.height
     target_width = max(1, int(image.width * ratio))
-    return image.resize((target_width, target_height), Image.Resampling.LANCZOS)
+    return image.resize((target_width, target_height), Image.Resampling.LANCZOS, reducing_gap=3.0)
 
@@ -2,16 +2,20 @@
 换姿势 Pipeline
 负责 AI 姿势迁移的完整流程
 """
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from pathlib import Path
 
+from PIL import Image
+
 from app.services.image.pipelines.base import PipelineBase
 from app.services.image.dto import EditTaskInput, EditTaskResult, PoseChangeConfig
 from app.services.image.enums import ProcessingStep
 from app.services.image.engines.registry import get_engine_registry
-from app.services.image.image_assets import resolve_uploaded_file, copy_image_to_results
+from app.services.image.image_assets import resolve_uploaded_file
 from app.core.config import settings
 from app.core.error_codes import TaskErrorCode
+from app.services.image.renditions import render_renditions
+from app.utils.image_io import WEB_IMAGE_FORMATS, read_image_header, save_image
 
 
 class PoseChangePipeline(PipelineBase):
@@ -172,8 +176,11 @@ class PoseChangePipeline(PipelineBase):
                 "pose_image": str(pose_path)
             }
             
-            # 执行工作流
-            result = self.comfyui_engine.execute(input_data)
+            # 执行工作流（节点级进度映射到 30%-75%，同步轮询 Engine 会忽略该回调）
+            def engine_progress(progress: int, step: str):
+                self._update_progress(30 + progress * 45 // 100, step)
+            
+            result = self.comfyui_engine.execute(input_data, progress_callback=engine_progress)
             
         except Exception as e:
             self._log_step(ProcessingStep.COMPLETE, f"AI 引擎执行失败: {e}")
@@ -214,63 +221,43 @@ class PoseChangePipeline(PipelineBase):
                     error_code=TaskErrorCode.COMFYUI_RESULT_NOT_FOUND.value
                 )
             
-            # 下载图片到本地
-            import requests
-            import io
-            from app.utils.image_io import save_image, load_image, create_thumbnail
-            from PIL import Image
-            
-            response = requests.get(output_url, timeout=60)
-            response.raise_for_status()
-            
-            # 保存输出图片
-            output_filename = f"{task_id}_output.jpg"
-            output_path = Path(settings.RESULT_DIR) / output_filename
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            # 从响应中读取图片并保存
-            output_img = Image.open(io.BytesIO(response.content))
-            save_image(output_img, str(output_path), format="JPEG", quality=95)
+            # 流式下载到 RESULT_DIR（复用 Engine 的连接池，不在内存中解码）
+            output_path, _, _, _ = self._download_result(
+                output_image_info, task_id, "output"
+            )
+            output_filename = output_path.name
             
             # 下载对比图片（如果有）
-            comparison_path = None
             comparison_filename = None
-            if comparison_image_info:
-                comparison_url = comparison_image_info.get("url")
-                if comparison_url:
-                    try:
-                        comp_response = requests.get(comparison_url, timeout=60)
-                        comp_response.raise_for_status()
-                        comparison_filename = f"{task_id}_comparison.jpg"
-                        comparison_path = Path(settings.RESULT_DIR) / comparison_filename
-                        comp_img = Image.open(io.BytesIO(comp_response.content))
-                        save_image(comp_img, str(comparison_path), format="JPEG", quality=95)
-                    except Exception as e:
-                        self._log_step(ProcessingStep.COMPLETE, f"下载对比图片失败: {e}")
+            if comparison_image_info and comparison_image_info.get("url"):
+                try:
+                    comparison_path, _, _, _ = self._download_result(
+                        comparison_image_info, task_id, "comparison"
+                    )
+                    comparison_filename = comparison_path.name
+                except Exception as e:
+                    self._log_step(ProcessingStep.COMPLETE, f"下载对比图片失败: {e}")
             
-            # 生成缩略图
-            thumbnail_path = None
-            try:
-                thumbnail = create_thumbnail(output_img, (256, 256))
-                thumbnail_filename = f"{task_id}_thumb.jpg"
-                thumbnail_path_obj = Path(settings.RESULT_DIR) / thumbnail_filename
-                save_image(thumbnail, str(thumbnail_path_obj), format="JPEG", quality=85)
-                thumbnail_path = f"/results/{thumbnail_filename}"
-            except Exception as e:
-                self._log_step(ProcessingStep.COMPLETE, f"生成缩略图失败: {e}")
+            # 一次解码生成缩略图、预览图（ComfyUI 未输出对比图时同时生成对比图）
+            renditions = render_renditions(
+                task_id,
+                output_path,
+                before_path=None if comparison_filename else source_path
+            )
+            if renditions.url("comparison"):
+                comparison_filename = renditions.files["comparison"].name
             
             # Step 4: 完成 (100%)
             self._update_progress(100, "处理完成")
             
+            metadata = renditions.to_metadata()
+            metadata["pose_type"] = "custom"
+            
             return self._create_success_result(
                 output_image=f"/results/{output_filename}",
-                thumbnail=thumbnail_path,
+                thumbnail=renditions.url("thumbnail"),
                 comparison_image=f"/results/{comparison_filename}" if comparison_filename else None,
-                metadata={
-                    "width": output_img.width,
-                    "height": output_img.height,
-                    "pose_type": "custom"
-                }
+                metadata=metadata
             )
             
         except Exception as e:
@@ -280,4 +267,38 @@ class PoseChangePipeline(PipelineBase):
                 error_code=TaskErrorCode.RESULT_SAVE_FAILED.value
             )
     
-
+    def _download_result(self, image_info: Dict, task_id: str, name: str) -> Tuple[Path, str, int, int]:
+        """
+        流式下载 ComfyUI 结果图片到 RESULT_DIR
+        
+        保留 ComfyUI 输出的原始编码，只有非 Web 格式（如 TIFF、BMP）才转码为 JPEG；
+        尺寸从文件头读取。
+        
+        Args:
+            image_info: ComfyUI 输出图片信息（filename、url）
+            task_id: 任务ID
+            name: 结果名称（output / comparison）
+            
+        Returns:
+            Tuple[Path, str, int, int]: (文件路径, 格式, 宽度, 高度)
+        """
+        result_dir = Path(settings.RESULT_DIR)
+        suffix = Path(image_info.get("filename") or "").suffix.lower() or ".png"
+        download_path = result_dir / f"{task_id}_{name}{suffix}"
+        self.comfyui_engine.download_image(image_info, str(download_path), timeout=60)
+        
+        image_format, width, height = read_image_header(str(download_path))
+        
+        if image_format in WEB_IMAGE_FORMATS:
+            # 扩展名与实际格式不一致时只改名，不转码
+            target_path = result_dir / f"{task_id}_{name}{WEB_IMAGE_FORMATS[image_format]}"
+            if target_path != download_path:
+                download_path.replace(target_path)
+            return target_path, image_format, width, height
+        
+        # 格式必须转换：转码为 JPEG
+        target_path = result_dir / f"{task_id}_{name}.jpg"
+        with Image.open(download_path) as image:
+            save_image(image, str(target_path), format="JPEG", quality=95)
+        download_path.unlink(missing_ok=True)
+        return target_path, "JPEG", width, height
@@ -0,0 +1,174 @@
+"""
+结果衍生图渲染
+每张输入只解码一次（JPEG 按所需最大尺寸使用 draft 模式降采样解码），
+一次生成原图、缩略图、对比图与 WebP 预览图，并记录每种衍生图的耗时
+"""
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from PIL import Image
+
+from app.core.config import settings
+from app.services.image.image_assets import RESULTS_DIR, compose_comparison
+from app.utils.image_io import WEB_IMAGE_FORMATS, decode_image, fit_image, save_image
+
+
+class RenditionResult:
+    """衍生图渲染结果"""
+
+    def __init__(self, width: int, height: int, image_format: str):
+        self.width = width
+        self.height = height
+        self.format = image_format
+        self.files: Dict[str, Path] = {}
+        self.timings: Dict[str, float] = {}
+
+    def url(self, name: str) -> Optional[str]:
+        """衍生图访问路径（/results/...），未生成返回 None"""
+        path = self.files.get(name)
+        return f"/results/{path.name}" if path else None
+
+    def to_metadata(self) -> dict:
+        """
+        转换为任务结果元数据
+
+        Returns:
+            dict: 尺寸、格式、各衍生图路径与耗时（毫秒）
+        """
+        return {
+            "width": self.width,
+            "height": self.height,
+            "format": self.format.lower(),
+            "renditions": {name: self.url(name) for name in self.files},
+            "rendition_timings_ms": self.timings,
+        }
+
+
+def _place_full(task_id: str, output_path: Path, image_format: str) -> Path:
+    """
+    将原图放入 RESULT_DIR（已在其中则不动；否则硬链接，跨文件系统时复制）
+
+    Args:
+        task_id: 任务ID
+        output_path: 原图路径
+        image_format: 原图格式
+
+    Returns:
+        Path: RESULT_DIR 中的原图路径
+    """
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    if output_path.resolve().parent == RESULTS_DIR.resolve():
+        return output_path
+
+    suffix = WEB_IMAGE_FORMATS.get(image_format) or output_path.suffix.lower() or ".jpg"
+    target_path = RESULTS_DIR / f"{task_id}_output{suffix}"
+    target_path.unlink(missing_ok=True)
+    try:
+        os.link(output_path, target_path)
+    except OSError:
+        shutil.copyfile(output_path, target_path)
+    return target_path
+
+
+def render_renditions(
+    task_id: str,
+    output_path: Path,
+    before_path: Optional[Path] = None,
+    renditions: Optional[Iterable[str]] = None
+) -> RenditionResult:
+    """
+    生成结果衍生图
+
+    原图不重新编码；结果图与原始图各解码一次，解码尺寸取所有衍生图所需的最大尺寸，
+    缩略图在预览图的基础上继续缩小。
+
+    Args:
+        task_id: 任务ID
+        output_path: 结果图路径
+        before_path: 原始图路径（生成对比图时需要）
+        renditions: 需要生成的衍生图（thumbnail / comparison / preview），默认读取 RESULT_RENDITIONS
+
+    Returns:
+        RenditionResult: 渲染结果
+    """
+    wanted = set(settings.get_result_renditions if renditions is None else renditions)
+    wanted.discard("full")
+    if not before_path:
+        wanted.discard("comparison")
+
+    output_path = Path(output_path)
+    with Image.open(output_path) as header:
+        result = RenditionResult(header.width, header.height, header.format or "Unknown")
+
+    def timed(name: str, start: float):
+        result.timings[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    # 原图
+    start = time.perf_counter()
+    result.files["full"] = _place_full(task_id, output_path, result.format)
+    timed("full", start)
+
+    if not wanted:
+        return result
+
+    # 各衍生图所需的缩放比例（相对结果图）
+    longest = max(result.width, result.height)
+    scales = []
+    if "preview" in wanted:
+        scales.append(min(1.0, settings.PREVIEW_MAX_SIZE / longest))
+    if "thumbnail" in wanted:
+        scales.append(min(1.0, settings.THUMBNAIL_SIZE / longest))
+    comparison_height = 0
+    if "comparison" in wanted:
+        with Image.open(before_path) as before_header:
+            before_size = before_header.size
+        comparison_height = min(max(before_size[1], result.height), settings.COMPARISON_MAX_HEIGHT)
+        scales.append(min(1.0, comparison_height / result.height))
+
+    # 结果图只解码一次
+    start = time.perf_counter()
+    after = decode_image(output_path, max(scales))
+    timed("decode", start)
+
+    def render_preview() -> Image.Image:
+        preview = fit_image(after, settings.PREVIEW_MAX_SIZE)
+        path = RESULTS_DIR / f"{task_id}_preview.webp"
+        save_image(preview, str(path), format="WEBP", quality=settings.PREVIEW_QUALITY)
+        result.files["preview"] = path
+        return preview
+
+    def render_thumbnail():
+        source = preview if preview is not None and max(preview.size) >= settings.THUMBNAIL_SIZE else after
+        path = RESULTS_DIR / f"{task_id}_thumb.jpg"
+        save_image(fit_image(source, settings.THUMBNAIL_SIZE), str(path), format="JPEG", quality=85)
+        result.files["thumbnail"] = path
+
+    def render_comparison():
+        before = decode_image(before_path, min(1.0, comparison_height / before_size[1]))
+        canvas = compose_comparison(before, after, comparison_height)
+        path = RESULTS_DIR / f"{task_id}_comparison.jpg"
+        save_image(canvas, str(path), format="JPEG", quality=95)
+        result.files["comparison"] = path
+
+    # 衍生图失败不影响原图结果
+    preview = None
+    for name, render in (("preview", render_preview), ("thumbnail", render_thumbnail), ("comparison", render_comparison)):
+        if name not in wanted:
+            continue
+        start = time.perf_counter()
+        try:
+            rendered = render()
+            if name == "preview":
+                preview = rendered
+        except Exception as e:
+            print(f"[Renditions] 生成 {name} 失败: {e}")
+        timed(name, start)
+
+    print(
+        f"[Renditions] {task_id} {result.width}x{result.height} " +
+        ", ".join(f"{name}={ms}ms" for name, ms in result.timings.items())
+    )
+    return result
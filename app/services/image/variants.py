@@ -0,0 +1,257 @@
+"""
+图片按需缩放与磁盘缓存
+按允许的宽度生成 WebP/JPEG 缩放图，缓存在本地磁盘（总大小超限时按最近最少使用淘汰），
+重复请求直接返回缓存文件，不再重新编码
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image
+
+from app.core.config import settings
+from app.services.image.image_assets import RESULTS_DIR, UPLOAD_DIR, UPLOAD_SUBDIRS
+from app.services.storage.file_index import get_file_index
+from app.services.storage.local_storage import get_local_storage
+from app.services.tasks.queue import get_task_queue
+from app.utils.image_io import decode_image, save_image
+
+
+# 支持的输出格式 -> (PIL 格式, 扩展名, Content-Type)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", ".webp", "image/webp"),
+    "jpeg": ("JPEG", ".jpg", "image/jpeg"),
+    "jpg": ("JPEG", ".jpg", "image/jpeg"),
+}
+
+# 图片 ID 只允许字母、数字、下划线与短横线（防止路径穿越）
+_IMAGE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+# 结果文件名: {task_id}_{名称}（如 task_1234567890_abc123_output）
+_RESULT_ID_PATTERN = re.compile(r"^(task_\d+_[a-z0-9]+)_[a-z]+$")
+
+
+class ImageVariant:
+    """缩放图（缓存文件）"""
+
+    def __init__(self, path: Path, etag: str, media_type: str, width: int, cache_hit: bool):
+        self.path = path
+        self.etag = etag
+        self.media_type = media_type
+        self.width = width
+        self.cache_hit = cache_hit
+
+
+class ImageVariantCache:
+    """缩放图 LRU 磁盘缓存"""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        """
+        初始化缓存（扫描已有缓存文件，按访问时间恢复 LRU 顺序）
+
+        Args:
+            cache_dir: 缓存目录（默认 IMAGE_VARIANT_CACHE_DIR）
+            max_bytes: 缓存总大小上限（默认 IMAGE_VARIANT_CACHE_MAX_MB）
+        """
+        self.cache_dir = Path(cache_dir or settings.IMAGE_VARIANT_CACHE_DIR)
+        self.max_bytes = max_bytes if max_bytes is not None else settings.IMAGE_VARIANT_CACHE_MAX_MB * 1024 * 1024
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # 文件名 -> 字节数（最近使用的在末尾）
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        existing = []
+        for path in self.cache_dir.iterdir():
+            if path.is_file() and not path.name.startswith("."):
+                stat = path.stat()
+                existing.append((stat.st_atime, path.name, stat.st_size))
+        for _, name, size in sorted(existing):
+            self._entries[name] = size
+            self._total_bytes += size
+        self._evict()
+
+    @staticmethod
+    def find_original(image_id: str) -> Optional[Path]:
+        """
+        查找原图（结果图从任务结果解析，上传图查询文件索引；不扫描目录，含同步 Redis 查询，需在线程池中调用）
+
+        Args:
+            image_id: 结果文件名（不含扩展名，如 task_xxx_output）或上传 file_id
+
+        Returns:
+            Optional[Path]: 原图路径，不存在返回 None
+        """
+        if not _IMAGE_ID_PATTERN.match(image_id):
+            return None
+
+        match = _RESULT_ID_PATTERN.match(image_id)
+        if match:
+            return ImageVariantCache._find_result(match.group(1), image_id)
+
+        file_index = get_file_index()
+        if file_index.is_missing(image_id):
+            return None
+        indexed_path = file_index.lookup(image_id)
+        if indexed_path and (UPLOAD_DIR / indexed_path).is_file():
+            return UPLOAD_DIR / indexed_path
+
+        # 未记录索引的上传文件（分片目录或旧的平铺目录）
+        relative_path = get_local_storage().find_file(image_id, UPLOAD_SUBDIRS)
+        if not relative_path:
+            file_index.mark_missing(image_id)
+            return None
+        return UPLOAD_DIR / relative_path
+
+    @staticmethod
+    def _find_result(task_id: str, image_id: str) -> Optional[Path]:
+        """从任务结果中的 /results/... 路径定位结果图（扩展名由结果记录决定）"""
+        task_data = get_task_queue().get_task_data(task_id)
+        result = task_data.get("result") if task_data else None
+        if not result:
+            return None
+
+        result = json.loads(result)
+        urls = [result.get(field) for field in ("output_image", "thumbnail", "comparison_image")]
+        urls += list(((result.get("metadata") or {}).get("renditions") or {}).values())
+        for url in urls:
+            if isinstance(url, str) and url.startswith("/results/"):
+                candidate = RESULTS_DIR / Path(url).name
+                if candidate.stem == image_id and candidate.is_file():
+                    return candidate
+        return None
+
+    @staticmethod
+    def snap_width(width: int) -> int:
+        """请求宽度向上取到最近的允许宽度（超过最大值时取最大值）"""
+        widths = settings.get_image_variant_widths
+        for allowed in widths:
+            if allowed >= width:
+                return allowed
+        return widths[-1]
+
+    def get_variant(self, source: Path, width: int, fmt: str) -> ImageVariant:
+        """
+        获取缩放图（命中缓存直接返回，否则生成并写入缓存）
+
+        Args:
+            source: 原图路径
+            width: 允许的宽度（由 snap_width 得到）
+            fmt: 输出格式（webp / jpeg）
+
+        Returns:
+            ImageVariant: 缩放图
+        """
+        pil_format, extension, media_type = VARIANT_FORMATS[fmt]
+        quality = settings.IMAGE_VARIANT_QUALITY
+        stat = source.stat()
+
+        # 原图变化（mtime / 大小）后缓存键随之变化，旧文件由 LRU 自然淘汰
+        key = f"{source.resolve()}:{stat.st_mtime_ns}:{stat.st_size}:{width}:{pil_format}:{quality}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+        name = f"{source.stem}-w{width}-{digest}{extension}"
+        path = self.cache_dir / name
+        etag = f'"{digest}"'
+
+        with self._lock:
+            if name in self._entries and path.exists():
+                self._entries.move_to_end(name)
+                self.hits += 1
+                hit = True
+            else:
+                self._entries.pop(name, None)
+                self.misses += 1
+                hit = False
+
+        if hit:
+            try:
+                os.utime(path)  # 更新访问时间，重启后仍能恢复 LRU 顺序
+            except OSError:
+                pass
+            return ImageVariant(path, etag, media_type, width, cache_hit=True)
+
+        size = self._render(source, path, width, pil_format, quality)
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = size
+                self._total_bytes += size
+            self._evict()
+        return ImageVariant(path, etag, media_type, width, cache_hit=False)
+
+    @staticmethod
+    def _render(source: Path, path: Path, width: int, pil_format: str, quality: int) -> int:
+        """
+        生成缩放图（JPEG 使用 draft 模式按目标宽度解码；写入临时文件后原子重命名）
+
+        Returns:
+            int: 文件字节数
+        """
+        with Image.open(source) as header:
+            source_width = header.width
+        image = decode_image(str(source), min(1.0, width / source_width))
+        if image.width > width:
+            # 只缩小不放大
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+        fd, temp_path = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".part")
+        os.close(fd)
+        try:
+            save_image(image, temp_path, format=pil_format, quality=quality)
+            os.replace(temp_path, path)
+        except BaseException:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+        return path.stat().st_size
+
+    def _evict(self):
+        """淘汰最近最少使用的缓存文件直到总大小不超过上限（调用方持有锁）"""
+        while self._total_bytes > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                (self.cache_dir / name).unlink()
+            except OSError:
+                pass
+
+    def get_stats(self) -> dict:
+        """
+        获取缓存统计
+
+        Returns:
+            dict: 文件数、总大小、命中/未命中/淘汰次数
+        """
+        with self._lock:
+            return {
+                "files": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# 全局单例
+_variant_cache_instance: Optional[ImageVariantCache] = None
+_variant_cache_lock = threading.Lock()
+
+
+def get_image_variant_cache() -> ImageVariantCache:
+    """获取缩放图缓存单例"""
+    global _variant_cache_instance
+    if _variant_cache_instance is None:
+        with _variant_cache_lock:
+            if _variant_cache_instance is None:
+                _variant_cache_instance = ImageVariantCache()
+    return _variant_cache_instance
@@ -2,6 +2,14 @@
 存储服务模块
 """
 from app.services.storage.local_storage import LocalStorage, get_local_storage
+from app.services.storage.file_index import FileIndex, get_file_index
+from app.services.storage.factory import get_storage, is_remote_storage
+from app.services.storage.direct_upload import verify_direct_upload
 
-__all__ = ["LocalStorage", "get_local_storage"]
+__all__ = [
+    "LocalStorage", "get_local_storage",
+    "FileIndex", "get_file_index",
+    "get_storage", "is_remote_storage",
+    "verify_direct_upload",
+]
 
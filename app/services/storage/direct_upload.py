@@ -0,0 +1,78 @@
+"""
+客户端直传文件校验
+预签名 POST 只在对象存储侧限制大小与 Content-Type，对象内容仍由客户端决定：
+file_id 用于任务之前读取对象大小与文件头，按魔数识别格式并解析尺寸，
+通过后重新记录文件索引（去掉 pending 标记），未通过的对象与索引直接删除
+"""
+import asyncio
+from pathlib import PurePosixPath
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.services.storage.factory import get_storage
+from app.services.storage.file_index import get_file_index
+from app.utils.image_io import WEB_IMAGE_FORMATS, probe_image_header, sniff_image_format
+
+
+# 解析图片尺寸时读取的文件头字节数（与普通上传的 HEADER_PROBE_LIMIT 一致）
+HEADER_READ_BYTES = 512 * 1024
+
+
+def verify_direct_upload(file_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, str]]:
+    """
+    校验客户端直传的文件（含同步 Redis 与对象存储请求，需在线程池中调用）
+
+    非直传文件（普通上传、未记录索引的旧文件）原样返回，不做额外请求。
+
+    Args:
+        file_id: 文件ID
+        user_id: 当前用户ID（直传记录属于其他用户时视为不存在）
+
+    Returns:
+        Optional[Dict[str, str]]: 校验后的文件记录，未记录索引返回 None
+
+    Raises:
+        ValueError: 文件尚未上传、不属于当前用户或内容不合法
+    """
+    file_index = get_file_index()
+    info = file_index.get_info(file_id)
+    if not info or info.get("pending") != "1":
+        return info
+
+    if user_id and info.get("user_id") and info["user_id"] != user_id:
+        raise ValueError(f"文件不存在: {file_id}")
+
+    storage = get_storage()
+    try:
+        size, header = storage.read_header(info["path"], HEADER_READ_BYTES)
+    except FileNotFoundError:
+        raise ValueError(f"文件尚未上传完成: {file_id}")
+
+    image_format = sniff_image_format(header)
+    probed = probe_image_header(header) if image_format else None
+    error = None
+    if size > settings.MAX_UPLOAD_SIZE:
+        error = f"文件大小超过限制（最大 {settings.MAX_UPLOAD_SIZE // (1024 * 1024)}MB）"
+    elif image_format is None or WEB_IMAGE_FORMATS[image_format] != PurePosixPath(info["path"]).suffix:
+        error = "文件内容与声明的格式不符。支持的格式: JPG, PNG, WEBP"
+    elif probed is None:
+        error = "无法解析图片文件头，文件可能已损坏"
+
+    if error:
+        print(f"[DirectUpload] 直传文件校验失败，已删除: {file_id}: {error}")
+        asyncio.run(storage.delete_file(info["path"]))
+        file_index.forget(file_id)
+        raise ValueError(error)
+
+    _, width, height = probed
+    file_index.record(
+        file_id,
+        info["path"],
+        size=size,
+        width=width,
+        height=height,
+        image_format=image_format.lower(),
+        purpose=info.get("purpose"),
+        user_id=info.get("user_id")
+    )
+    return file_index.get_info(file_id)
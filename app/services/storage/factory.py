@@ -0,0 +1,31 @@
+"""
+存储实例工厂
+按 STORAGE_TYPE 选择存储实现：local（本地文件系统）/ oss、s3（S3 兼容对象存储）
+"""
+from typing import Optional
+
+from app.core.config import settings
+from app.services.storage.interface import StorageInterface
+from app.services.storage.local_storage import get_local_storage
+
+
+# 全局存储实例（单例）
+_storage_instance: Optional[StorageInterface] = None
+
+
+def is_remote_storage() -> bool:
+    """是否使用对象存储（文件不在本地磁盘）"""
+    return settings.STORAGE_TYPE.lower() in ("oss", "s3")
+
+
+def get_storage() -> StorageInterface:
+    """获取当前配置的存储实例（单例）"""
+    global _storage_instance
+    if _storage_instance is None:
+        if is_remote_storage():
+            # 仅在使用对象存储时才需要 boto3
+            from app.services.storage.s3_storage import S3Storage
+            _storage_instance = S3Storage()
+        else:
+            _storage_instance = get_local_storage()
+    return _storage_instance
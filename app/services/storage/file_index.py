@@ -0,0 +1,263 @@
+"""
+上传文件索引
+上传时把 file_id 对应的相对路径、大小、尺寸、内容哈希记录到 Redis Hash，
+解析 file_id 时一次查询即可定位文件（前置进程内 LRU），不再扫描上传目录；
+未找到的 file_id 在进程内短暂缓存，重复的无效 ID 不会反复查询
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.utils.redis_client import get_async_redis_client, get_redis_client
+
+
+class FileIndex:
+    """上传文件索引（Redis Hash + 进程内 LRU）"""
+
+    KEY_PREFIX = "formy:file:"  # {file_id} -> Hash(path, size, width, height, format, sha256, purpose, uploaded_at, last_used_at, pending, user_id)
+    PENDING_TTL = 86400  # 未校验的直传记录保留时间（秒），客户端放弃上传时自动过期
+
+    # 记录最近一次被任务引用的时间（只更新已有记录，不为未记录索引的 ID 创建空记录）
+    # KEYS: 文件记录; ARGV[1]: 时间
+    _TOUCH_SCRIPT = """
+    for _, key in ipairs(KEYS) do
+        if redis.call('EXISTS', key) == 1 then
+            redis.call('HSET', key, 'last_used_at', ARGV[1])
+        end
+    end
+    return 1
+    """
+
+    def __init__(self, cache_size: Optional[int] = None):
+        """
+        初始化索引
+
+        Args:
+            cache_size: 进程内 LRU 容量（默认 FILE_INDEX_CACHE_SIZE）
+        """
+        self.cache_size = cache_size if cache_size is not None else settings.FILE_INDEX_CACHE_SIZE
+        self.miss_ttl = settings.FILE_INDEX_MISS_TTL
+        self._cache: "OrderedDict[str, str]" = OrderedDict()  # file_id -> 相对路径
+        self._missing: "OrderedDict[str, float]" = OrderedDict()  # 未找到的 file_id -> 过期时间（monotonic）
+        self._lock = threading.Lock()
+        self._redis = None
+        self._touch_script = None
+        self._async_touch_script = None
+
+    @property
+    def redis_client(self):
+        """懒加载 Redis 客户端（Redis 不可用时索引失效，解析回退为目录扫描）"""
+        if self._redis is None:
+            self._redis = get_redis_client()
+        return self._redis
+
+    def _key(self, file_id: str) -> str:
+        return f"{self.KEY_PREFIX}{file_id}"
+
+    def _remember(self, file_id: str, path: str):
+        """写入进程内 LRU"""
+        with self._lock:
+            self._missing.pop(file_id, None)
+            self._cache[file_id] = path
+            self._cache.move_to_end(file_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def mark_missing(self, file_id: str):
+        """
+        记录未找到的 file_id（FILE_INDEX_MISS_TTL 秒内 is_missing 返回 True；记录文件后立即失效）
+
+        Args:
+            file_id: 文件ID
+        """
+        if self.miss_ttl <= 0:
+            return
+        with self._lock:
+            self._missing[file_id] = time.monotonic() + self.miss_ttl
+            self._missing.move_to_end(file_id)
+            while len(self._missing) > self.cache_size:
+                self._missing.popitem(last=False)
+
+    def is_missing(self, file_id: str) -> bool:
+        """
+        file_id 是否在近期被确认不存在
+
+        Args:
+            file_id: 文件ID
+
+        Returns:
+            bool: 是否仍在未找到缓存中
+        """
+        with self._lock:
+            expires = self._missing.get(file_id)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._missing[file_id]
+                return False
+            return True
+
+    def record(
+        self,
+        file_id: str,
+        path: str,
+        size: Optional[int] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        image_format: Optional[str] = None,
+        sha256: Optional[str] = None,
+        purpose: Optional[str] = None,
+        pending: bool = False,
+        user_id: Optional[str] = None
+    ):
+        """
+        记录上传文件（覆盖同一 file_id 的旧记录）
+
+        Args:
+            file_id: 文件ID
+            path: 相对上传目录的路径（如 source/ab/cd/file_xxx.jpg）
+            size: 文件大小（字节）
+            width: 图片宽度
+            height: 图片高度
+            image_format: 图片格式
+            sha256: 内容哈希
+            purpose: 用途
+            pending: 客户端直传、尚未校验（校验通过后重新记录；PENDING_TTL 秒后过期）
+            user_id: 发起直传的用户ID
+        """
+        mapping: Dict[str, Any] = {
+            "path": path,
+            "size": size,
+            "width": width,
+            "height": height,
+            "format": image_format,
+            "sha256": sha256,
+            "purpose": purpose,
+            "uploaded_at": datetime.now().isoformat(),
+            "pending": "1" if pending else None,
+            "user_id": user_id,
+        }
+        mapping = {key: value for key, value in mapping.items() if value is not None}
+
+        self._remember(file_id, path)
+        try:
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.delete(self._key(file_id))
+            pipe.hset(self._key(file_id), mapping=mapping)
+            if pending:
+                pipe.expire(self._key(file_id), self.PENDING_TTL)
+            pipe.execute()
+        except Exception as e:
+            print(f"[FileIndex] 记录文件索引失败: {file_id}: {e}")
+
+    def update_path(self, file_id: str, path: str):
+        """
+        更新文件路径（文件迁移后调用，保留其他字段）
+
+        Args:
+            file_id: 文件ID
+            path: 新的相对路径
+        """
+        self._remember(file_id, path)
+        try:
+            self.redis_client.hset(self._key(file_id), "path", path)
+        except Exception as e:
+            print(f"[FileIndex] 更新文件索引失败: {file_id}: {e}")
+
+    def touch(self, file_ids: List[str]):
+        """
+        记录文件被任务引用（保留期清理只删除最近一次引用也早于截止时间的上传文件）
+
+        Args:
+            file_ids: 文件ID列表
+        """
+        if not file_ids:
+            return
+        try:
+            if self._touch_script is None:
+                self._touch_script = self.redis_client.register_script(self._TOUCH_SCRIPT)
+            self._touch_script(keys=[self._key(file_id) for file_id in file_ids], args=[datetime.now().isoformat()])
+        except Exception as e:
+            print(f"[FileIndex] 记录文件引用失败: {file_ids}: {e}")
+
+    async def touch_async(self, file_ids: List[str]):
+        """记录文件被任务引用（异步版本，参数同 touch）"""
+        if not file_ids:
+            return
+        try:
+            if self._async_touch_script is None:
+                self._async_touch_script = get_async_redis_client().register_script(self._TOUCH_SCRIPT)
+            await self._async_touch_script(keys=[self._key(file_id) for file_id in file_ids], args=[datetime.now().isoformat()])
+        except Exception as e:
+            print(f"[FileIndex] 记录文件引用失败: {file_ids}: {e}")
+
+    def lookup(self, file_id: str) -> Optional[str]:
+        """
+        查询文件相对路径（先查进程内 LRU，再查 Redis）
+
+        Args:
+            file_id: 文件ID
+
+        Returns:
+            Optional[str]: 相对上传目录的路径，未记录返回 None
+        """
+        with self._lock:
+            path = self._cache.get(file_id)
+            if path is not None:
+                self._cache.move_to_end(file_id)
+                return path
+
+        try:
+            path = self.redis_client.hget(self._key(file_id), "path")
+        except Exception as e:
+            print(f"[FileIndex] 查询文件索引失败: {file_id}: {e}")
+            return None
+
+        if path:
+            self._remember(file_id, path)
+        return path
+
+    def get_info(self, file_id: str) -> Optional[Dict[str, str]]:
+        """
+        获取完整的文件记录
+
+        Args:
+            file_id: 文件ID
+
+        Returns:
+            Optional[Dict[str, str]]: 文件记录，未记录返回 None
+        """
+        try:
+            return self.redis_client.hgetall(self._key(file_id)) or None
+        except Exception as e:
+            print(f"[FileIndex] 查询文件索引失败: {file_id}: {e}")
+            return None
+
+    def forget(self, file_id: str):
+        """
+        删除文件记录（文件被删除或迁移后调用）
+
+        Args:
+            file_id: 文件ID
+        """
+        with self._lock:
+            self._cache.pop(file_id, None)
+        try:
+            self.redis_client.delete(self._key(file_id))
+        except Exception as e:
+            print(f"[FileIndex] 删除文件索引失败: {file_id}: {e}")
+
+
+# 全局单例
+_file_index_instance: Optional[FileIndex] = None
+
+
+def get_file_index() -> FileIndex:
+    """获取上传文件索引单例"""
+    global _file_index_instance
+    if _file_index_instance is None:
+        _file_index_instance = FileIndex()
+    return _file_index_instance
@@ -2,7 +2,7 @@
 存储接口定义
 """
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import AsyncIterator, Dict, Optional, Tuple
 
 
 class StorageInterface(ABC):
@@ -28,6 +28,30 @@ class StorageInterface(ABC):
         """
         pass
     
+    async def save_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        subdirectory: Optional[str] = None
+    ) -> Tuple[str, int]:
+        """
+        分块保存文件（默认实现拼接后调用 save_file，子类可覆盖为真正的流式写入）
+        
+        chunks 迭代过程中抛出的异常（如超出大小限制）会中止保存，不留下文件。
+        
+        Args:
+            chunks: 数据块异步迭代器
+            filename: 文件名
+            subdirectory: 子目录
+            
+        Returns:
+            Tuple[str, int]: (文件路径, 字节数)
+        """
+        data = bytearray()
+        async for chunk in chunks:
+            data.extend(chunk)
+        return await self.save_file(bytes(data), filename, subdirectory), len(data)
+    
     @abstractmethod
     async def get_file(self, file_path: str) -> bytes:
         """
@@ -79,4 +103,37 @@ class StorageInterface(ABC):
             bool: 是否存在
         """
         pass
-
+    
+    def generate_upload_url(
+        self,
+        filename: str,
+        subdirectory: Optional[str] = None,
+        content_type: Optional[str] = None,
+        max_size: Optional[int] = None
+    ) -> Dict[str, object]:
+        """
+        生成客户端直传 URL（对象存储实现；本地存储不支持）
+        
+        Args:
+            filename: 文件名
+            subdirectory: 子目录
+            content_type: 上传时必须携带的 Content-Type
+            max_size: 最大字节数
+            
+        Returns:
+            Dict: path、upload_url、method、fields、expires_in
+        """
+        raise NotImplementedError("当前存储不支持客户端直传")
+    
+    def read_header(self, file_path: str, length: int) -> Tuple[int, bytes]:
+        """
+        读取文件大小与开头的字节（校验客户端直传的文件；对象存储实现）
+        
+        Args:
+            file_path: 文件路径
+            length: 最多读取的字节数
+            
+        Returns:
+            Tuple[int, bytes]: (文件字节数, 开头的字节)
+        """
+        raise NotImplementedError("当前存储不支持客户端直传")
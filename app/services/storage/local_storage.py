@@ -1,26 +1,36 @@
 """
 本地文件系统存储实现
 """
+import hashlib
 import os
+import re
 import aiofiles
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Optional, Tuple
+
+from starlette.staticfiles import StaticFiles
 
 from app.services.storage.interface import StorageInterface
 from app.core.config import settings
 
 
+# 分片目录名（两位十六进制）
+SHARD_DIR_PATTERN = re.compile(r"^[0-9a-f]{2}$")
+
+
 class LocalStorage(StorageInterface):
     """本地文件系统存储"""
     
-    def __init__(self, base_dir: str = None):
+    def __init__(self, base_dir: str = None, shard_depth: Optional[int] = None):
         """
         初始化本地存储
         
         Args:
             base_dir: 基础存储目录
+            shard_depth: 分片目录层数（默认 UPLOAD_SHARD_DEPTH，0 表示不分片）
         """
         self.base_dir = base_dir or settings.UPLOAD_DIR
+        self.shard_depth = settings.UPLOAD_SHARD_DEPTH if shard_depth is None else shard_depth
         self._ensure_directory_exists(self.base_dir)
     
     def _ensure_directory_exists(self, directory: str):
@@ -31,6 +41,58 @@ class LocalStorage(StorageInterface):
         """获取完整路径"""
         return os.path.join(self.base_dir, file_path)
     
+    def shard_dir(self, file_id: str) -> str:
+        """
+        计算 file_id 的分片目录（如 ab/cd），由 file_id 的哈希决定，无需查表即可定位
+        
+        Args:
+            file_id: 文件ID（文件名去掉扩展名）
+            
+        Returns:
+            str: 分片目录（不分片时为空字符串）
+        """
+        digest = hashlib.md5(file_id.encode("utf-8")).hexdigest()
+        return "/".join(digest[i * 2:i * 2 + 2] for i in range(self.shard_depth))
+    
+    def build_relative_path(self, filename: str, subdirectory: Optional[str] = None) -> str:
+        """
+        构建文件的相对存储路径：{子目录}/{分片目录}/{文件名}
+        
+        Args:
+            filename: 文件名
+            subdirectory: 子目录
+            
+        Returns:
+            str: 相对路径（如 source/ab/cd/file_xxx.jpg）
+        """
+        parts = [subdirectory] if subdirectory else []
+        shard = self.shard_dir(Path(filename).stem)
+        if shard:
+            parts.append(shard)
+        parts.append(filename)
+        return "/".join(parts)
+    
+    def find_file(self, file_id: str, subdirectories: Tuple[str, ...] = ()) -> Optional[str]:
+        """
+        按 file_id 查找文件（先查分片目录，再查旧的平铺目录）
+        
+        Args:
+            file_id: 文件ID
+            subdirectories: 要查找的子目录
+            
+        Returns:
+            Optional[str]: 相对路径，未找到返回 None
+        """
+        shard = self.shard_dir(file_id)
+        subdirectories = tuple(subdirectories) or ("",)
+        folders = [os.path.join(sub, shard) for sub in subdirectories] if shard else []
+        folders += subdirectories
+        for folder in folders:
+            for candidate in Path(self.base_dir, folder).glob(f"{file_id}.*"):
+                if candidate.is_file() and not candidate.name.startswith("."):
+                    return candidate.relative_to(self.base_dir).as_posix()
+        return None
+    
     async def save_file(
         self, 
         file_data: bytes, 
@@ -48,15 +110,10 @@ class LocalStorage(StorageInterface):
         Returns:
             str: 相对文件路径
         """
-        # 构建保存路径
-        if subdirectory:
-            save_dir = os.path.join(self.base_dir, subdirectory)
-            self._ensure_directory_exists(save_dir)
-            relative_path = os.path.join(subdirectory, filename)
-        else:
-            relative_path = filename
-        
+        # 构建保存路径（按 file_id 哈希分片）
+        relative_path = self.build_relative_path(filename, subdirectory)
         full_path = self._get_full_path(relative_path)
+        self._ensure_directory_exists(os.path.dirname(full_path))
         
         # 异步写入文件
         async with aiofiles.open(full_path, 'wb') as f:
@@ -64,6 +121,42 @@ class LocalStorage(StorageInterface):
         
         return relative_path
     
+    async def save_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        subdirectory: Optional[str] = None
+    ) -> Tuple[str, int]:
+        """
+        分块保存文件到本地（写入同目录临时文件，完成后原子重命名）
+        
+        Args:
+            chunks: 数据块异步迭代器（迭代中抛出异常时删除临时文件并向上抛出）
+            filename: 文件名
+            subdirectory: 子目录
+            
+        Returns:
+            Tuple[str, int]: (相对文件路径, 字节数)
+        """
+        relative_path = self.build_relative_path(filename, subdirectory)
+        full_path = self._get_full_path(relative_path)
+        self._ensure_directory_exists(os.path.dirname(full_path))
+        temp_path = os.path.join(os.path.dirname(full_path), f".{filename}.part")
+        
+        size = 0
+        try:
+            async with aiofiles.open(temp_path, 'wb') as f:
+                async for chunk in chunks:
+                    await f.write(chunk)
+                    size += len(chunk)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        
+        return relative_path, size
+    
     async def get_file(self, file_path: str) -> bytes:
         """
         读取文件
@@ -132,6 +225,22 @@ class LocalStorage(StorageInterface):
         return os.path.exists(full_path)
 
 
+class ShardedStaticFiles(StaticFiles):
+    """
+    上传文件静态服务：旧的平铺路径（/uploads/source/file_xxx.jpg）找不到时，
+    按分片规则查找迁移后的文件，旧 URL 继续可用
+    """
+    
+    def lookup_path(self, path: str):
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is None:
+            directory, filename = os.path.split(path)
+            sharded_path = get_local_storage().build_relative_path(filename, directory or None)
+            if sharded_path != path:
+                return super().lookup_path(sharded_path)
+        return full_path, stat_result
+
+
 # 全局存储实例（单例）
 _local_storage_instance: Optional[LocalStorage] = None
 
@@ -0,0 +1,104 @@
+"""
+上传目录分片迁移
+把旧的平铺上传文件（source/file_xxx.jpg）批量移动到分片目录（source/ab/cd/file_xxx.jpg），
+并同步更新文件索引。旧 URL 由 ShardedStaticFiles 继续提供服务，旧 file_id 通过索引解析。
+
+运行: python -m app.services.storage.migrate_layout [--dry-run] [--batch-size 1000]
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+from typing import Iterator, Tuple
+
+from app.services.storage.file_index import get_file_index
+from app.services.storage.local_storage import SHARD_DIR_PATTERN, LocalStorage, get_local_storage
+
+
+def iter_flat_files(storage: LocalStorage) -> Iterator[Tuple[Path, str]]:
+    """
+    遍历需要迁移的平铺文件（上传根目录及其子目录下直接存放的文件）
+
+    Args:
+        storage: 本地存储
+
+    Yields:
+        Tuple[Path, str]: (文件路径, 子目录名，根目录为空字符串)
+    """
+    base_dir = Path(storage.base_dir)
+    folders = [(base_dir, "")]
+    for entry in sorted(base_dir.iterdir()):
+        if entry.is_dir() and not SHARD_DIR_PATTERN.match(entry.name):
+            folders.append((entry, entry.name))
+
+    for folder, subdirectory in folders:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith("."):
+                    yield Path(entry.path), subdirectory
+
+
+def migrate_layout(
+    storage: LocalStorage = None,
+    batch_size: int = 1000,
+    dry_run: bool = False
+) -> dict:
+    """
+    迁移平铺文件到分片目录
+
+    同一文件系统内使用 os.replace（只修改目录项，不复制数据）；
+    目标已存在时跳过，迁移可重复执行。
+
+    Args:
+        storage: 本地存储（默认全局实例）
+        batch_size: 每批文件数（每批输出一次进度）
+        dry_run: 只统计不移动
+
+    Returns:
+        dict: 迁移统计（moved / skipped / failed / seconds）
+    """
+    storage = storage or get_local_storage()
+    file_index = get_file_index()
+    stats = {"moved": 0, "skipped": 0, "failed": 0}
+    start = time.time()
+
+    if storage.shard_depth <= 0:
+        print("[MigrateLayout] UPLOAD_SHARD_DEPTH=0，无需迁移")
+        return {**stats, "seconds": 0.0}
+
+    for index, (path, subdirectory) in enumerate(iter_flat_files(storage), 1):
+        relative_path = storage.build_relative_path(path.name, subdirectory or None)
+        target = Path(storage.base_dir) / relative_path
+
+        if target.exists():
+            stats["skipped"] += 1
+        elif dry_run:
+            stats["moved"] += 1
+        else:
+            try:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(path, target)
+                file_index.update_path(path.stem, relative_path)
+                stats["moved"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"[MigrateLayout] 迁移失败: {path}: {e}")
+
+        if index % batch_size == 0:
+            print(f"[MigrateLayout] 已处理 {index} 个文件: {stats}")
+
+    stats["seconds"] = round(time.time() - start, 1)
+    print(f"[MigrateLayout] 完成{'（dry run）' if dry_run else ''}: {stats}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="迁移上传文件到分片目录")
+    parser.add_argument("--dry-run", action="store_true", help="只统计不移动")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每批文件数（进度输出间隔）")
+    args = parser.parse_args()
+    migrate_layout(batch_size=args.batch_size, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+S3 兼容对象存储实现（阿里云 OSS / AWS S3 / MinIO）
+大文件分片上传、客户端直传（预签名 POST，限制大小与类型）、预签名下载 URL
+"""
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from app.services.storage.interface import StorageInterface
+from app.core.config import settings
+
+
+# S3 分片上传要求除最后一片外每片不小于 5MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class S3Storage(StorageInterface):
+    """S3 兼容对象存储"""
+
+    def __init__(
+        self,
+        bucket: Optional[str] = None,
+        endpoint: Optional[str] = None,
+        access_key_id: Optional[str] = None,
+        access_key_secret: Optional[str] = None,
+        region: Optional[str] = None,
+        addressing_style: Optional[str] = None,
+        public_domain: Optional[str] = None,
+        key_prefix: str = "uploads"
+    ):
+        """
+        初始化对象存储（参数缺省时读取 OSS_* 配置）
+
+        Args:
+            bucket: Bucket 名称
+            endpoint: 服务地址（如 oss-cn-hangzhou.aliyuncs.com、http://127.0.0.1:9000）
+            access_key_id: Access Key ID
+            access_key_secret: Access Key Secret
+            region: 区域
+            addressing_style: virtual / path（OSS 使用 virtual，MinIO 使用 path）
+            public_domain: 公开访问域名（配置后 get_url 返回公开 URL，否则返回预签名 URL）
+            key_prefix: 对象键前缀
+        """
+        self.bucket = bucket or settings.OSS_BUCKET_NAME
+        if not self.bucket:
+            raise ValueError("对象存储未配置 OSS_BUCKET_NAME")
+
+        endpoint = endpoint or settings.OSS_ENDPOINT
+        if endpoint and "://" not in endpoint:
+            endpoint = f"https://{endpoint}"
+
+        if addressing_style is None:
+            addressing_style = settings.OSS_ADDRESSING_STYLE or (
+                "virtual" if settings.STORAGE_TYPE == "oss" else "path"
+            )
+
+        self.public_domain = (public_domain or settings.OSS_BUCKET_DOMAIN or "").rstrip("/") or None
+        self.key_prefix = key_prefix.strip("/")
+        self.presign_expires = settings.STORAGE_PRESIGN_EXPIRES
+        self.part_size = max(MIN_PART_SIZE, settings.STORAGE_MULTIPART_CHUNK_SIZE)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=self.part_size,
+            multipart_chunksize=self.part_size
+        )
+
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint,
+            aws_access_key_id=access_key_id or settings.OSS_ACCESS_KEY_ID,
+            aws_secret_access_key=access_key_secret or settings.OSS_ACCESS_KEY_SECRET,
+            region_name=region or settings.OSS_REGION,
+            config=Config(
+                signature_version="s3v4",
+                s3={"addressing_style": addressing_style},
+                retries={"max_attempts": 3, "mode": "standard"}
+            )
+        )
+
+    def _key(self, file_path: str) -> str:
+        """相对路径 -> 对象键"""
+        file_path = file_path.replace(os.sep, "/").lstrip("/")
+        return f"{self.key_prefix}/{file_path}" if self.key_prefix else file_path
+
+    @staticmethod
+    def build_relative_path(filename: str, subdirectory: Optional[str] = None) -> str:
+        """构建相对路径（对象存储无需目录分片）"""
+        return f"{subdirectory}/{filename}" if subdirectory else filename
+
+    async def save_file(
+        self,
+        file_data: bytes,
+        filename: str,
+        subdirectory: Optional[str] = None
+    ) -> str:
+        """
+        上传文件（超过分片大小时自动分片上传）
+
+        Args:
+            file_data: 文件二进制数据
+            filename: 文件名
+            subdirectory: 子目录
+
+        Returns:
+            str: 相对文件路径
+        """
+        relative_path = self.build_relative_path(filename, subdirectory)
+
+        async def single_chunk():
+            yield file_data
+
+        await self._upload_chunks(single_chunk(), self._key(relative_path))
+        return relative_path
+
+    async def save_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        subdirectory: Optional[str] = None
+    ) -> Tuple[str, int]:
+        """
+        分块上传文件（内存中最多缓存一个分片）
+
+        Args:
+            chunks: 数据块异步迭代器（迭代中抛出异常时中止分片上传并向上抛出）
+            filename: 文件名
+            subdirectory: 子目录
+
+        Returns:
+            Tuple[str, int]: (相对文件路径, 字节数)
+        """
+        relative_path = self.build_relative_path(filename, subdirectory)
+        size = await self._upload_chunks(chunks, self._key(relative_path))
+        return relative_path, size
+
+    async def _upload_chunks(self, chunks: AsyncIterator[bytes], key: str) -> int:
+        """
+        上传数据块：总大小不超过一个分片时单次 PUT，否则使用分片上传
+
+        Args:
+            chunks: 数据块异步迭代器
+            key: 对象键
+
+        Returns:
+            int: 字节数
+        """
+        buffer = bytearray()
+        upload_id = None
+        parts = []
+        size = 0
+
+        async def flush_part(data: bytes):
+            nonlocal upload_id
+            if upload_id is None:
+                response = await asyncio.to_thread(
+                    self.client.create_multipart_upload, Bucket=self.bucket, Key=key
+                )
+                upload_id = response["UploadId"]
+            part_number = len(parts) + 1
+            response = await asyncio.to_thread(
+                self.client.upload_part,
+                Bucket=self.bucket, Key=key, UploadId=upload_id,
+                PartNumber=part_number, Body=data
+            )
+            parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+
+        try:
+            async for chunk in chunks:
+                buffer.extend(chunk)
+                size += len(chunk)
+                while len(buffer) >= self.part_size:
+                    data = bytes(buffer[:self.part_size])
+                    del buffer[:self.part_size]
+                    await flush_part(data)
+
+            if upload_id is None:
+                await asyncio.to_thread(
+                    self.client.put_object, Bucket=self.bucket, Key=key, Body=bytes(buffer)
+                )
+                return size
+
+            if buffer:
+                await flush_part(bytes(buffer))
+            await asyncio.to_thread(
+                self.client.complete_multipart_upload,
+                Bucket=self.bucket, Key=key, UploadId=upload_id,
+                MultipartUpload={"Parts": parts}
+            )
+            return size
+        except BaseException:
+            if upload_id is not None:
+                try:
+                    await asyncio.to_thread(
+                        self.client.abort_multipart_upload,
+                        Bucket=self.bucket, Key=key, UploadId=upload_id
+                    )
+                except Exception as e:
+                    print(f"[S3Storage] 中止分片上传失败: {key}: {e}")
+            raise
+
+    def download_to_path(self, file_path: str, local_path: str) -> str:
+        """
+        下载对象到本地文件（写入临时文件后原子重命名）
+
+        Args:
+            file_path: 相对文件路径
+            local_path: 本地保存路径
+
+        Returns:
+            str: 本地保存路径
+        """
+        target = Path(local_path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # 每次下载使用独立的临时文件，并发下载同一对象时互不覆盖
+        fd, temp_path = tempfile.mkstemp(dir=str(target.parent), prefix=f".{target.name}.", suffix=".part")
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self._key(file_path), temp_path, Config=self.transfer_config)
+            os.replace(temp_path, local_path)
+        except BaseException:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+        return local_path
+
+    def read_header(self, file_path: str, length: int) -> Tuple[int, bytes]:
+        """
+        读取对象大小与开头的字节（HEAD + Range GET，用于校验客户端直传的文件）
+
+        Args:
+            file_path: 相对文件路径
+            length: 最多读取的字节数
+
+        Returns:
+            Tuple[int, bytes]: (对象字节数, 开头的字节)
+
+        Raises:
+            FileNotFoundError: 对象不存在（客户端尚未上传）
+        """
+        key = self._key(file_path)
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise FileNotFoundError(f"文件不存在: {file_path}")
+            raise
+
+        size = head["ContentLength"]
+        if size <= 0 or length <= 0:
+            return size, b""
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=key, Range=f"bytes=0-{min(length, size) - 1}"
+        )
+        return size, response["Body"].read()
+
+    async def get_file(self, file_path: str) -> bytes:
+        """
+        读取文件
+
+        Args:
+            file_path: 文件路径
+
+        Returns:
+            bytes: 文件二进制数据
+        """
+        def read() -> bytes:
+            try:
+                response = self.client.get_object(Bucket=self.bucket, Key=self._key(file_path))
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                    raise FileNotFoundError(f"文件不存在: {file_path}")
+                raise
+            return response["Body"].read()
+
+        return await asyncio.to_thread(read)
+
+    async def delete_file(self, file_path: str) -> bool:
+        """
+        删除文件
+
+        Args:
+            file_path: 文件路径
+
+        Returns:
+            bool: 是否成功
+        """
+        try:
+            await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self._key(file_path))
+            return True
+        except Exception as e:
+            print(f"[S3Storage] 删除文件失败: {e}")
+            return False
+
+    def get_url(self, file_path: str) -> str:
+        """
+        获取文件访问 URL（配置了公开域名时返回公开 URL，否则返回预签名 GET URL）
+
+        Args:
+            file_path: 文件路径
+
+        Returns:
+            str: 访问 URL
+        """
+        key = self._key(file_path)
+        if self.public_domain:
+            return f"{self.public_domain}/{key}"
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=self.presign_expires
+        )
+
+    def generate_upload_url(
+        self,
+        filename: str,
+        subdirectory: Optional[str] = None,
+        content_type: Optional[str] = None,
+        max_size: Optional[int] = None
+    ) -> Dict[str, object]:
+        """
+        生成客户端直传用的预签名 POST（策略中限定大小范围与 Content-Type，由对象存储拒绝超限上传）
+
+        Args:
+            filename: 文件名
+            subdirectory: 子目录
+            content_type: 上传时必须携带的 Content-Type
+            max_size: 最大字节数（默认 MAX_UPLOAD_SIZE）
+
+        Returns:
+            Dict: path（相对路径）、upload_url、method、fields（表单字段）、expires_in
+        """
+        relative_path = self.build_relative_path(filename, subdirectory)
+        fields = {}
+        conditions = [["content-length-range", 1, max_size or settings.MAX_UPLOAD_SIZE]]
+        if content_type:
+            fields["Content-Type"] = content_type
+            conditions.append({"Content-Type": content_type})
+
+        presigned = self.client.generate_presigned_post(
+            Bucket=self.bucket,
+            Key=self._key(relative_path),
+            Fields=fields,
+            Conditions=conditions,
+            ExpiresIn=self.presign_expires
+        )
+        return {
+            "path": relative_path,
+            "upload_url": presigned["url"],
+            "method": "POST",
+            "fields": presigned["fields"],
+            "expires_in": self.presign_expires,
+        }
+
+    def file_exists(self, file_path: str) -> bool:
+        """
+        检查文件是否存在（HEAD 请求）
+
+        Args:
+            file_path: 文件路径
+
+        Returns:
+            bool: 是否存在
+        """
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(file_path))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
@@ -3,6 +3,11 @@
 """
 from app.services.tasks.manager import TaskService, get_task_service
 from app.services.tasks.queue import TaskQueue, get_task_queue
+from app.services.tasks.lease import TaskLeaseKeeper
+from app.services.tasks.slots import TaskSlotPool
+from app.services.tasks.retention import TaskRetentionJob
+from app.services.tasks.progress import TaskProgressWriter
+from app.services.tasks.events import TaskEventHub, get_task_event_hub
 from app.services.tasks.worker import TaskWorker, run_worker
 
 __all__ = [
@@ -10,6 +15,12 @@ __all__ = [
     "get_task_service",
     "TaskQueue",
     "get_task_queue",
+    "TaskLeaseKeeper",
+    "TaskSlotPool",
+    "TaskRetentionJob",
+    "TaskProgressWriter",
+    "TaskEventHub",
+    "get_task_event_hub",
     "TaskWorker",
     "run_worker"
 ]
@@ -0,0 +1,195 @@
+"""
+任务事件推送
+TaskQueue.update_task_status 写入状态时向 formy:task:events 发布事件；
+每个 API 进程只维持一个 Redis 订阅，按 task_id 分发给本进程内的全部 SSE / WebSocket 连接，
+连接数增加不会增加 Redis 连接或订阅数
+"""
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from app.core.config import settings
+from app.services.tasks.queue import TaskQueue, get_task_queue
+from app.utils.redis_client import get_async_redis_client
+
+
+class TaskEventHub:
+    """任务事件分发（单个 Redis 订阅 -> 进程内订阅者队列）"""
+    
+    # 每个订阅者最多缓存的事件数（客户端读取慢时丢弃最旧的进度事件，只有最新状态有意义）
+    QUEUE_SIZE = 32
+    
+    def __init__(self):
+        """初始化分发器（订阅在首个连接到来时启动）"""
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+    
+    @property
+    def subscriber_count(self) -> int:
+        """当前订阅者数量"""
+        return sum(len(queues) for queues in self._subscribers.values())
+    
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        """
+        订阅任务事件
+        
+        Args:
+            task_id: 任务ID
+        
+        Returns:
+            asyncio.Queue: 事件队列（收到 None 表示订阅曾中断，需要重新读取任务状态）
+        """
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        self._subscribers.setdefault(task_id, set()).add(queue)
+        return queue
+    
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        """取消订阅"""
+        queues = self._subscribers.get(task_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[task_id]
+    
+    async def close(self):
+        """停止订阅（应用关闭时调用）"""
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+    
+    async def _listen(self):
+        """订阅事件频道并分发；连接中断时 1 秒后重连，并通知订阅者重新读取状态"""
+        reconnecting = False
+        while True:
+            pubsub = get_async_redis_client().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(TaskQueue.EVENTS_CHANNEL)
+                self._subscribed.set()
+                if reconnecting:
+                    self._broadcast(None)
+                while True:
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message and message["type"] == "message":
+                        self._dispatch(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[TaskEvents] 事件订阅中断，1 秒后重连: {e}")
+                reconnecting = True
+            finally:
+                self._subscribed.clear()
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(1)
+    
+    def _dispatch(self, data: str):
+        """把事件放入该任务全部订阅者的队列"""
+        try:
+            event = json.loads(data)
+        except ValueError:
+            return
+        for queue in list(self._subscribers.get(event.get("task_id"), ())):
+            self._put(queue, event)
+    
+    def _broadcast(self, event: Optional[Dict[str, Any]]):
+        """向全部订阅者发送事件"""
+        for queues in list(self._subscribers.values()):
+            for queue in list(queues):
+                self._put(queue, event)
+    
+    @staticmethod
+    def _put(queue: asyncio.Queue, event: Optional[Dict[str, Any]]):
+        """写入队列（队列已满时丢弃最旧的事件）"""
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+    
+    async def stream(self, task_id: str, keepalive: Optional[float] = None) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        任务事件流：先返回当前状态，之后返回每次状态更新，任务结束后停止
+        
+        先订阅再读取当前状态，读取期间发生的更新不会丢失；version 不大于已返回状态的进度事件被跳过，
+        结束事件总是推送。
+        
+        Args:
+            task_id: 任务ID
+            keepalive: 无事件时的保活间隔（秒，默认 TASK_EVENTS_KEEPALIVE）
+        
+        Yields:
+            Optional[Dict]: 状态事件（TaskQueue.task_event 格式）；保活时为 None
+        """
+        keepalive = keepalive or settings.TASK_EVENTS_KEEPALIVE
+        queue = self.subscribe(task_id)
+        try:
+            # 等待频道订阅生效后再读取状态（订阅未能建立时，重连后会通知重新读取）
+            try:
+                await asyncio.wait_for(self._subscribed.wait(), keepalive)
+            except asyncio.TimeoutError:
+                pass
+            
+            event = await self._snapshot(task_id)
+            if event is None:
+                return
+            yield event
+            
+            while event["status"] not in TaskQueue.TERMINAL_STATUSES:
+                try:
+                    next_event = await asyncio.wait_for(queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                
+                # 订阅中断过，可能错过事件：重新读取当前状态
+                if next_event is None:
+                    next_event = await self._snapshot(task_id)
+                    if next_event is None:
+                        return
+                
+                if self._is_stale(next_event, event):
+                    continue
+                event = next_event
+                yield event
+        finally:
+            self.unsubscribe(task_id, queue)
+    
+    @staticmethod
+    def _is_stale(event: Dict[str, Any], current: Dict[str, Any]) -> bool:
+        """
+        事件是否不晚于已返回的状态（按任务 Hash 的 version 判断，不比较各节点时钟）
+        
+        结束事件总是推送；没有 version 的事件（旧版本节点发布）无法排序，同样推送。
+        """
+        if event.get("status") in TaskQueue.TERMINAL_STATUSES or event.get("version") is None:
+            return False
+        return event["version"] <= current.get("version", 0)
+    
+    @staticmethod
+    async def _snapshot(task_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务当前状态（任务不存在返回 None）"""
+        task_data = await get_task_queue().get_task_data_async(task_id)
+        if not task_data:
+            return None
+        return TaskQueue.task_event(task_id, task_data)
+
+
+# 全局单例（每个 API 进程一个 Redis 订阅）
+_task_event_hub: Optional[TaskEventHub] = None
+
+
+def get_task_event_hub() -> TaskEventHub:
+    """获取任务事件分发器单例"""
+    global _task_event_hub
+    if _task_event_hub is None:
+        _task_event_hub = TaskEventHub()
+    return _task_event_hub
@@ -0,0 +1,85 @@
+"""
+任务租约维护
+Worker 处理任务期间由后台线程定期续租，并周期性回收孤儿任务
+"""
+import threading
+import time
+from typing import Optional, Set
+
+from app.core.config import settings
+from app.services.tasks.queue import TaskQueue, get_task_queue
+from app.services.tasks.manager import TaskService, get_task_service
+
+
+class TaskLeaseKeeper:
+    """任务租约维护类"""
+    
+    def __init__(
+        self,
+        worker_id: str,
+        queue: Optional[TaskQueue] = None,
+        task_service: Optional[TaskService] = None
+    ):
+        """
+        初始化租约维护
+        
+        Args:
+            worker_id: Worker ID
+            queue: 任务队列（默认使用全局实例）
+            task_service: 任务服务（默认使用全局实例）
+        """
+        self.worker_id = worker_id
+        self.queue = queue or get_task_queue()
+        self.task_service = task_service or get_task_service()
+        
+        # 每 1/3 租约时长续租一次，保证一次心跳失败不会导致租约过期
+        self.heartbeat_interval = max(1, settings.TASK_LEASE_SECONDS // 3)
+        self.reaper_interval = settings.TASK_REAPER_INTERVAL
+        
+        self._active_tasks: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_reap = 0.0
+    
+    def start(self):
+        """注册 Worker 并启动后台心跳线程"""
+        self.queue.register_worker(self.worker_id)
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"lease-keeper-{self.worker_id}",
+            daemon=True
+        )
+        self._thread.start()
+    
+    def stop(self):
+        """停止心跳线程并注销 Worker"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.heartbeat_interval + 1)
+        self.queue.unregister_worker(self.worker_id)
+    
+    def track(self, task_id: str):
+        """开始为任务续租"""
+        with self._lock:
+            self._active_tasks.add(task_id)
+    
+    def untrack(self, task_id: str):
+        """停止为任务续租"""
+        with self._lock:
+            self._active_tasks.discard(task_id)
+    
+    def _run(self):
+        """后台循环：续租 + 定期回收孤儿任务"""
+        while not self._stop_event.wait(self.heartbeat_interval):
+            with self._lock:
+                task_ids = list(self._active_tasks)
+            self.queue.heartbeat(self.worker_id, task_ids)
+            
+            if time.time() - self._last_reap >= self.reaper_interval:
+                self._last_reap = time.time()
+                try:
+                    self.task_service.recover_orphaned_tasks()
+                except Exception as e:
+                    print(f"[LeaseKeeper] 回收孤儿任务失败: {e}")
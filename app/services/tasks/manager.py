@@ -3,7 +3,8 @@
 提供任务创建、查询、取消等业务逻辑
 """
 import json
-from typing import Optional, List
+import re
+from typing import Any, Dict, Optional, List, Tuple
 from datetime import datetime
 
 from app.schemas.task import (
@@ -16,7 +17,35 @@ from app.schemas.task import (
     TaskSummary
 )
 from app.services.tasks.queue import get_task_queue
+from app.services.tasks.progress import TaskProgressWriter
+from app.services.storage.file_index import get_file_index
 from app.utils.id_generator import generate_task_id
+from app.core.config import settings
+from app.config.plans import get_queue_lane
+from app.core.error_codes import TaskErrorCode, create_error
+
+
+# 任务数据中引用的上传文件 ID（source_image 以及 config 中的参考图）
+FILE_ID_PATTERN = re.compile(r"^(file|img)_[A-Za-z0-9_]+$")
+
+
+def referenced_file_ids(source_image: Any, config: Optional[Dict[str, Any]]) -> List[str]:
+    """
+    列出任务引用的上传文件 ID（去重，保持顺序）
+    
+    Args:
+        source_image: 原图 file_id
+        config: 模式配置（值为 file_id 的视为参考图）
+        
+    Returns:
+        List[str]: 文件ID列表
+    """
+    candidates = [source_image] + list((config or {}).values())
+    file_ids = []
+    for candidate in candidates:
+        if isinstance(candidate, str) and FILE_ID_PATTERN.match(candidate) and candidate not in file_ids:
+            file_ids.append(candidate)
+    return file_ids
 
 
 class TaskService:
@@ -25,12 +54,15 @@ class TaskService:
     def __init__(self):
         """初始化任务服务"""
         self.queue = get_task_queue()
+        self.progress_writer = TaskProgressWriter(self.queue)
     
     def create_task(
         self, 
         request: TaskCreateRequest,
         user_id: Optional[str] = None,
-        credits_consumed: Optional[int] = None
+        credits_consumed: Optional[int] = None,
+        plan_id: Optional[str] = None,
+        task_id: Optional[str] = None
     ) -> TaskInfo:
         """
         创建新任务
@@ -39,15 +71,62 @@ class TaskService:
             request: 任务创建请求
             user_id: 用户ID（用于失败退款）
             credits_consumed: 消耗的积分（用于失败退款）
+            plan_id: 用户当前套餐（决定排队的优先级通道）
+            task_id: 任务ID（已按任务预扣算力时传入，默认生成新ID）
             
         Returns:
             TaskInfo: 任务信息
         """
         # 1. 生成任务ID
-        task_id = generate_task_id()
+        task_id = task_id or generate_task_id()
+        
+        # 2. 按套餐等级推入对应优先级通道
+        success = self.queue.push_task(
+            task_id,
+            self._build_task_data(request, user_id, credits_consumed),
+            lane=get_queue_lane(plan_id)
+        )
+        
+        if not success:
+            raise Exception("Failed to create task: cannot push to queue")
         
-        # 2. 构建任务数据
-        task_data = {
+        # 3. 记录上传文件的最近引用时间（保留期清理不会删除仍被新任务使用的文件）
+        get_file_index().touch(referenced_file_ids(request.source_image, request.config))
+        
+        # 4. 返回任务信息
+        return self._new_task_info(task_id, request)
+    
+    async def create_task_async(
+        self,
+        request: TaskCreateRequest,
+        user_id: Optional[str] = None,
+        credits_consumed: Optional[int] = None,
+        plan_id: Optional[str] = None,
+        task_id: Optional[str] = None
+    ) -> TaskInfo:
+        """创建新任务（异步版本，参数同 create_task）"""
+        task_id = task_id or generate_task_id()
+        
+        success = await self.queue.push_task_async(
+            task_id,
+            self._build_task_data(request, user_id, credits_consumed),
+            lane=get_queue_lane(plan_id)
+        )
+        
+        if not success:
+            raise Exception("Failed to create task: cannot push to queue")
+        
+        await get_file_index().touch_async(referenced_file_ids(request.source_image, request.config))
+        return self._new_task_info(task_id, request)
+    
+    @staticmethod
+    def _build_task_data(
+        request: TaskCreateRequest,
+        user_id: Optional[str],
+        credits_consumed: Optional[int]
+    ) -> dict:
+        """构建入队的任务数据"""
+        return {
             "mode": request.mode.value,
             "source_image": request.source_image,
             "config": request.config,
@@ -55,14 +134,10 @@ class TaskService:
             "user_id": user_id,
             "credits_consumed": credits_consumed
         }
-        
-        # 3. 推入队列
-        success = self.queue.push_task(task_id, task_data)
-        
-        if not success:
-            raise Exception("Failed to create task: cannot push to queue")
-        
-        # 4. 返回任务信息
+    
+    @staticmethod
+    def _new_task_info(task_id: str, request: TaskCreateRequest) -> TaskInfo:
+        """新建任务的初始信息"""
         return TaskInfo(
             task_id=task_id,
             status=TaskStatus.PENDING,
@@ -97,53 +172,165 @@ class TaskService:
         status_filter: Optional[str] = None,
         mode_filter: Optional[str] = None,
         page: int = 1,
-        page_size: int = 20
+        page_size: int = 20,
+        user_filter: Optional[str] = None
     ) -> List[TaskSummary]:
         """
-        获取任务列表
+        获取任务列表（按创建时间倒序）
         
         Args:
             status_filter: 状态筛选
             mode_filter: 模式筛选
             page: 页码
             page_size: 每页数量
+            user_filter: 用户筛选
             
         Returns:
             List[TaskSummary]: 任务摘要列表
         """
-        # 获取所有任务ID（可按状态筛选）
-        task_ids = self.queue.get_all_task_ids(status_filter=status_filter)
+        # 从索引中按页读取任务ID（已按创建时间倒序）
+        task_ids = self.get_task_ids(
+            status_filter=status_filter,
+            mode_filter=mode_filter,
+            page=page,
+            page_size=page_size,
+            user_filter=user_filter
+        )
         
-        # 获取每个任务的详细信息
-        tasks = []
-        for task_id in task_ids:
-            task_data = self.queue.get_task_data(task_id)
-            if task_data:
-                task_info = self._parse_task_info(task_data)
-                
-                # 模式筛选
-                if mode_filter and task_info.mode.value != mode_filter:
-                    continue
-                
-                # 构建摘要
-                tasks.append(TaskSummary(
-                    task_id=task_info.task_id,
-                    status=task_info.status,
-                    mode=task_info.mode,
-                    thumbnail=task_info.result.thumbnail if task_info.result else None,
-                    progress=task_info.progress,
-                    created_at=task_info.created_at,
-                    completed_at=task_info.completed_at
-                ))
-        
-        # 按创建时间倒序排序
-        tasks.sort(key=lambda x: x.created_at, reverse=True)
-        
-        # 分页
-        start_idx = (page - 1) * page_size
-        end_idx = start_idx + page_size
-        
-        return tasks[start_idx:end_idx]
+        # 批量获取任务详情并构建摘要
+        return [
+            TaskSummary(
+                task_id=task_info.task_id,
+                status=task_info.status,
+                mode=task_info.mode,
+                thumbnail=task_info.result.thumbnail if task_info.result else None,
+                progress=task_info.progress,
+                created_at=task_info.created_at,
+                completed_at=task_info.completed_at
+            )
+            for task_info in self.get_tasks(task_ids)
+        ]
+    
+    def get_task_ids(
+        self,
+        status_filter: Optional[str] = None,
+        mode_filter: Optional[str] = None,
+        page: int = 1,
+        page_size: int = 20,
+        user_filter: Optional[str] = None
+    ) -> List[str]:
+        """
+        获取一页任务ID（按创建时间倒序）
+        
+        Args:
+            status_filter: 状态筛选
+            mode_filter: 模式筛选
+            page: 页码
+            page_size: 每页数量
+            user_filter: 用户筛选
+            
+        Returns:
+            List[str]: 任务ID列表
+        """
+        return self.queue.get_task_ids_page(
+            status_filter=status_filter,
+            mode_filter=mode_filter,
+            user_filter=user_filter,
+            offset=(page - 1) * page_size,
+            limit=page_size
+        )
+    
+    def get_tasks(self, task_ids: List[str]) -> List[TaskInfo]:
+        """
+        批量获取任务详情（单次 Redis 往返）
+        
+        Args:
+            task_ids: 任务ID列表
+            
+        Returns:
+            List[TaskInfo]: 任务信息列表（保持输入顺序，跳过不存在的任务）
+        """
+        tasks_data = self.queue.get_task_data_many(task_ids)
+        return [
+            self._parse_task_info(task_data)
+            for task_data in tasks_data
+            if task_data
+        ]
+    
+    def get_user_tasks(
+        self,
+        user_id: str,
+        cursor: Optional[str] = None,
+        limit: int = 20
+    ) -> Tuple[List[TaskInfo], Optional[str]]:
+        """
+        获取用户的任务历史（游标分页，按创建时间倒序）
+        
+        Args:
+            user_id: 用户ID
+            cursor: 上一页返回的游标，None 表示第一页
+            limit: 每页数量
+            
+        Returns:
+            Tuple[List[TaskInfo], Optional[str]]: (任务列表, 下一页游标)
+            
+        Raises:
+            ValueError: 游标格式无效
+        """
+        tasks_data, next_position = self.queue.get_user_task_page(
+            user_id=user_id,
+            before=self._parse_cursor(cursor),
+            limit=limit
+        )
+        
+        tasks = [self._parse_task_info(task_data) for task_data in tasks_data]
+        return tasks, self._format_cursor(next_position)
+    
+    @staticmethod
+    def _parse_cursor(cursor: Optional[str]) -> Optional[Tuple[float, str]]:
+        """
+        分页游标 "创建时间戳:任务ID" -> (创建时间戳, 任务ID)
+        
+        兼容只有时间戳的旧游标（等价于跳过该时间戳的全部任务）。
+        
+        Raises:
+            ValueError: 游标格式无效
+        """
+        if not cursor:
+            return None
+        score, _, task_id = cursor.partition(":")
+        return float(score), task_id
+    
+    @staticmethod
+    def _format_cursor(position: Optional[Tuple[float, str]]) -> Optional[str]:
+        """(创建时间戳, 任务ID) -> 分页游标"""
+        if position is None:
+            return None
+        score, task_id = position
+        return f"{score!r}:{task_id}"
+    
+    def count_tasks(
+        self,
+        status_filter: Optional[str] = None,
+        mode_filter: Optional[str] = None,
+        user_filter: Optional[str] = None
+    ) -> int:
+        """
+        统计满足筛选条件的任务总数
+        
+        Args:
+            status_filter: 状态筛选
+            mode_filter: 模式筛选
+            user_filter: 用户筛选
+            
+        Returns:
+            int: 任务总数
+        """
+        return self.queue.count_task_ids(
+            status_filter=status_filter,
+            mode_filter=mode_filter,
+            user_filter=user_filter
+        )
     
     def cancel_task(self, task_id: str) -> bool:
         """
@@ -159,32 +346,139 @@ class TaskService:
         if not self.queue.is_task_exists(task_id):
             return False
         
-        # 取消任务
-        return self.queue.cancel_task(task_id)
+        # 取消任务，并退还预扣的算力（已结算的任务不会退还，重复取消只退一次）
+        if not self.queue.cancel_task(task_id):
+            return False
+        self.refund_credits_for_failed_task(task_id)
+        return True
+    
+    # ==================== 异步接口（API 请求处理使用） ====================
+    
+    async def get_task_async(self, task_id: str) -> Optional[TaskInfo]:
+        """获取任务详情（异步版本）"""
+        task_data = await self.queue.get_task_data_async(task_id)
+        if not task_data:
+            return None
+        return self._parse_task_info(task_data)
+    
+    async def get_task_ids_async(
+        self,
+        status_filter: Optional[str] = None,
+        mode_filter: Optional[str] = None,
+        page: int = 1,
+        page_size: int = 20,
+        user_filter: Optional[str] = None
+    ) -> List[str]:
+        """获取一页任务ID（异步版本，参数同 get_task_ids）"""
+        return await self.queue.get_task_ids_page_async(
+            status_filter=status_filter,
+            mode_filter=mode_filter,
+            user_filter=user_filter,
+            offset=(page - 1) * page_size,
+            limit=page_size
+        )
+    
+    async def get_tasks_async(self, task_ids: List[str]) -> List[TaskInfo]:
+        """批量获取任务详情（异步版本，单次 Redis 往返）"""
+        tasks_data = await self.queue.get_task_data_many_async(task_ids)
+        return [
+            self._parse_task_info(task_data)
+            for task_data in tasks_data
+            if task_data
+        ]
+    
+    async def get_user_tasks_async(
+        self,
+        user_id: str,
+        cursor: Optional[str] = None,
+        limit: int = 20
+    ) -> Tuple[List[TaskInfo], Optional[str]]:
+        """
+        获取用户的任务历史（异步版本，参数同 get_user_tasks）
+        
+        Raises:
+            ValueError: 游标格式无效
+        """
+        tasks_data, next_position = await self.queue.get_user_task_page_async(
+            user_id=user_id,
+            before=self._parse_cursor(cursor),
+            limit=limit
+        )
+        
+        tasks = [self._parse_task_info(task_data) for task_data in tasks_data]
+        return tasks, self._format_cursor(next_position)
+    
+    async def count_tasks_async(
+        self,
+        status_filter: Optional[str] = None,
+        mode_filter: Optional[str] = None,
+        user_filter: Optional[str] = None
+    ) -> int:
+        """统计满足筛选条件的任务总数（异步版本）"""
+        return await self.queue.count_task_ids_async(
+            status_filter=status_filter,
+            mode_filter=mode_filter,
+            user_filter=user_filter
+        )
+    
+    async def cancel_task_async(self, task_id: str) -> bool:
+        """取消任务（异步版本）"""
+        if not await self.queue.is_task_exists_async(task_id):
+            return False
+        if not await self.queue.cancel_task_async(task_id):
+            return False
+        await self.refund_credits_for_cancelled_task_async(task_id)
+        return True
+    
+    async def refund_credits_for_cancelled_task_async(self, task_id: str) -> bool:
+        """
+        退还已取消任务预扣的算力（异步版本，按 task_id 幂等，见 refund_credits_for_failed_task）
+        
+        Args:
+            task_id: 任务ID
+            
+        Returns:
+            bool: 是否成功退款
+        """
+        try:
+            task_data = await self.queue.get_task_data_async(task_id)
+            if not task_data:
+                print(f"[Refund] Task {task_id} not found, cannot refund")
+                return False
+            user_id, credits_consumed = self._refund_target(task_data)
+            if not user_id or not credits_consumed:
+                print(f"[Refund] Task {task_id} missing user_id or credits_consumed")
+                return False
+            
+            from app.services.billing import billing_service
+            success = await billing_service.refund_credits_async(task_id, user_id, credits_consumed)
+            if success:
+                print(f"[Refund] ✓ Refunded {credits_consumed} credits to user {user_id} for cancelled task {task_id}")
+            return success
+        except Exception as e:
+            print(f"[Refund] Error refunding credits for task {task_id}: {e}")
+            return False
     
     def update_task_progress(
         self, 
         task_id: str, 
         progress: int,
-        current_step: Optional[str] = None
+        current_step: Optional[str] = None,
+        immediate: bool = False
     ) -> bool:
         """
-        更新任务进度
+        更新任务进度（按 TASK_PROGRESS_MIN_INTERVAL 合并写入，见 TaskProgressWriter）
         
         Args:
             task_id: 任务ID
             progress: 进度百分比（0-100）
             current_step: 当前步骤描述
+            immediate: 直接写入（任务开始处理时使用）
             
         Returns:
-            bool: 是否成功
+            bool: 是否成功（合并写入时总是 True）
         """
-        return self.queue.update_task_status(
-            task_id=task_id,
-            status="processing",
-            progress=progress,
-            current_step=current_step
-        )
+        return self.progress_writer.update(task_id, progress, current_step, immediate=immediate)
     
     def complete_task(
         self, 
@@ -201,6 +495,15 @@ class TaskService:
         Returns:
             bool: 是否成功
         """
+        # 结算预扣的算力（之后不会再被退还）
+        try:
+            from app.services.billing import billing_service
+            billing_service.commit_credits(task_id)
+        except Exception as e:
+            print(f"[Billing] 结算算力失败: {task_id}: {e}")
+        
+        # 丢弃未写入的进度，最终状态立即写入
+        self.progress_writer.finish(task_id)
         return self.queue.update_task_status(
             task_id=task_id,
             status="done",
@@ -236,6 +539,8 @@ class TaskService:
         # Refund credits if task fails
         self.refund_credits_for_failed_task(task_id)
         
+        # 丢弃未写入的进度，最终状态立即写入
+        self.progress_writer.finish(task_id)
         return self.queue.update_task_status(
             task_id=task_id,
             status="failed",
@@ -244,9 +549,9 @@ class TaskService:
     
     def refund_credits_for_failed_task(self, task_id: str) -> bool:
         """
-        Refund credits for a failed task
+        Refund credits for a failed or cancelled task
         
-        Policy: Full refund for all failed tasks
+        Policy: Full refund for all failed / cancelled tasks (idempotent per task_id, repeated calls refund once)
         
         Args:
             task_id: 任务ID
@@ -261,14 +566,7 @@ class TaskService:
                 print(f"[Refund] Task {task_id} not found, cannot refund")
                 return False
             
-            # Parse task input data
-            input_data = task_data.get("data", {})
-            if isinstance(input_data, str):
-                import json
-                input_data = json.loads(input_data)
-            
-            user_id = input_data.get("user_id")
-            credits_consumed = input_data.get("credits_consumed")
+            user_id, credits_consumed = self._refund_target(task_data)
             
             if not user_id or not credits_consumed:
                 print(f"[Refund] Task {task_id} missing user_id or credits_consumed")
@@ -276,12 +574,12 @@ class TaskService:
             
             # Refund credits
             from app.services.billing import billing_service
-            success = billing_service.add_credits(user_id, credits_consumed)
+            success = billing_service.refund_credits(task_id, user_id, credits_consumed)
             
             if success:
-                print(f"[Refund] ✓ Refunded {credits_consumed} credits to user {user_id} for failed task {task_id}")
+                print(f"[Refund] ✓ Refunded {credits_consumed} credits to user {user_id} for task {task_id}")
             else:
-                print(f"[Refund] ✗ Failed to refund credits for task {task_id}")
+                print(f"[Refund] ✗ Credits for task {task_id} already refunded or committed")
             
             return success
             
@@ -291,6 +589,52 @@ class TaskService:
             traceback.print_exc()
             return False
     
+    @staticmethod
+    def _refund_target(task_data: Dict[str, Any]) -> Tuple[Optional[str], Optional[int]]:
+        """从任务数据中读取退款用户与预扣的算力"""
+        input_data = task_data.get("data", {})
+        if isinstance(input_data, str):
+            input_data = json.loads(input_data)
+        return input_data.get("user_id"), input_data.get("credits_consumed")
+    
+    def recover_orphaned_tasks(self) -> dict:
+        """
+        回收孤儿任务（Worker 崩溃/重新部署导致租约过期的任务）
+        
+        未超过重试次数的任务重新排队；超过 TASK_MAX_RETRIES 的任务标记失败并退还算力；
+        同时回收已不在处理中的任务仍占用的用户并发名额。
+        
+        Returns:
+            dict: {"requeued": 重新排队数量, "failed": 标记失败数量, "released_slots": 回收的名额数量}
+        """
+        requeued, exhausted = self.queue.requeue_expired_tasks(settings.TASK_MAX_RETRIES)
+        
+        for task_id in requeued:
+            print(f"[Recovery] 任务已重新排队: {task_id}")
+        
+        for task_id in exhausted:
+            error = create_error(
+                TaskErrorCode.TASK_RETRY_EXHAUSTED,
+                custom_details=f"已重试 {settings.TASK_MAX_RETRIES} 次"
+            )
+            self.fail_task(
+                task_id=task_id,
+                error_code=error["code"],
+                error_message=error["message"],
+                error_details=error["details"]
+            )
+            print(f"[Recovery] 任务超过最大重试次数，已标记失败: {task_id}")
+        
+        released = self.queue.reconcile_user_slots()
+        if released:
+            print(f"[Recovery] 已回收泄漏的用户并发名额: {released}")
+        
+        return {
+            "requeued": len(requeued),
+            "failed": len(exhausted),
+            "released_slots": released
+        }
+    
     def get_queue_stats(self) -> dict:
         """
         获取队列统计信息
@@ -300,8 +644,10 @@ class TaskService:
         """
         return {
             "pending": self.queue.get_queue_length(),
+            "deferred": self.queue.get_deferred_count(),
             "processing": self.queue.get_processing_count(),
-            "total_tasks": len(self.queue.get_all_task_ids())
+            "total_tasks": self.queue.count_task_ids(),
+            "lanes": self.queue.get_lane_stats()
         }
     
     def _parse_task_info(self, task_data: dict) -> TaskInfo:
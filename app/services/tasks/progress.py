@@ -0,0 +1,167 @@
+"""
+任务进度合并写入
+Pipeline / 引擎节点回调产生的进度更新先记录在内存中（每个任务只保留最新一次），
+由后台线程按 TASK_PROGRESS_MIN_INTERVAL 限速写入：同一任务两次写入至少间隔该时间，
+同一时刻到期的多个任务合并为一次 Lua 调用（单次往返）。
+
+任务开始（pending -> processing）与结束（done / failed / cancelled）仍直接写入，
+结束前丢弃该任务尚未写入的进度；批量写入只更新仍在处理中的任务，迟到的进度不会覆盖最终状态。
+"""
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.services.tasks.queue import TaskQueue, get_task_queue
+
+
+class TaskProgressWriter:
+    """任务进度合并写入类"""
+    
+    # 超过该时间没有进度更新的任务不再记录上次写入时间（秒）
+    FORGET_AFTER = 600
+    
+    def __init__(self, queue: Optional[TaskQueue] = None, min_interval: Optional[float] = None):
+        """
+        初始化写入器（参数缺省时读取配置）
+        
+        Args:
+            queue: 任务队列（默认使用全局实例）
+            min_interval: 同一任务进度写入的最小间隔（秒；0 表示每次更新直接写入）
+        """
+        self.queue = queue or get_task_queue()
+        self.min_interval = settings.TASK_PROGRESS_MIN_INTERVAL if min_interval is None else min_interval
+        
+        self._pending: Dict[str, Tuple[int, Optional[str]]] = {}  # task_id -> 最新的 (进度, 步骤)
+        self._last_write: Dict[str, float] = {}  # task_id -> 上次写入时间（monotonic）
+        self._last_forget = time.monotonic()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        
+        # 统计：收到的更新数 / 实际写入 Redis 的更新数
+        self.received = 0
+        self.written = 0
+    
+    def update(
+        self,
+        task_id: str,
+        progress: int,
+        current_step: Optional[str] = None,
+        immediate: bool = False
+    ) -> bool:
+        """
+        记录任务进度
+        
+        Args:
+            task_id: 任务ID
+            progress: 进度百分比（0-100）
+            current_step: 当前步骤描述
+            immediate: 直接写入（任务开始时使用：需要把状态从 pending 迁移为 processing）
+        
+        Returns:
+            bool: 直接写入时为是否成功；合并写入时为 True
+        """
+        # 未启用合并或写入器已停止时直接写入
+        direct = immediate or self.min_interval <= 0 or self._stop_event.is_set()
+        with self._lock:
+            self.received += 1
+            if direct:
+                self._pending.pop(task_id, None)
+                if self.min_interval > 0:
+                    self._last_write[task_id] = time.monotonic()
+                self.written += 1
+            else:
+                self._pending[task_id] = (progress, current_step)
+                self._start()
+        
+        if direct:
+            return self.queue.update_task_status(
+                task_id=task_id,
+                status="processing",
+                progress=progress,
+                current_step=current_step
+            )
+        
+        self._wakeup.set()
+        return True
+    
+    def finish(self, task_id: str):
+        """
+        任务结束：丢弃尚未写入的进度（之后由调用方直接写入最终状态）
+        
+        Args:
+            task_id: 任务ID
+        """
+        with self._lock:
+            self._pending.pop(task_id, None)
+            self._last_write.pop(task_id, None)
+    
+    def flush(self):
+        """立即写入全部待写入的进度"""
+        self._write(self._take_due(force=True)[0])
+    
+    def stop(self):
+        """停止后台线程并写入剩余进度"""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+        if self.received:
+            print(f"[ProgressWriter] 收到 {self.received} 次进度更新，写入 {self.written} 次")
+    
+    def _start(self):
+        """按需启动后台写入线程（调用方持有锁）"""
+        if self._thread is None and not self._stop_event.is_set():
+            self._thread = threading.Thread(target=self._run, name="task-progress-writer", daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        """后台循环：写入到期的进度，然后等待新的更新或下一个到期时间"""
+        while not self._stop_event.is_set():
+            self._wakeup.clear()
+            due, timeout = self._take_due()
+            self._write(due)
+            self._wakeup.wait(timeout)
+    
+    def _take_due(self, force: bool = False) -> Tuple[Dict[str, Tuple[int, Optional[str]]], Optional[float]]:
+        """
+        取出已到写入时间的进度
+        
+        Args:
+            force: 忽略写入间隔，取出全部
+        
+        Returns:
+            Tuple[Dict, Optional[float]]: (到期的进度, 距下一个到期的秒数；没有待写入进度时为 None)
+        """
+        now = time.monotonic()
+        due = {}
+        timeout = None
+        with self._lock:
+            for task_id, update in list(self._pending.items()):
+                next_write = self._last_write.get(task_id, 0.0) + self.min_interval
+                if force or next_write <= now:
+                    due[task_id] = update
+                    del self._pending[task_id]
+                    self._last_write[task_id] = now
+                else:
+                    wait = next_write - now
+                    timeout = wait if timeout is None else min(timeout, wait)
+            
+            # 清理长时间没有更新的任务（例如由其他进程结束的任务）
+            if now - self._last_forget >= self.FORGET_AFTER:
+                self._last_forget = now
+                for task_id, written_at in list(self._last_write.items()):
+                    if now - written_at >= self.FORGET_AFTER and task_id not in self._pending:
+                        del self._last_write[task_id]
+            
+            self.written += len(due)
+        return due, timeout
+    
+    def _write(self, due: Dict[str, Tuple[int, Optional[str]]]):
+        """批量写入进度"""
+        if due:
+            self.queue.update_progress_many(due)
@@ -3,83 +3,749 @@ Redis 任务队列管理
 负责任务的入队、出队操作
 """
 import json
+import math
+import time
+import random
+import uuid
 import redis
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime
 
 from app.core.config import settings
-from app.utils.redis_client import get_redis_client
+from app.utils.redis_client import get_redis_client, get_async_redis_client
 
 
 class TaskQueue:
     """任务队列管理类"""
     
     # Redis Key 前缀
-    QUEUE_KEY = "formy:task:queue"           # 任务队列（List）
+    QUEUE_KEY = "formy:task:queue"           # 任务队列（List，normal 通道）
+    LANE_KEY_PREFIX = "formy:task:queue:"    # 其他优先级通道（List）
+    WAKEUP_KEY = "formy:task:queue:wakeup"   # 入队通知（List，空闲 Worker 阻塞等待）
+    WAKEUP_MAX = 64                          # 入队通知最大堆积数量
+    WAIT_STATS_PREFIX = "formy:task:stats:wait:"  # 各通道排队耗时样本（List）
     TASK_KEY_PREFIX = "formy:task:data:"     # 任务数据（Hash）
     PROCESSING_SET = "formy:task:processing" # 处理中任务集合（Set）
+    EVENTS_CHANNEL = "formy:task:events"     # 任务状态事件（Pub/Sub，消息为 JSON，每个 API 节点共享一个订阅）
+    
+    # 二级索引（ZSet，score 为创建时间戳）
+    INDEX_ALL_KEY = "formy:task:index:all"              # 全部任务
+    INDEX_STATUS_PREFIX = "formy:task:index:status:"    # 按状态
+    INDEX_MODE_PREFIX = "formy:task:index:mode:"        # 按模式
+    INDEX_USER_PREFIX = "formy:task:index:user:"        # 按用户
+    INDEX_FINISHED_KEY = "formy:task:index:finished"    # 已结束任务（score 为结束时间戳，供保留期清理使用）
+    INDEX_TMP_PREFIX = "formy:task:index:tmp:"          # 组合筛选临时结果
+    INDEX_TMP_TTL = 5                                   # 临时结果过期时间（秒）
+    INDEX_REBUILD_PREFIX = "formy:task:index:rebuild:"  # 重建索引时的临时键
+    
+    TASK_STATUSES = ("pending", "processing", "done", "failed", "cancelled")
+    TERMINAL_STATUSES = ("done", "failed", "cancelled")
+    
+    # 结束任务 Hash 的过期时间在保留期基础上多留一天：正常情况下由清理任务先归档再删除，
+    # 清理任务未运行时 Redis 仍会回收（此时只能清理全量/状态索引，用户/模式索引由读取侧跳过）
+    RETENTION_GRACE_SECONDS = 86400
+    
+    # 可靠出队
+    LEASE_KEY = "formy:task:leases"                 # 任务租约（ZSet，score 为租约到期时间戳）
+    WORKERS_SET = "formy:task:workers"              # 已注册 Worker（Set）
+    WORKER_KEY_PREFIX = "formy:task:worker:"        # Worker 私有处理列表 / 存活标记
+    
+    # 用户并发限制
+    INFLIGHT_PREFIX = "formy:task:inflight:"        # 用户处理中的任务（Set，基数即在途数量）
+    OVERFLOW_PREFIX = "formy:task:overflow:"        # 用户超限暂缓的任务（List）
+    OVERFLOW_USERS_SET = "formy:task:overflow:users"  # 存在暂缓任务的用户（Set）
+    MAX_DEFER_PER_CALL = 100                        # 单次出队最多暂缓的任务数量
+    INFLIGHT_TTL = 3600                             # 在途集合过期时间（秒，每次出队刷新；名额泄漏且未被回收时的兜底）
+    
+    STATUS_UPDATE_ATTEMPTS = 3                      # 状态更新期间任务持有者变化时的最多尝试次数
+    
+    # 脚本键约定：脚本访问的键尽量通过 KEYS 声明（任务 Hash、通道、索引、用户在途/暂缓键等）。
+    # 只有出队时才知道的键无法预先声明：出队脚本读取队首任务的 Hash 与其用户的在途/暂缓键，
+    # 名额释放时读取被放回任务的 Hash（用于确定其通道），这些键由 ARGV 中的前缀拼接。
+    # 因此任务队列要求单节点 Redis（或 Sentinel 主从），不支持 Redis Cluster / 按键分片的代理。
+    
+    # 释放用户并发名额（Lua 片段，供回收/状态更新脚本共用）：
+    # 从用户在途集合移除任务，名额确实被释放时把该用户最早暂缓的任务放回其通道队首
+    # 名额配置（slot_config(kb, ab) 从 KEYS[kb] / ARGV[ab] 起读取，由 _slot_keys / _slot_args 生成）:
+    #   KEYS: 用户在途集合、用户暂缓列表、暂缓用户集合、入队通知键、各通道键
+    #   ARGV: 用户ID、任务键前缀、入队通知最大数量、默认通道、通道数量、各通道名
+    _RELEASE_SLOT_LUA = """
+    local function slot_config(kb, ab)
+        local cfg = {
+            inflight = KEYS[kb],
+            overflow = KEYS[kb + 1],
+            overflow_users = KEYS[kb + 2],
+            wakeup = KEYS[kb + 3],
+            user_id = ARGV[ab],
+            task_prefix = ARGV[ab + 1],
+            wakeup_max = tonumber(ARGV[ab + 2]),
+            default_lane = ARGV[ab + 3],
+            lanes = {}
+        }
+        for i = 1, tonumber(ARGV[ab + 4]) do
+            cfg.lanes[ARGV[ab + 4 + i]] = KEYS[kb + 3 + i]
+        end
+        return cfg
+    end
+    
+    local function promote_overflow(cfg, count)
+        local promoted = {}
+        if count > 0 then
+            promoted = redis.call('LPOP', cfg.overflow, count) or {}
+        end
+        if redis.call('LLEN', cfg.overflow) == 0 then
+            redis.call('SREM', cfg.overflow_users, cfg.user_id)
+        end
+        -- 倒序 LPUSH：最早暂缓的任务位于通道队首
+        for i = #promoted, 1, -1 do
+            local lane = redis.call('HGET', cfg.task_prefix .. promoted[i], 'lane')
+            redis.call('LPUSH', cfg.lanes[lane] or cfg.lanes[cfg.default_lane], promoted[i])
+            redis.call('RPUSH', cfg.wakeup, '1')
+        end
+        if #promoted > 0 then
+            redis.call('LTRIM', cfg.wakeup, -cfg.wakeup_max, -1)
+        end
+        return #promoted
+    end
+    
+    local function release_slot(cfg, task_id)
+        if cfg.user_id == '' or redis.call('SREM', cfg.inflight, task_id) == 0 then
+            return 0
+        end
+        promote_overflow(cfg, 1)
+        return 1
+    end
+    """
+    
+    # 状态索引（Lua 片段）：status_index(base) 返回 {状态: 索引键}，索引键按 TASK_STATUSES 顺序从 KEYS[base] 起传入
+    _STATUS_INDEX_LUA = """
+    local function status_index(base)
+        local index = {}
+        for i, status in ipairs({%s}) do
+            index[status] = KEYS[base + i - 1]
+        end
+        return index
+    end
+    """ % ", ".join(f"'{status}'" for status in TASK_STATUSES)
+    
+    # 事件发布（Lua 片段）：递增任务 Hash 的 version 并附加到事件 JSON 末尾后发布；
+    # 订阅者按 version 判断事件先后，不比较各节点时钟生成的 updated_at
+    _EVENT_LUA = """
+    local function publish_event(task_key, channel, event)
+        local version = redis.call('HINCRBY', task_key, 'version', 1)
+        redis.call('PUBLISH', channel, string.sub(event, 1, -2) .. ',"version":' .. version .. '}')
+        return version
+    end
+    """
+    
+    # 重新排队脚本：原子地回收租约、移出 Worker 处理列表、累加重试次数并放回队首
+    # KEYS: [1] 租约 [2] 任务 Hash [3] Worker 处理列表 [4] 任务通道 [5] 处理中集合 [6] 全量索引
+    #       [7] 入队通知键 [8..12] 状态索引 [13..] 名额配置
+    # ARGV: [1] 任务ID [2] 当前时间戳 [3] 最大重试次数 [4] 是否强制回收 [5] 更新时间 [6] 当前步骤描述
+    #       [7] 入队通知最大数量 [8..] 名额配置
+    # 返回值: >0 重试次数 | -1 超过最大重试次数 | -2 已被处理/租约已续期 | -3 任务已结束
+    _REQUEUE_SCRIPT = _RELEASE_SLOT_LUA + _STATUS_INDEX_LUA + """
+    local task_id = ARGV[1]
+    local score = redis.call('ZSCORE', KEYS[1], task_id)
+    if ARGV[4] ~= '1' and (not score or tonumber(score) > tonumber(ARGV[2])) then
+        return -2
+    end
+    redis.call('ZREM', KEYS[1], task_id)
+    local removed = redis.call('LREM', KEYS[3], 0, task_id)
+    if not score and removed == 0 then
+        return -2
+    end
+    redis.call('SREM', KEYS[5], task_id)
+    release_slot(slot_config(13, 8), task_id)
+    local status = redis.call('HGET', KEYS[2], 'status')
+    if not status or status == 'done' or status == 'failed' or status == 'cancelled' then
+        return -3
+    end
+    local attempts = redis.call('HINCRBY', KEYS[2], 'attempts', 1)
+    if attempts > tonumber(ARGV[3]) then
+        return -1
+    end
+    redis.call('HSET', KEYS[2], 'status', 'pending', 'progress', '0', 'current_step', ARGV[6], 'updated_at', ARGV[5])
+    redis.call('HINCRBY', KEYS[2], 'version', 1)
+    redis.call('HDEL', KEYS[2], 'worker_id')
+    local created = redis.call('ZSCORE', KEYS[6], task_id)
+    local index = status_index(8)
+    if created and index[status] then
+        redis.call('ZREM', index[status], task_id)
+        redis.call('ZADD', index['pending'], created, task_id)
+    end
+    redis.call('HSET', KEYS[2], 'enqueued_at', ARGV[2])
+    redis.call('LPUSH', KEYS[4], task_id)
+    redis.call('RPUSH', KEYS[7], '1')
+    redis.call('LTRIM', KEYS[7], -tonumber(ARGV[7]), -1)
+    return attempts
+    """
+    
+    # 多通道出队脚本：按给定顺序从第一个非空通道取出任务，并记录排队耗时
+    # 队首任务所属用户在途任务数已达上限时，将其移入该用户的暂缓列表，继续检查下一个任务
+    # 取出的任务在同一脚本内加入处理中集合与用户在途集合（两者始终一致，供名额回收判断）
+    # KEYS: [1] 暂缓用户集合 [2] 处理中集合 [3..n+2] 按本次出队顺序排列的通道键
+    #       [n+3..2n+2] 对应通道的排队耗时样本键 [2n+3] 目标处理列表（可靠模式；不传表示直接弹出）
+    # ARGV: [1] 当前时间戳 [2] 样本保留数量 [3] 每用户并发上限（0 表示不限制） [4] 单次最多暂缓数量
+    #       [5] 任务键前缀 [6] 在途前缀 [7] 暂缓前缀 [8] 通道数量 n [9..n+8] 与通道键对应的通道名
+    #       [n+9] 在途集合过期时间（秒）
+    # 返回值: {task_id, lane} | {'', ''} 暂缓数量达到单次上限需立即重试 | false 所有通道为空
+    _DEQUEUE_SCRIPT = """
+    local limit = tonumber(ARGV[3])
+    local lanes = tonumber(ARGV[8])
+    local target = KEYS[2 * lanes + 3]
+    local deferred = 0
+    for i = 1, lanes do
+        local lane_key = KEYS[2 + i]
+        while true do
+            local task_id = redis.call('LINDEX', lane_key, 0)
+            if not task_id then
+                break
+            end
+            local task_key = ARGV[5] .. task_id
+            local user_id = redis.call('HGET', task_key, 'user_id')
+            local has_user = user_id and user_id ~= ''
+            if has_user and limit > 0 and redis.call('SCARD', ARGV[6] .. user_id) >= limit then
+                redis.call('LPOP', lane_key)
+                redis.call('RPUSH', ARGV[7] .. user_id, task_id)
+                redis.call('SADD', KEYS[1], user_id)
+                deferred = deferred + 1
+                if deferred >= tonumber(ARGV[4]) then
+                    return {'', ''}
+                end
+            else
+                if target then
+                    redis.call('LMOVE', lane_key, target, 'LEFT', 'RIGHT')
+                else
+                    redis.call('LPOP', lane_key)
+                end
+                redis.call('SADD', KEYS[2], task_id)
+                if has_user then
+                    redis.call('SADD', ARGV[6] .. user_id, task_id)
+                    redis.call('EXPIRE', ARGV[6] .. user_id, ARGV[9 + lanes])
+                end
+                local enqueued_at = redis.call('HGET', task_key, 'enqueued_at')
+                if enqueued_at then
+                    local stats_key = KEYS[2 + lanes + i]
+                    redis.call('LPUSH', stats_key, tostring(tonumber(ARGV[1]) - tonumber(enqueued_at)))
+                    redis.call('LTRIM', stats_key, 0, tonumber(ARGV[2]) - 1)
+                end
+                return {task_id, ARGV[8 + i]}
+            end
+        end
+    end
+    return false
+    """
+    
+    # 释放名额脚本（任务删除时调用；名额回收时只释放已不在处理中的任务）
+    # KEYS: [1] 任务 Hash [2] 处理中集合 [3..] 名额配置
+    # ARGV: [1] 任务ID [2] 是否只释放泄漏的名额（'1'：任务仍在处理中集合且未结束时跳过） [3..] 名额配置
+    _RELEASE_SCRIPT = _RELEASE_SLOT_LUA + """
+    if ARGV[2] == '1' and redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 1 then
+        local status = redis.call('HGET', KEYS[1], 'status')
+        if status and status ~= 'done' and status ~= 'failed' and status ~= 'cancelled' then
+            return 0
+        end
+    end
+    return release_slot(slot_config(3, 3), ARGV[1])
+    """
+    
+    # 暂缓任务补放脚本（名额回收时调用）：在途集合过期或名额已被回收时，release_slot 不会再放回暂缓任务，
+    # 按用户当前空闲名额（上限 - 在途数量）把最早暂缓的任务放回通道队首
+    # KEYS: 名额配置; ARGV: [1] 每用户并发上限（0 表示不限制） [2..] 名额配置
+    # 返回值: 放回的任务数量
+    _PROMOTE_SCRIPT = _RELEASE_SLOT_LUA + """
+    local cfg = slot_config(1, 2)
+    local limit = tonumber(ARGV[1])
+    local count = redis.call('LLEN', cfg.overflow)
+    if limit > 0 then
+        count = math.min(count, limit - redis.call('SCARD', cfg.inflight))
+    end
+    return promote_overflow(cfg, count)
+    """
+    
+    # 状态更新脚本：在同一脚本内读取旧状态并迁移状态索引，并发的状态变更不会让任务同时留在两个状态索引中；
+    # 任务结束时在同一脚本内释放用户并发名额
+    # KEYS: [1] 任务 Hash [2] 全量索引 [3] 处理中集合 [4] 租约 [5] 结束时间索引 [6] Worker 处理列表
+    #       [7..11] 状态索引 [12..] 名额配置
+    # ARGV: [1] 任务ID [2] 新状态 [3] 调用方读取到的 worker_id（'' 表示无） [4] 结束时间戳
+    #       [5] 结束任务过期时间（秒，0 表示不过期） [6] 事件频道 [7] 状态事件 [8] 写入 Hash 的字段（JSON）
+    #       [9..] 名额配置
+    # 返回值: 1 已更新 | 0 任务不存在（已删除或过期，不重新创建 Hash）
+    #         | -1 worker_id 已变化（任务被回收/重新分配），调用方需重新读取后重试
+    _STATUS_SCRIPT = _RELEASE_SLOT_LUA + _STATUS_INDEX_LUA + _EVENT_LUA + """
+    local task_id = ARGV[1]
+    local status = ARGV[2]
+    local old_status, worker_id = unpack(redis.call('HMGET', KEYS[1], 'status', 'worker_id'))
+    if not old_status then
+        return 0
+    end
+    if (worker_id or '') ~= ARGV[3] then
+        return -1
+    end
+    for field, value in pairs(cjson.decode(ARGV[8])) do
+        redis.call('HSET', KEYS[1], field, value)
+    end
+    local created = redis.call('ZSCORE', KEYS[2], task_id)
+    local index = status_index(7)
+    if old_status ~= status and created then
+        if old_status and index[old_status] then
+            redis.call('ZREM', index[old_status], task_id)
+        end
+        redis.call('ZADD', index[status], created, task_id)
+    end
+    if status == 'done' or status == 'failed' or status == 'cancelled' then
+        redis.call('SREM', KEYS[3], task_id)
+        redis.call('ZREM', KEYS[4], task_id)
+        if ARGV[3] ~= '' then
+            redis.call('LREM', KEYS[6], 0, task_id)
+        end
+        redis.call('ZADD', KEYS[5], ARGV[4], task_id)
+        if tonumber(ARGV[5]) > 0 then
+            redis.call('EXPIRE', KEYS[1], ARGV[5])
+        end
+        release_slot(slot_config(12, 9), task_id)
+    end
+    publish_event(KEYS[1], ARGV[6], ARGV[7])
+    return 1
+    """
+    
+    # 批量进度写入脚本：只更新仍在处理中的任务（已结束 / 已重新排队的任务跳过，不会被迟到的进度覆盖）
+    # KEYS: 任务 Hash；ARGV: [1] 事件频道 [2] 更新时间，之后每个任务依次为 进度、当前步骤、状态事件
+    # 返回值: 实际写入的任务数
+    _PROGRESS_SCRIPT = _EVENT_LUA + """
+    local written = 0
+    for i, key in ipairs(KEYS) do
+        local base = 2 + (i - 1) * 3
+        if redis.call('HGET', key, 'status') == 'processing' then
+            redis.call('HSET', key, 'progress', ARGV[base + 1], 'updated_at', ARGV[2])
+            if ARGV[base + 2] ~= '' then
+                redis.call('HSET', key, 'current_step', ARGV[base + 2])
+            end
+            publish_event(key, ARGV[1], ARGV[base + 3])
+            written = written + 1
+        end
+    end
+    return written
+    """
     
     def __init__(self):
         """初始化 Redis 连接"""
         # 使用统一的 Redis 客户端（基于 REDIS_URL）
         self.redis_client = get_redis_client()
+        self.reliable = settings.TASK_RELIABLE_QUEUE
+        self.lease_seconds = settings.TASK_LEASE_SECONDS
+        self.lane_weights = settings.get_task_queue_lanes
+        self.default_lane = settings.TASK_QUEUE_DEFAULT_LANE
+        self._requeue_script = self.redis_client.register_script(self._REQUEUE_SCRIPT)
+        self._dequeue_script = self.redis_client.register_script(self._DEQUEUE_SCRIPT)
+        self._release_script = self.redis_client.register_script(self._RELEASE_SCRIPT)
+        self._promote_script = self.redis_client.register_script(self._PROMOTE_SCRIPT)
+        self._progress_script = self.redis_client.register_script(self._PROGRESS_SCRIPT)
+        self._status_script = self.redis_client.register_script(self._STATUS_SCRIPT)
+        self.max_concurrent_per_user = settings.MAX_CONCURRENT_TASKS_PER_USER
+        self.retention_seconds = max(0, settings.TASK_RETENTION_DAYS) * 86400
+        self._async_status_script = None
+    
+    @property
+    def async_redis(self):
+        """共享的异步 Redis 客户端（API 请求处理使用）"""
+        return get_async_redis_client()
     
-    def push_task(self, task_id: str, task_data: Dict[str, Any]) -> bool:
+    def push_task(self, task_id: str, task_data: Dict[str, Any], lane: Optional[str] = None) -> bool:
         """
         推送任务到队列
         
         Args:
             task_id: 任务ID
             task_data: 任务数据
+            lane: 优先级通道（默认 TASK_QUEUE_DEFAULT_LANE）
             
         Returns:
             bool: 是否成功
         """
         try:
-            # 1. 存储任务数据到 Hash
-            task_key = f"{self.TASK_KEY_PREFIX}{task_id}"
-            self.redis_client.hset(
-                task_key,
-                mapping={
-                    "task_id": task_id,
-                    "status": "pending",
-                    "data": json.dumps(task_data, ensure_ascii=False),
-                    "created_at": datetime.now().isoformat(),
-                    "updated_at": datetime.now().isoformat()
-                }
-            )
-            
-            # 2. 推入队列（右侧推入）
-            self.redis_client.rpush(self.QUEUE_KEY, task_id)
-            
+            pipe = self.redis_client.pipeline(transaction=True)
+            self._queue_push(pipe, task_id, task_data, lane)
+            pipe.execute()
             return True
         except Exception as e:
             print(f"推送任务失败: {e}")
             return False
     
-    def pop_task(self, timeout: int = 5) -> Optional[str]:
+    def _queue_push(self, pipe, task_id: str, task_data: Dict[str, Any], lane: Optional[str]):
+        """向 Pipeline 写入入队命令（同步/异步入队共用）"""
+        task_key = f"{self.TASK_KEY_PREFIX}{task_id}"
+        now = datetime.now()
+        score = now.timestamp()
+        mode = task_data.get("mode") or ""
+        user_id = task_data.get("user_id") or ""
+        lane = lane if lane in self.lane_weights else self.default_lane
+        
+        # 1. 存储任务数据到 Hash（mode/user_id 冗余存储，便于维护索引时无需解析 data）
+        pipe.hset(
+            task_key,
+            mapping={
+                "task_id": task_id,
+                "status": "pending",
+                "mode": mode,
+                "user_id": user_id,
+                "lane": lane,
+                "data": json.dumps(task_data, ensure_ascii=False),
+                "created_at": now.isoformat(),
+                "updated_at": now.isoformat(),
+                "enqueued_at": score
+            }
+        )
+        
+        # 2. 写入二级索引
+        for index_key in self._index_keys(mode=mode, user_id=user_id, status="pending"):
+            pipe.zadd(index_key, {task_id: score})
+        
+        # 3. 推入对应优先级通道（右侧推入），并唤醒一个空闲 Worker
+        pipe.rpush(self._lane_key(lane), task_id)
+        pipe.rpush(self.WAKEUP_KEY, "1")
+        pipe.ltrim(self.WAKEUP_KEY, -self.WAKEUP_MAX, -1)
+    
+    def pop_task(self, timeout: int = 5, worker_id: Optional[str] = None) -> Optional[str]:
         """
         从队列中弹出任务（阻塞式）
         
+        多个优先级通道按权重随机决定本次出队顺序（加权公平，低优先级通道不会饿死），
+        所有通道为空时阻塞等待入队通知。
+        
+        用户在途任务数达到 MAX_CONCURRENT_TASKS_PER_USER 时，其任务被移入暂缓列表，
+        待该用户有任务结束后再放回队首，集群吞吐在用户之间公平分配而不拒绝提交。
+        
+        可靠模式下（TASK_RELIABLE_QUEUE 且提供 worker_id）任务被原子地 LMOVE 到 Worker
+        私有处理列表并登记租约，Worker 崩溃后任务可被回收重新排队。
+        
         Args:
             timeout: 阻塞超时时间（秒）
+            worker_id: Worker ID（可靠模式需要）
             
         Returns:
             Optional[str]: 任务ID，如果超时返回 None
         """
         try:
-            # 从左侧弹出（FIFO）
-            result = self.redis_client.blpop(self.QUEUE_KEY, timeout=timeout)
-            if result:
-                _, task_id = result
-                # 标记为处理中
-                self.redis_client.sadd(self.PROCESSING_SET, task_id)
-                return task_id
-            return None
+            reliable = bool(self.reliable and worker_id)
+            deadline = time.time() + timeout
+            
+            while True:
+                lanes = self._weighted_lane_order()
+                keys = [
+                    self.OVERFLOW_USERS_SET,
+                    self.PROCESSING_SET,
+                    *[self._lane_key(lane) for lane in lanes],
+                    *[f"{self.WAIT_STATS_PREFIX}{lane}" for lane in lanes]
+                ]
+                if reliable:
+                    keys.append(self._worker_list_key(worker_id))
+                result = self._dequeue_script(
+                    keys=keys,
+                    args=[
+                        time.time(),
+                        settings.TASK_WAIT_SAMPLES,
+                        self.max_concurrent_per_user,
+                        self.MAX_DEFER_PER_CALL,
+                        self.TASK_KEY_PREFIX,
+                        self.INFLIGHT_PREFIX,
+                        self.OVERFLOW_PREFIX,
+                        len(lanes),
+                        *lanes,
+                        self.INFLIGHT_TTL
+                    ]
+                )
+                
+                if result and not result[0]:
+                    # 本轮暂缓了大量超限任务，立即继续检查
+                    continue
+                
+                if result:
+                    task_id = result[0]
+                    if reliable:
+                        self._acquire_lease(task_id, worker_id)
+                    return task_id
+                
+                # 所有通道为空：等待入队通知
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                if not self.redis_client.blpop(self.WAKEUP_KEY, timeout=math.ceil(remaining)):
+                    return None
         except Exception as e:
             print(f"弹出任务失败: {e}")
             return None
     
+    def register_worker(self, worker_id: str) -> bool:
+        """
+        注册 Worker 并写入存活标记
+        
+        Args:
+            worker_id: Worker ID
+            
+        Returns:
+            bool: 是否成功
+        """
+        return self.heartbeat(worker_id, [])
+    
+    def unregister_worker(self, worker_id: str) -> bool:
+        """
+        注销 Worker（优雅关闭时调用）
+        
+        处理列表中残留的任务会由回收流程立即重新排队。
+        
+        Args:
+            worker_id: Worker ID
+            
+        Returns:
+            bool: 是否成功
+        """
+        try:
+            self.redis_client.delete(self._worker_alive_key(worker_id))
+            return True
+        except Exception as e:
+            print(f"注销 Worker 失败: {e}")
+            return False
+    
+    def heartbeat(self, worker_id: str, task_ids: List[str]) -> bool:
+        """
+        Worker 心跳：刷新存活标记并为处理中的任务续租
+        
+        Args:
+            worker_id: Worker ID
+            task_ids: Worker 当前持有的任务ID列表
+            
+        Returns:
+            bool: 是否成功
+        """
+        try:
+            lease_until = time.time() + self.lease_seconds
+            
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.sadd(self.WORKERS_SET, worker_id)
+            pipe.set(self._worker_alive_key(worker_id), lease_until, ex=self.lease_seconds)
+            if task_ids:
+                # 仅续期已存在的租约（已结束的任务不会被重新加入）
+                pipe.zadd(self.LEASE_KEY, {task_id: lease_until for task_id in task_ids}, xx=True)
+            pipe.execute()
+            return True
+        except Exception as e:
+            print(f"Worker 心跳失败: {e}")
+            return False
+    
+    def requeue_expired_tasks(self, max_retries: int) -> Tuple[List[str], List[str]]:
+        """
+        回收孤儿任务：租约过期的任务，以及已失联 Worker 处理列表中的任务
+        
+        可被多个 Worker 并发调用，每个任务只会被回收一次。
+        
+        Args:
+            max_retries: 最大重新排队次数
+            
+        Returns:
+            Tuple[List[str], List[str]]: (已重新排队的任务ID, 超过重试次数需标记失败的任务ID)
+        """
+        requeued: List[str] = []
+        exhausted: List[str] = []
+        
+        try:
+            now = time.time()
+            
+            # task_id -> (worker_id, 是否强制回收)
+            candidates: Dict[str, Tuple[Optional[str], bool]] = {}
+            
+            # 1. 租约过期的任务
+            for task_id in self.redis_client.zrangebyscore(self.LEASE_KEY, "-inf", now):
+                candidates[task_id] = (None, False)
+            
+            # 2. 已失联 Worker 的处理列表（覆盖 BLMOVE 之后、登记租约之前崩溃的情况）
+            dead_workers = []
+            for worker_id in self.redis_client.smembers(self.WORKERS_SET):
+                if self.redis_client.exists(self._worker_alive_key(worker_id)):
+                    continue
+                dead_workers.append(worker_id)
+                for task_id in self.redis_client.lrange(self._worker_list_key(worker_id), 0, -1):
+                    candidates[task_id] = (worker_id, True)
+            
+            for task_id, (worker_id, force) in candidates.items():
+                holder, lane, user_id = self.redis_client.hmget(
+                    f"{self.TASK_KEY_PREFIX}{task_id}", "worker_id", "lane", "user_id"
+                )
+                worker_id = worker_id or holder
+                result = self._requeue_script(
+                    keys=[
+                        self.LEASE_KEY,
+                        f"{self.TASK_KEY_PREFIX}{task_id}",
+                        self._worker_list_key(worker_id or ""),
+                        self._lane_key(lane or self.default_lane),
+                        self.PROCESSING_SET,
+                        self.INDEX_ALL_KEY,
+                        self.WAKEUP_KEY,
+                        *self._status_index_keys(),
+                        *self._slot_keys(user_id),
+                    ],
+                    args=[
+                        task_id,
+                        now,
+                        max_retries,
+                        "1" if force else "0",
+                        datetime.now().isoformat(),
+                        "Worker 中断，任务已重新排队",
+                        self.WAKEUP_MAX,
+                        *self._slot_args(user_id),
+                    ]
+                )
+                if result == -1:
+                    exhausted.append(task_id)
+                elif result > 0:
+                    requeued.append(task_id)
+            
+            # 3. 清理处理列表已清空的失联 Worker
+            for worker_id in dead_workers:
+                if self.redis_client.llen(self._worker_list_key(worker_id)) == 0:
+                    self.redis_client.srem(self.WORKERS_SET, worker_id)
+            
+            return requeued, exhausted
+        except Exception as e:
+            print(f"回收孤儿任务失败: {e}")
+            return requeued, exhausted
+    
+    def _acquire_lease(self, task_id: str, worker_id: str):
+        """登记任务租约并记录持有者"""
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.zadd(self.LEASE_KEY, {task_id: time.time() + self.lease_seconds})
+        pipe.hset(f"{self.TASK_KEY_PREFIX}{task_id}", "worker_id", worker_id)
+        pipe.execute()
+    
+    def _lane_key(self, lane: str) -> str:
+        """优先级通道键（normal 通道沿用原队列键，兼容存量任务）"""
+        if lane == "normal":
+            return self.QUEUE_KEY
+        return f"{self.LANE_KEY_PREFIX}{lane}"
+    
+    def _status_index_keys(self) -> List[str]:
+        """全部状态索引键（顺序与 TASK_STATUSES 一致，供 _STATUS_INDEX_LUA 使用）"""
+        return [f"{self.INDEX_STATUS_PREFIX}{task_status}" for task_status in self.TASK_STATUSES]
+    
+    def _slot_keys(self, user_id: Optional[str]) -> List[str]:
+        """释放名额 Lua 片段所需的键（顺序与 _RELEASE_SLOT_LUA 约定一致）"""
+        return [
+            f"{self.INFLIGHT_PREFIX}{user_id or ''}",
+            f"{self.OVERFLOW_PREFIX}{user_id or ''}",
+            self.OVERFLOW_USERS_SET,
+            self.WAKEUP_KEY,
+            *[self._lane_key(lane) for lane in self._slot_lanes()],
+        ]
+    
+    def _slot_args(self, user_id: Optional[str]) -> List[Any]:
+        """释放名额 Lua 片段所需的参数（顺序与 _RELEASE_SLOT_LUA 约定一致）"""
+        lanes = self._slot_lanes()
+        return [
+            user_id or "",
+            self.TASK_KEY_PREFIX,
+            self.WAKEUP_MAX,
+            self.default_lane,
+            len(lanes),
+            *lanes,
+        ]
+    
+    def _slot_lanes(self) -> List[str]:
+        """被放回的暂缓任务可能进入的通道（已配置通道 + 默认通道；未知通道的任务放回默认通道）"""
+        lanes = list(self.lane_weights)
+        if self.default_lane not in lanes:
+            lanes.append(self.default_lane)
+        return lanes
+    
+    def release_user_slot(self, task_id: str) -> bool:
+        """
+        释放任务占用的用户并发名额，并放回该用户一个暂缓任务
+        
+        重复调用是安全的：名额只会释放一次。
+        
+        Args:
+            task_id: 任务ID
+            
+        Returns:
+            bool: 是否释放了名额
+        """
+        try:
+            user_id = self.redis_client.hget(f"{self.TASK_KEY_PREFIX}{task_id}", "user_id")
+            return bool(self._release_slot(task_id, user_id, stale_only=False))
+        except Exception as e:
+            print(f"释放用户并发名额失败: {e}")
+            return False
+    
+    def reconcile_user_slots(self) -> int:
+        """
+        回收泄漏的用户并发名额：释放在途集合中已不在处理中（已结束 / 已删除 / 已移出处理中集合）的任务，
+        并按空闲名额放回暂缓用户的任务
+        
+        出队时任务同时加入处理中集合与在途集合，结束/回收时同时移除，两者不一致即说明名额已泄漏。
+        在途集合在长任务期间过期后，任务结束时不会再放回暂缓任务，因此还需遍历暂缓用户集合补放。
+        由孤儿任务回收流程周期性调用，可被多个 Worker 并发调用。
+        
+        Returns:
+            int: 释放的名额数量与补放的暂缓任务数量之和
+        """
+        released = 0
+        try:
+            for key in self.redis_client.scan_iter(match=f"{self.INFLIGHT_PREFIX}*"):
+                user_id = key[len(self.INFLIGHT_PREFIX):]
+                for task_id in self.redis_client.smembers(key):
+                    released += self._release_slot(task_id, user_id, stale_only=True)
+            
+            for user_id in self.redis_client.smembers(self.OVERFLOW_USERS_SET):
+                released += self._promote_script(
+                    keys=self._slot_keys(user_id),
+                    args=[self.max_concurrent_per_user, *self._slot_args(user_id)]
+                )
+        except Exception as e:
+            print(f"回收用户并发名额失败: {e}")
+        return released
+    
+    def _release_slot(self, task_id: str, user_id: Optional[str], stale_only: bool) -> int:
+        """执行释放名额脚本"""
+        return self._release_script(
+            keys=[f"{self.TASK_KEY_PREFIX}{task_id}", self.PROCESSING_SET, *self._slot_keys(user_id)],
+            args=[task_id, "1" if stale_only else "0", *self._slot_args(user_id)]
+        )
+    
+    def get_deferred_count(self) -> int:
+        """获取因用户并发超限而暂缓的任务数量"""
+        try:
+            users = self.redis_client.smembers(self.OVERFLOW_USERS_SET)
+            if not users:
+                return 0
+            pipe = self.redis_client.pipeline(transaction=False)
+            for user_id in users:
+                pipe.llen(f"{self.OVERFLOW_PREFIX}{user_id}")
+            return sum(pipe.execute())
+        except Exception as e:
+            print(f"获取暂缓任务数量失败: {e}")
+            return 0
+    
+    def _weighted_lane_order(self) -> List[str]:
+        """按权重随机生成本次出队的通道顺序（加权不放回抽样）"""
+        lanes = list(self.lane_weights.items())
+        order = []
+        while lanes:
+            pick = random.uniform(0, sum(weight for _, weight in lanes))
+            for idx, (_, weight) in enumerate(lanes):
+                pick -= weight
+                if pick <= 0:
+                    break
+            order.append(lanes.pop(idx)[0])
+        return order
+    
+    def _worker_list_key(self, worker_id: str) -> str:
+        """Worker 私有处理列表键"""
+        return f"{self.WORKER_KEY_PREFIX}{worker_id}:processing"
+    
+    def _worker_alive_key(self, worker_id: str) -> str:
+        """Worker 存活标记键"""
+        return f"{self.WORKER_KEY_PREFIX}{worker_id}:alive"
+    
     def get_task_data(self, task_id: str) -> Optional[Dict[str, Any]]:
         """
         获取任务数据
@@ -92,20 +758,42 @@ class TaskQueue:
         """
         try:
             task_key = f"{self.TASK_KEY_PREFIX}{task_id}"
-            data = self.redis_client.hgetall(task_key)
-            
-            if not data:
-                return None
-            
-            # 解析 JSON 数据
-            if "data" in data:
-                data["data"] = json.loads(data["data"])
-            
-            return data
+            return self._parse_task_data(self.redis_client.hgetall(task_key))
         except Exception as e:
             print(f"获取任务数据失败: {e}")
             return None
     
+    @staticmethod
+    def _parse_task_data(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """解析任务 Hash（data 字段为 JSON），空 Hash 返回 None"""
+        if not data:
+            return None
+        if "data" in data:
+            data["data"] = json.loads(data["data"])
+        return data
+    
+    def get_task_data_many(self, task_ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        批量获取任务数据（单次 Pipeline 往返）
+        
+        Args:
+            task_ids: 任务ID列表
+            
+        Returns:
+            List[Optional[Dict]]: 与 task_ids 顺序一致的任务数据，不存在的任务为 None
+        """
+        if not task_ids:
+            return []
+        
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for task_id in task_ids:
+                pipe.hgetall(f"{self.TASK_KEY_PREFIX}{task_id}")
+            return [self._parse_task_data(data) for data in pipe.execute()]
+        except Exception as e:
+            print(f"批量获取任务数据失败: {e}")
+            return [None] * len(task_ids)
+    
     def update_task_status(
         self, 
         task_id: str, 
@@ -131,41 +819,150 @@ class TaskQueue:
         """
         try:
             task_key = f"{self.TASK_KEY_PREFIX}{task_id}"
+            update_data = self._status_fields(status, progress, current_step, result, error)
             
-            # 构建更新字段
-            update_data = {
-                "status": status,
-                "progress": str(progress),
-                "updated_at": datetime.now().isoformat()
-            }
-            
-            if current_step:
-                update_data["current_step"] = current_step
-            
-            if result:
-                update_data["result"] = json.dumps(result, ensure_ascii=False)
-            
-            if error:
-                update_data["error"] = json.dumps(error, ensure_ascii=False)
-            
-            # 记录完成/失败时间
-            if status == "done":
-                update_data["completed_at"] = datetime.now().isoformat()
-            elif status == "failed":
-                update_data["failed_at"] = datetime.now().isoformat()
-            
-            # 更新 Hash
-            self.redis_client.hset(task_key, mapping=update_data)
-            
-            # 如果任务完成/失败/取消，从处理中集合移除
-            if status in ["done", "failed", "cancelled"]:
-                self.redis_client.srem(self.PROCESSING_SET, task_id)
-            
+            # 旧状态的读取、状态索引迁移与名额释放在同一脚本内完成；
+            # worker_id 用于确定处理列表键，脚本执行前被回收/重新分配时重新读取
+            for _ in range(self.STATUS_UPDATE_ATTEMPTS):
+                worker_id, user_id = self.redis_client.hmget(task_key, "worker_id", "user_id")
+                keys, args = self._status_script_params(task_id, status, worker_id, user_id, update_data)
+                updated = self._status_script(keys=keys, args=args)
+                if updated != -1:
+                    break
+            else:
+                print(f"更新任务状态失败: 任务 {task_id} 持有者频繁变化")
+                return False
+            if updated == 0:
+                print(f"更新任务状态失败: 任务不存在 {task_id}")
+                return False
             return True
         except Exception as e:
             print(f"更新任务状态失败: {e}")
             return False
     
+    def update_progress_many(self, updates: Dict[str, Tuple[int, Optional[str]]]) -> int:
+        """
+        批量写入处理中任务的进度（单次 Lua 调用，状态不变、无需迁移索引）
+        
+        Args:
+            updates: {任务ID: (进度百分比, 当前步骤描述)}
+            
+        Returns:
+            int: 实际写入的任务数（已结束或不在处理中的任务被跳过）
+        """
+        if not updates:
+            return 0
+        
+        try:
+            updated_at = datetime.now().isoformat()
+            keys = []
+            args = [self.EVENTS_CHANNEL, updated_at]
+            for task_id, (progress, current_step) in updates.items():
+                fields = {
+                    "status": "processing",
+                    "progress": progress,
+                    "current_step": current_step,
+                    "updated_at": updated_at
+                }
+                keys.append(f"{self.TASK_KEY_PREFIX}{task_id}")
+                args += [progress, current_step or "", json.dumps(self.task_event(task_id, fields), ensure_ascii=False)]
+            return int(self._progress_script(keys=keys, args=args))
+        except Exception as e:
+            print(f"批量更新任务进度失败: {e}")
+            return 0
+    
+    @staticmethod
+    def _status_fields(
+        status: str,
+        progress: int,
+        current_step: Optional[str],
+        result: Optional[Dict[str, Any]],
+        error: Optional[Dict[str, Any]]
+    ) -> Dict[str, str]:
+        """构建状态更新写入 Hash 的字段"""
+        update_data = {
+            "status": status,
+            "progress": str(progress),
+            "updated_at": datetime.now().isoformat()
+        }
+        
+        if current_step:
+            update_data["current_step"] = current_step
+        
+        if result:
+            update_data["result"] = json.dumps(result, ensure_ascii=False)
+        
+        if error:
+            update_data["error"] = json.dumps(error, ensure_ascii=False)
+        
+        # 记录完成/失败时间
+        if status == "done":
+            update_data["completed_at"] = datetime.now().isoformat()
+        elif status == "failed":
+            update_data["failed_at"] = datetime.now().isoformat()
+        return update_data
+    
+    def _status_script_params(
+        self,
+        task_id: str,
+        status: str,
+        worker_id: Optional[str],
+        user_id: Optional[str],
+        update_data: Dict[str, str]
+    ) -> Tuple[List[str], List[Any]]:
+        """状态更新脚本的 KEYS / ARGV（同步/异步更新共用）"""
+        keys = [
+            f"{self.TASK_KEY_PREFIX}{task_id}",
+            self.INDEX_ALL_KEY,
+            self.PROCESSING_SET,
+            self.LEASE_KEY,
+            self.INDEX_FINISHED_KEY,
+            self._worker_list_key(worker_id or ""),
+            *self._status_index_keys(),
+            *self._slot_keys(user_id),
+        ]
+        args = [
+            task_id,
+            status,
+            worker_id or "",
+            time.time(),
+            self.retention_seconds + self.RETENTION_GRACE_SECONDS if self.retention_seconds else 0,
+            self.EVENTS_CHANNEL,
+            json.dumps(self.task_event(task_id, update_data), ensure_ascii=False),
+            json.dumps(update_data, ensure_ascii=False),
+            *self._slot_args(user_id),
+        ]
+        return keys, args
+    
+    @staticmethod
+    def task_event(task_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        任务 Hash 字段 -> 状态事件（推送给订阅者的内容）
+        
+        Args:
+            task_id: 任务ID
+            fields: 任务 Hash 字段（或状态更新写入的字段）
+        
+        Returns:
+            Dict: task_id / status / progress / current_step / result / error / updated_at，
+                  以及 version（任务 Hash 每次写入递增；发布事件时由脚本附加）
+        """
+        event = {
+            "task_id": task_id,
+            "status": fields.get("status"),
+            "progress": int(fields.get("progress") or 0),
+            "current_step": fields.get("current_step"),
+            "result": None,
+            "error": None,
+            "updated_at": fields.get("updated_at"),
+        }
+        for field in ("result", "error"):
+            value = fields.get(field)
+            event[field] = json.loads(value) if isinstance(value, str) else value
+        if fields.get("version") is not None:
+            event["version"] = int(fields["version"])
+        return event
+    
     def cancel_task(self, task_id: str) -> bool:
         """
         取消任务
@@ -177,8 +974,11 @@ class TaskQueue:
             bool: 是否成功
         """
         try:
-            # 从队列中移除（如果还在队列中）
-            self.redis_client.lrem(self.QUEUE_KEY, 0, task_id)
+            # 从所在通道中移除（如果还在队列中）
+            lane, user_id = self.redis_client.hmget(f"{self.TASK_KEY_PREFIX}{task_id}", "lane", "user_id")
+            self.redis_client.lrem(self._lane_key(lane or self.default_lane), 0, task_id)
+            if user_id:
+                self.redis_client.lrem(f"{self.OVERFLOW_PREFIX}{user_id}", 0, task_id)
             
             # 更新状态为已取消
             return self.update_task_status(task_id, "cancelled")
@@ -187,13 +987,67 @@ class TaskQueue:
             return False
     
     def get_queue_length(self) -> int:
-        """获取队列长度"""
+        """获取队列长度（所有通道之和）"""
         try:
-            return self.redis_client.llen(self.QUEUE_KEY)
+            pipe = self.redis_client.pipeline(transaction=False)
+            for lane in self.lane_weights:
+                pipe.llen(self._lane_key(lane))
+            return sum(pipe.execute())
         except Exception as e:
             print(f"获取队列长度失败: {e}")
             return 0
     
+    def get_lane_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        获取各优先级通道统计
+        
+        Returns:
+            Dict: {通道名: {depth, oldest_wait_seconds, wait_p50, wait_p90, wait_p99, samples}}
+            排队耗时分位数基于最近 TASK_WAIT_SAMPLES 次出队（秒）
+        """
+        try:
+            lanes = list(self.lane_weights)
+            
+            pipe = self.redis_client.pipeline(transaction=False)
+            for lane in lanes:
+                pipe.llen(self._lane_key(lane))
+                pipe.lindex(self._lane_key(lane), 0)
+                pipe.lrange(f"{self.WAIT_STATS_PREFIX}{lane}", 0, -1)
+            results = pipe.execute()
+            
+            # 队首任务的入队时间（用于计算当前最长等待）
+            heads = [results[i * 3 + 1] for i in range(len(lanes))]
+            pipe = self.redis_client.pipeline(transaction=False)
+            for head in heads:
+                pipe.hget(f"{self.TASK_KEY_PREFIX}{head or ''}", "enqueued_at")
+            head_enqueued = pipe.execute()
+            
+            now = time.time()
+            stats = {}
+            for i, lane in enumerate(lanes):
+                samples = sorted(float(v) for v in results[i * 3 + 2])
+                enqueued_at = head_enqueued[i]
+                stats[lane] = {
+                    "depth": results[i * 3],
+                    "oldest_wait_seconds": round(now - float(enqueued_at), 3) if enqueued_at else 0.0,
+                    "wait_p50": self._percentile(samples, 50),
+                    "wait_p90": self._percentile(samples, 90),
+                    "wait_p99": self._percentile(samples, 99),
+                    "samples": len(samples)
+                }
+            return stats
+        except Exception as e:
+            print(f"获取通道统计失败: {e}")
+            return {}
+    
+    @staticmethod
+    def _percentile(sorted_values: List[float], percent: int) -> Optional[float]:
+        """计算分位数（最近秩法），无样本时返回 None"""
+        if not sorted_values:
+            return None
+        rank = max(0, int(round(percent / 100 * len(sorted_values))) - 1)
+        return round(sorted_values[min(rank, len(sorted_values) - 1)], 3)
+    
     def get_processing_count(self) -> int:
         """获取正在处理的任务数量"""
         try:
@@ -223,16 +1077,101 @@ class TaskQueue:
         """
         try:
             task_key = f"{self.TASK_KEY_PREFIX}{task_id}"
-            self.redis_client.delete(task_key)
-            self.redis_client.srem(self.PROCESSING_SET, task_id)
+            mode, user_id, data = self.redis_client.hmget(task_key, "mode", "user_id", "data")
+            
+            # 兼容旧任务：mode/user_id 只存在于 data 中
+            if (not mode or not user_id) and data:
+                input_data = json.loads(data)
+                mode = mode or input_data.get("mode") or ""
+                user_id = user_id or input_data.get("user_id") or ""
+            
+            # 释放可能仍占用的并发名额
+            self.release_user_slot(task_id)
+            
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.delete(task_key)
+            pipe.srem(self.PROCESSING_SET, task_id)
+            pipe.zrem(self.LEASE_KEY, task_id)
+            
+            # 从所有索引中移除（状态索引逐个清理，避免依赖可能过期的状态字段）
+            pipe.zrem(self.INDEX_ALL_KEY, task_id)
+            pipe.zrem(self.INDEX_FINISHED_KEY, task_id)
+            for task_status in self.TASK_STATUSES:
+                pipe.zrem(f"{self.INDEX_STATUS_PREFIX}{task_status}", task_id)
+            if mode:
+                pipe.zrem(f"{self.INDEX_MODE_PREFIX}{mode}", task_id)
+            if user_id:
+                pipe.zrem(f"{self.INDEX_USER_PREFIX}{user_id}", task_id)
+            
+            pipe.execute()
             return True
         except Exception as e:
             print(f"删除任务失败: {e}")
             return False
     
+    def get_finished_task_ids(self, before: float, offset: int = 0, limit: int = 100) -> List[str]:
+        """
+        获取结束时间早于指定时间戳的任务ID（按结束时间升序）
+        
+        Args:
+            before: 结束时间戳上限（不含）
+            offset: 起始偏移
+            limit: 最多返回数量
+            
+        Returns:
+            List[str]: 任务ID列表
+        """
+        try:
+            return self.redis_client.zrangebyscore(
+                self.INDEX_FINISHED_KEY, "-inf", f"({before!r}", start=offset, num=limit
+            )
+        except Exception as e:
+            print(f"获取已结束任务失败: {e}")
+            return []
+    
+    def backfill_finished_index(self, before: float, batch_size: int = 500) -> int:
+        """
+        为旧任务回填结束时间索引（结束时间索引上线前已结束的任务，只检查创建时间早于 before 的）
+        
+        Args:
+            before: 创建时间戳上限（不含）
+            batch_size: 每批检查的任务数
+            
+        Returns:
+            int: 回填的任务数量
+        """
+        count = 0
+        for task_status in self.TERMINAL_STATUSES:
+            index_key = f"{self.INDEX_STATUS_PREFIX}{task_status}"
+            offset = 0
+            while True:
+                entries = self.redis_client.zrangebyscore(
+                    index_key, "-inf", f"({before!r}", start=offset, num=batch_size, withscores=True
+                )
+                if not entries:
+                    break
+                offset += len(entries)
+                
+                pipe = self.redis_client.pipeline(transaction=False)
+                for task_id, _ in entries:
+                    pipe.zscore(self.INDEX_FINISHED_KEY, task_id)
+                    pipe.hget(f"{self.TASK_KEY_PREFIX}{task_id}", "updated_at")
+                replies = pipe.execute()
+                
+                missing = {}
+                for (task_id, created_score), finished_score, updated_at in zip(entries, replies[::2], replies[1::2]):
+                    if finished_score is None:
+                        missing[task_id] = (
+                            datetime.fromisoformat(updated_at).timestamp() if updated_at else created_score
+                        )
+                if missing:
+                    self.redis_client.zadd(self.INDEX_FINISHED_KEY, missing)
+                    count += len(missing)
+        return count
+    
     def get_all_task_ids(self, status_filter: Optional[str] = None) -> list[str]:
         """
-        获取所有任务ID（支持状态筛选）
+        获取所有任务ID（支持状态筛选，按创建时间倒序）
         
         Args:
             status_filter: 状态筛选（pending/processing/done/failed/cancelled）
@@ -241,25 +1180,420 @@ class TaskQueue:
             list[str]: 任务ID列表
         """
         try:
-            # 扫描所有任务键
-            pattern = f"{self.TASK_KEY_PREFIX}*"
-            task_ids = []
+            index_key = (
+                f"{self.INDEX_STATUS_PREFIX}{status_filter}" if status_filter
+                else self.INDEX_ALL_KEY
+            )
+            return self.redis_client.zrevrange(index_key, 0, -1)
+        except Exception as e:
+            print(f"获取任务列表失败: {e}")
+            return []
+    
+    def get_task_ids_page(
+        self,
+        status_filter: Optional[str] = None,
+        mode_filter: Optional[str] = None,
+        user_filter: Optional[str] = None,
+        offset: int = 0,
+        limit: int = 20
+    ) -> List[str]:
+        """
+        分页获取任务ID（基于索引，按创建时间倒序）
+        
+        单条件筛选直接读取对应索引，复杂度 O(log N + limit)；
+        多条件筛选先对索引求交集（结果短暂缓存）再分页。
+        
+        Args:
+            status_filter: 状态筛选
+            mode_filter: 模式筛选
+            user_filter: 用户筛选
+            offset: 起始偏移
+            limit: 数量
             
-            for key in self.redis_client.scan_iter(match=pattern):
-                task_id = key.replace(self.TASK_KEY_PREFIX, "")
-                
-                # 如果有状态筛选
-                if status_filter:
-                    task_status = self.redis_client.hget(key, "status")
-                    if task_status == status_filter:
-                        task_ids.append(task_id)
-                else:
-                    task_ids.append(task_id)
+        Returns:
+            List[str]: 任务ID列表
+        """
+        try:
+            index_key = self._resolve_index(status_filter, mode_filter, user_filter)
+            return self.redis_client.zrevrange(index_key, offset, offset + limit - 1)
+        except Exception as e:
+            print(f"分页获取任务列表失败: {e}")
+            return []
+    
+    def count_task_ids(
+        self,
+        status_filter: Optional[str] = None,
+        mode_filter: Optional[str] = None,
+        user_filter: Optional[str] = None
+    ) -> int:
+        """
+        统计满足筛选条件的任务数量
+        
+        Args:
+            status_filter: 状态筛选
+            mode_filter: 模式筛选
+            user_filter: 用户筛选
             
-            return task_ids
+        Returns:
+            int: 任务数量
+        """
+        try:
+            index_key = self._resolve_index(status_filter, mode_filter, user_filter)
+            return self.redis_client.zcard(index_key)
         except Exception as e:
-            print(f"获取任务列表失败: {e}")
+            print(f"统计任务数量失败: {e}")
+            return 0
+    
+    def get_user_task_page(
+        self,
+        user_id: str,
+        before: Optional[Tuple[float, str]] = None,
+        limit: int = 20
+    ) -> Tuple[List[Dict[str, Any]], Optional[Tuple[float, str]]]:
+        """
+        按创建时间游标分页获取用户任务（倒序）
+        
+        游标为上一页最后一条的 (创建时间戳, 任务ID)：同一时间戳的任务按任务ID倒序排列，
+        跨页的同分任务不会被跳过。
+        固定两次 Redis 往返：一次 Pipeline 索引范围读取，一次 Pipeline 批量 HGETALL。
+        
+        Args:
+            user_id: 用户ID
+            before: 游标（只返回排在该位置之后的任务），None 表示从最新开始
+            limit: 每页数量
+            
+        Returns:
+            Tuple[List[Dict], Optional[Tuple[float, str]]]: (任务数据列表, 下一页游标；无更多数据时为 None)
+        """
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            self._queue_user_page_range(pipe, user_id, before, limit)
+            entries, has_more = self._user_page_entries(pipe.execute(), before, limit)
+            
+            if not entries:
+                return [], None
+            
+            # 任务 Hash 可能已被清理，跳过
+            raw_tasks = self.get_task_data_many([task_id for task_id, _ in entries])
+            tasks = [data for data in raw_tasks if data]
+            
+            next_cursor = (entries[-1][1], entries[-1][0]) if has_more else None
+            return tasks, next_cursor
+        except Exception as e:
+            print(f"获取用户任务列表失败: {e}")
+            return [], None
+    
+    def _queue_user_page_range(
+        self,
+        pipe,
+        user_id: str,
+        before: Optional[Tuple[float, str]],
+        limit: int
+    ):
+        """向 Pipeline 写入用户任务分页的索引读取命令（同步/异步共用）"""
+        index_key = f"{self.INDEX_USER_PREFIX}{user_id}"
+        if before is None:
+            # 多取一条用于判断是否还有下一页
+            pipe.zrevrangebyscore(index_key, "+inf", "-inf", start=0, num=limit + 1, withscores=True)
+            return
+        
+        score, _ = before
+        # 与游标同分的任务单独读取，按任务ID过滤掉已返回的部分
+        pipe.zrangebyscore(index_key, score, score, withscores=True)
+        pipe.zrevrangebyscore(index_key, f"({score!r}", "-inf", start=0, num=limit + 1, withscores=True)
+    
+    @staticmethod
+    def _user_page_entries(
+        replies: List[Any],
+        before: Optional[Tuple[float, str]],
+        limit: int
+    ) -> Tuple[List[Tuple[str, float]], bool]:
+        """索引读取结果 -> (本页条目, 是否还有下一页)"""
+        if before is None:
+            entries = replies[0]
+        else:
+            _, last_task_id = before
+            ties = sorted((entry for entry in replies[0] if entry[0] < last_task_id), reverse=True)
+            entries = ties + replies[1]
+        return entries[:limit], len(entries) > limit
+    
+    def rebuild_indexes(self) -> int:
+        """
+        根据任务 Hash 重建全部二级索引（迁移/修复用，会扫描全部任务）
+        
+        新索引先写入临时键，扫描完成后在一个事务内 RENAME 替换旧索引，重建期间列表查询照常读取旧索引。
+        重建开始后创建/结束的任务已由正常写入路径写入旧索引，替换前合并进新索引；
+        扫描之后才发生状态变化的任务以扫描时的状态为准，可再次运行修正。
+        
+        Returns:
+            int: 已索引的任务数量
+        """
+        started = time.time()
+        tmp_prefix = f"{self.INDEX_REBUILD_PREFIX}{uuid.uuid4().hex}:"
+        built = set()
+        
+        count = 0
+        for key in self.redis_client.scan_iter(match=f"{self.TASK_KEY_PREFIX}*"):
+            task_id = key.replace(self.TASK_KEY_PREFIX, "")
+            task_status, mode, user_id, created_at, updated_at, data = self.redis_client.hmget(
+                key, "status", "mode", "user_id", "created_at", "updated_at", "data"
+            )
+            # 扫描到之后已被删除（或过期）的任务：跳过，回填字段会重新创建只有冗余字段的 Hash
+            if task_status is None and created_at is None:
+                continue
+            
+            input_data = json.loads(data) if data else {}
+            mode = mode or input_data.get("mode") or ""
+            user_id = user_id or input_data.get("user_id") or ""
+            score = datetime.fromisoformat(created_at).timestamp() if created_at else time.time()
+            
+            pipe = self.redis_client.pipeline(transaction=False)
+            # 回填冗余字段，后续索引维护无需再解析 data
+            pipe.hset(key, mapping={"mode": mode, "user_id": user_id})
+            for index_key in self._index_keys(mode=mode, user_id=user_id, status=task_status or "pending"):
+                pipe.zadd(f"{tmp_prefix}{index_key}", {task_id: score})
+                built.add(index_key)
+            if task_status in self.TERMINAL_STATUSES:
+                finished_score = datetime.fromisoformat(updated_at).timestamp() if updated_at else score
+                pipe.zadd(f"{tmp_prefix}{self.INDEX_FINISHED_KEY}", {task_id: finished_score})
+                built.add(self.INDEX_FINISHED_KEY)
+            pipe.execute()
+            count += 1
+        
+        # 旧索引中没有任何任务的键（如已无任务的用户）只清理重建开始前的条目
+        stale = {self.INDEX_ALL_KEY, self.INDEX_FINISHED_KEY}
+        for pattern in (f"{self.INDEX_STATUS_PREFIX}*", f"{self.INDEX_MODE_PREFIX}*", f"{self.INDEX_USER_PREFIX}*"):
+            stale.update(self.redis_client.scan_iter(match=pattern))
+        stale -= built
+        
+        recent_key = f"{tmp_prefix}recent"
+        pipe = self.redis_client.pipeline(transaction=True)
+        for index_key in built:
+            tmp_key = f"{tmp_prefix}{index_key}"
+            # 合并重建开始后写入旧索引的条目
+            pipe.zunionstore(recent_key, [index_key])
+            pipe.zremrangebyscore(recent_key, "-inf", f"({started!r}")
+            pipe.zunionstore(tmp_key, [tmp_key, recent_key], aggregate="MAX")
+            pipe.rename(tmp_key, index_key)
+        pipe.delete(recent_key)
+        for index_key in stale:
+            pipe.zremrangebyscore(index_key, "-inf", f"({started!r}")
+        pipe.execute()
+        
+        return count
+    
+    def _index_keys(self, mode: str, user_id: str, status: str) -> List[str]:
+        """获取任务应写入的索引键列表"""
+        keys = [self.INDEX_ALL_KEY, f"{self.INDEX_STATUS_PREFIX}{status}"]
+        if mode:
+            keys.append(f"{self.INDEX_MODE_PREFIX}{mode}")
+        if user_id:
+            keys.append(f"{self.INDEX_USER_PREFIX}{user_id}")
+        return keys
+    
+    def _resolve_index(
+        self,
+        status_filter: Optional[str],
+        mode_filter: Optional[str],
+        user_filter: Optional[str]
+    ) -> str:
+        """
+        根据筛选条件确定要读取的索引键
+        
+        多个条件时通过 ZINTERSTORE 生成临时索引，相同条件在 INDEX_TMP_TTL 内复用。
+        """
+        index_key, source_keys = self._filter_index(status_filter, mode_filter, user_filter)
+        if source_keys and not self.redis_client.exists(index_key):
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.zinterstore(index_key, source_keys, aggregate="MAX")
+            pipe.expire(index_key, self.INDEX_TMP_TTL)
+            pipe.execute()
+        return index_key
+    
+    def _filter_index(
+        self,
+        status_filter: Optional[str],
+        mode_filter: Optional[str],
+        user_filter: Optional[str]
+    ) -> Tuple[str, List[str]]:
+        """
+        筛选条件 -> (索引键, 需要求交集的源索引)；单条件或无条件时源索引为空
+        """
+        keys = []
+        if status_filter:
+            keys.append(f"{self.INDEX_STATUS_PREFIX}{status_filter}")
+        if mode_filter:
+            keys.append(f"{self.INDEX_MODE_PREFIX}{mode_filter}")
+        if user_filter:
+            keys.append(f"{self.INDEX_USER_PREFIX}{user_filter}")
+        
+        if not keys:
+            return self.INDEX_ALL_KEY, []
+        if len(keys) == 1:
+            return keys[0], []
+        
+        tmp_key = f"{self.INDEX_TMP_PREFIX}{status_filter or ''}:{mode_filter or ''}:{user_filter or ''}"
+        return tmp_key, keys
+    
+    # ==================== 异步接口（API 请求处理使用，Worker 使用同步接口） ====================
+    
+    async def push_task_async(self, task_id: str, task_data: Dict[str, Any], lane: Optional[str] = None) -> bool:
+        """推送任务到队列（异步版本，参数同 push_task）"""
+        try:
+            pipe = self.async_redis.pipeline(transaction=True)
+            self._queue_push(pipe, task_id, task_data, lane)
+            await pipe.execute()
+            return True
+        except Exception as e:
+            print(f"推送任务失败: {e}")
+            return False
+    
+    async def get_task_data_async(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务数据（异步版本）"""
+        try:
+            return self._parse_task_data(await self.async_redis.hgetall(f"{self.TASK_KEY_PREFIX}{task_id}"))
+        except Exception as e:
+            print(f"获取任务数据失败: {e}")
+            return None
+    
+    async def get_task_data_many_async(self, task_ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """批量获取任务数据（异步版本，单次 Pipeline 往返）"""
+        if not task_ids:
             return []
+        
+        try:
+            pipe = self.async_redis.pipeline(transaction=False)
+            for task_id in task_ids:
+                pipe.hgetall(f"{self.TASK_KEY_PREFIX}{task_id}")
+            return [self._parse_task_data(data) for data in await pipe.execute()]
+        except Exception as e:
+            print(f"批量获取任务数据失败: {e}")
+            return [None] * len(task_ids)
+    
+    async def is_task_exists_async(self, task_id: str) -> bool:
+        """检查任务是否存在（异步版本）"""
+        try:
+            return await self.async_redis.exists(f"{self.TASK_KEY_PREFIX}{task_id}") > 0
+        except Exception as e:
+            print(f"检查任务存在失败: {e}")
+            return False
+    
+    async def update_task_status_async(
+        self,
+        task_id: str,
+        status: str,
+        progress: int = 0,
+        current_step: Optional[str] = None,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        """更新任务状态（异步版本，参数同 update_task_status）"""
+        try:
+            task_key = f"{self.TASK_KEY_PREFIX}{task_id}"
+            update_data = self._status_fields(status, progress, current_step, result, error)
+            if self._async_status_script is None:
+                self._async_status_script = self.async_redis.register_script(self._STATUS_SCRIPT)
+            
+            for _ in range(self.STATUS_UPDATE_ATTEMPTS):
+                worker_id, user_id = await self.async_redis.hmget(task_key, "worker_id", "user_id")
+                keys, args = self._status_script_params(task_id, status, worker_id, user_id, update_data)
+                updated = await self._async_status_script(keys=keys, args=args)
+                if updated != -1:
+                    break
+            else:
+                print(f"更新任务状态失败: 任务 {task_id} 持有者频繁变化")
+                return False
+            if updated == 0:
+                print(f"更新任务状态失败: 任务不存在 {task_id}")
+                return False
+            return True
+        except Exception as e:
+            print(f"更新任务状态失败: {e}")
+            return False
+    
+    async def cancel_task_async(self, task_id: str) -> bool:
+        """取消任务（异步版本）"""
+        try:
+            lane, user_id = await self.async_redis.hmget(f"{self.TASK_KEY_PREFIX}{task_id}", "lane", "user_id")
+            pipe = self.async_redis.pipeline(transaction=False)
+            pipe.lrem(self._lane_key(lane or self.default_lane), 0, task_id)
+            if user_id:
+                pipe.lrem(f"{self.OVERFLOW_PREFIX}{user_id}", 0, task_id)
+            await pipe.execute()
+            
+            return await self.update_task_status_async(task_id, "cancelled")
+        except Exception as e:
+            print(f"取消任务失败: {e}")
+            return False
+    
+    async def get_task_ids_page_async(
+        self,
+        status_filter: Optional[str] = None,
+        mode_filter: Optional[str] = None,
+        user_filter: Optional[str] = None,
+        offset: int = 0,
+        limit: int = 20
+    ) -> List[str]:
+        """分页获取任务ID（异步版本，参数同 get_task_ids_page）"""
+        try:
+            index_key = await self._resolve_index_async(status_filter, mode_filter, user_filter)
+            return await self.async_redis.zrevrange(index_key, offset, offset + limit - 1)
+        except Exception as e:
+            print(f"分页获取任务列表失败: {e}")
+            return []
+    
+    async def count_task_ids_async(
+        self,
+        status_filter: Optional[str] = None,
+        mode_filter: Optional[str] = None,
+        user_filter: Optional[str] = None
+    ) -> int:
+        """统计满足筛选条件的任务数量（异步版本）"""
+        try:
+            index_key = await self._resolve_index_async(status_filter, mode_filter, user_filter)
+            return await self.async_redis.zcard(index_key)
+        except Exception as e:
+            print(f"统计任务数量失败: {e}")
+            return 0
+    
+    async def get_user_task_page_async(
+        self,
+        user_id: str,
+        before: Optional[Tuple[float, str]] = None,
+        limit: int = 20
+    ) -> Tuple[List[Dict[str, Any]], Optional[Tuple[float, str]]]:
+        """按创建时间游标分页获取用户任务（异步版本，参数同 get_user_task_page）"""
+        try:
+            pipe = self.async_redis.pipeline(transaction=False)
+            self._queue_user_page_range(pipe, user_id, before, limit)
+            entries, has_more = self._user_page_entries(await pipe.execute(), before, limit)
+            
+            if not entries:
+                return [], None
+            
+            raw_tasks = await self.get_task_data_many_async([task_id for task_id, _ in entries])
+            tasks = [data for data in raw_tasks if data]
+            
+            next_cursor = (entries[-1][1], entries[-1][0]) if has_more else None
+            return tasks, next_cursor
+        except Exception as e:
+            print(f"获取用户任务列表失败: {e}")
+            return [], None
+    
+    async def _resolve_index_async(
+        self,
+        status_filter: Optional[str],
+        mode_filter: Optional[str],
+        user_filter: Optional[str]
+    ) -> str:
+        """根据筛选条件确定要读取的索引键（异步版本）"""
+        index_key, source_keys = self._filter_index(status_filter, mode_filter, user_filter)
+        if source_keys and not await self.async_redis.exists(index_key):
+            pipe = self.async_redis.pipeline(transaction=True)
+            pipe.zinterstore(index_key, source_keys, aggregate="MAX")
+            pipe.expire(index_key, self.INDEX_TMP_TTL)
+            await pipe.execute()
+        return index_key
     
     def health_check(self) -> bool:
         """健康检查"""
@@ -0,0 +1,340 @@
+"""
+任务保留期清理
+结束超过 TASK_RETENTION_DAYS 的任务：记录追加写入 gzip 压缩的 JSONL 归档，
+删除 Redis 中的任务数据与索引，并分批（限速）删除 RESULT_DIR / UPLOAD_DIR 中的对应文件
+
+Worker 按 TASK_CLEANUP_INTERVAL 周期运行（Redis 锁保证同一时间只有一个进程在清理），
+也可由定时任务手动执行:
+    python -m app.services.tasks.retention [--dry-run] [--batch-size 100]
+
+归档文件按日期切分（tasks-YYYYMMDD.jsonl.gz），每批追加一个 gzip 成员，
+读取时 gzip.open(path, "rt") 即可逐行读出全部记录
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.tasks.manager import referenced_file_ids
+from app.services.tasks.queue import TaskQueue, get_task_queue
+from app.services.storage import get_file_index, get_local_storage, get_storage, is_remote_storage
+from app.services.image.image_assets import UPLOAD_SUBDIRS
+
+
+class TaskRetentionJob:
+    """任务保留期清理类"""
+    
+    LOCK_KEY = "formy:task:retention:lock"
+    LOCK_TTL = 600  # 锁的过期时间（秒），每批处理前续期；进程崩溃后最多等待这么久
+    
+    # 持有者令牌一致时续期 / 释放（锁已过期并被其他进程获取时不影响对方）
+    # KEYS[1]: 锁; ARGV[1]: 令牌, ARGV[2]: 过期时间（秒）
+    _RENEW_LOCK_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('EXPIRE', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+    _RELEASE_LOCK_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+    
+    def __init__(
+        self,
+        queue: Optional[TaskQueue] = None,
+        retention_days: Optional[int] = None,
+        archive_dir: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        batch_pause: Optional[float] = None
+    ):
+        """
+        初始化清理任务（参数缺省时读取配置）
+        
+        Args:
+            queue: 任务队列（默认使用全局实例）
+            retention_days: 结束任务保留天数（0 表示永久保留）
+            archive_dir: 归档目录
+            batch_size: 每批处理的任务数
+            batch_pause: 批次之间的暂停时间（秒，限制磁盘与 Redis 压力）
+        """
+        self.queue = queue or get_task_queue()
+        self.retention_days = settings.TASK_RETENTION_DAYS if retention_days is None else retention_days
+        self.archive_dir = Path(archive_dir or settings.TASK_ARCHIVE_DIR)
+        self.batch_size = batch_size or settings.TASK_CLEANUP_BATCH_SIZE
+        self.batch_pause = settings.TASK_CLEANUP_BATCH_PAUSE if batch_pause is None else batch_pause
+        self.interval = settings.TASK_CLEANUP_INTERVAL
+        
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock_token: Optional[str] = None
+    
+    # ==================== 周期运行 ====================
+    
+    def start(self):
+        """启动后台清理线程（TASK_CLEANUP_INTERVAL 为 0 或保留期为 0 时不启动）"""
+        if self.interval <= 0 or self.retention_days <= 0:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="task-retention", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """停止后台清理线程（当前批次处理完后退出）"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.batch_pause + 5)
+    
+    def _run(self):
+        """后台循环：每个周期尝试获取锁并清理一次"""
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[Retention] 清理失败: {e}")
+    
+    # ==================== 清理 ====================
+    
+    def run_once(self, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        清理一次全部过期任务
+        
+        先写归档再删除 Redis 数据：进程中途退出时最多重复归档，不会丢失记录。
+        
+        Args:
+            dry_run: 只统计不归档、不删除
+        
+        Returns:
+            Dict: 清理统计（tasks / files / bytes_reclaimed / seconds 等）
+        """
+        stats = {"tasks": 0, "expired": 0, "backfilled": 0, "files": 0, "bytes_reclaimed": 0}
+        if self.retention_days <= 0:
+            print("[Retention] TASK_RETENTION_DAYS=0，任务永久保留")
+            return {**stats, "seconds": 0.0}
+        
+        # 多个 Worker 同时运行时只有一个进程清理（锁每批续期，清理结束或进程崩溃超时后释放）
+        if not dry_run and not self._acquire_lock():
+            return {**stats, "seconds": 0.0, "skipped": True}
+        
+        start = time.time()
+        cutoff = start - self.retention_days * 86400
+        try:
+            if not dry_run:
+                stats["backfilled"] = self.queue.backfill_finished_index(cutoff)
+            
+            offset = 0
+            while not self._stop_event.is_set():
+                if not dry_run and not self._renew_lock():
+                    print("[Retention] 清理锁已失效（可能被其他进程获取），停止本次清理")
+                    break
+                
+                task_ids = self.queue.get_finished_task_ids(cutoff, offset=offset, limit=self.batch_size)
+                if not task_ids:
+                    break
+                
+                batch = self._process_batch(task_ids, cutoff, dry_run)
+                for key, value in batch.items():
+                    stats[key] += value
+                
+                # 演练模式不删除，需要向后翻页
+                if dry_run:
+                    offset += len(task_ids)
+                if self.batch_pause:
+                    time.sleep(self.batch_pause)
+        finally:
+            if not dry_run:
+                self._release_lock()
+        
+        stats["seconds"] = round(time.time() - start, 1)
+        if stats["tasks"] or stats["expired"] or dry_run:
+            print(
+                f"[Retention] 完成{'（dry run）' if dry_run else ''}: "
+                f"归档 {stats['tasks']} 个任务，删除 {stats['files']} 个文件，"
+                f"回收 {stats['bytes_reclaimed'] / (1024 * 1024):.1f}MB（{stats}）"
+            )
+        return stats
+    
+    def _acquire_lock(self) -> bool:
+        """获取清理锁（值为本次运行的随机令牌）"""
+        token = f"{os.getpid()}:{uuid.uuid4().hex}"
+        if not self.queue.redis_client.set(self.LOCK_KEY, token, nx=True, ex=self.LOCK_TTL):
+            return False
+        self._lock_token = token
+        return True
+    
+    def _renew_lock(self) -> bool:
+        """续期清理锁（令牌不一致说明锁已过期并被其他进程获取）"""
+        script = self.queue.redis_client.register_script(self._RENEW_LOCK_SCRIPT)
+        return bool(script(keys=[self.LOCK_KEY], args=[self._lock_token, self.LOCK_TTL]))
+    
+    def _release_lock(self):
+        """释放清理锁（只删除自己持有的锁）"""
+        try:
+            script = self.queue.redis_client.register_script(self._RELEASE_LOCK_SCRIPT)
+            script(keys=[self.LOCK_KEY], args=[self._lock_token])
+        except Exception as e:
+            print(f"[Retention] 释放清理锁失败: {e}")
+        finally:
+            self._lock_token = None
+    
+    def _process_batch(self, task_ids: List[str], cutoff: float, dry_run: bool) -> Dict[str, int]:
+        """
+        处理一批过期任务：归档记录 -> 删除文件 -> 删除 Redis 数据
+        
+        Args:
+            task_ids: 任务ID列表
+            cutoff: 保留期截止时间戳
+            dry_run: 只统计
+        
+        Returns:
+            Dict[str, int]: 本批统计
+        """
+        tasks = self.queue.get_task_data_many(task_ids)
+        records = [task for task in tasks if task]
+        # Hash 已被 Redis 过期回收（清理任务长时间未运行）：记录无法归档，
+        # 但结果文件仍按任务ID删除（上传文件无从得知，留给其他引用它的任务或保持原样）
+        expired_ids = [task_id for task_id, task in zip(task_ids, tasks) if not task]
+        stats = {
+            "tasks": len(records),
+            "expired": len(expired_ids),
+            "files": 0,
+            "bytes_reclaimed": 0,
+        }
+        
+        if records and not dry_run:
+            self._archive(records)
+        if expired_ids:
+            print(f"[Retention] {len(expired_ids)} 个任务的数据已过期，无法归档，只删除结果文件: {expired_ids}")
+        
+        for task in records + [{"task_id": task_id} for task_id in expired_ids]:
+            for path, size, remote_path in self._iter_task_files(task, cutoff):
+                if dry_run or self._delete_file(path, remote_path):
+                    stats["files"] += 1
+                    stats["bytes_reclaimed"] += size
+        
+        if not dry_run:
+            for task_id in task_ids:
+                self.queue.delete_task(task_id)
+        return stats
+    
+    def _archive(self, records: List[Dict[str, Any]]):
+        """
+        追加写入归档（每批一个 gzip 成员，写完 fsync 后才删除 Redis 数据）
+        
+        Args:
+            records: 任务记录列表
+        """
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        archive_path = self.archive_dir / f"tasks-{datetime.now():%Y%m%d}.jsonl.gz"
+        archived_at = datetime.now().isoformat()
+        
+        lines = []
+        for record in records:
+            record = dict(record)
+            for field in ("result", "error"):
+                if isinstance(record.get(field), str):
+                    try:
+                        record[field] = json.loads(record[field])
+                    except ValueError:
+                        pass
+            record["archived_at"] = archived_at
+            lines.append(json.dumps(record, ensure_ascii=False))
+        
+        with open(archive_path, "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="ab") as archive:
+                archive.write(("\n".join(lines) + "\n").encode("utf-8"))
+            raw.flush()
+            os.fsync(raw.fileno())
+    
+    def _iter_task_files(self, task: Dict[str, Any], cutoff: float) -> Iterator[Tuple[Path, int, Optional[str]]]:
+        """
+        列出任务关联的文件
+        
+        结果文件按 {task_id}_* 匹配；上传文件可能被多个任务复用，只删除上传时间与最近一次
+        被任务引用的时间（创建任务时记录的 last_used_at）都早于截止时间的，仍被未过期任务使用的文件保留。
+        
+        Args:
+            task: 任务记录
+            cutoff: 保留期截止时间戳
+        
+        Yields:
+            Tuple[Path, int, Optional[str]]: (本地路径, 字节数, 对象存储相对路径；本地文件为 None)
+        """
+        task_id = task.get("task_id")
+        if task_id:
+            for path in Path(settings.RESULT_DIR).glob(f"{task_id}_*"):
+                if path.is_file():
+                    yield path, path.stat().st_size, None
+        
+        input_data = task.get("data") or {}
+        file_index = get_file_index()
+        upload_dir = Path(settings.UPLOAD_DIR)
+        for file_id in referenced_file_ids(input_data.get("source_image"), input_data.get("config")):
+            info = file_index.get_info(file_id) or {}
+            if self._used_since(info, cutoff):
+                continue
+            
+            if is_remote_storage():
+                if info.get("path"):
+                    yield upload_dir / info["path"], int(info.get("size") or 0), info["path"]
+                continue
+            
+            relative_path = info.get("path") or get_local_storage().find_file(file_id, UPLOAD_SUBDIRS)
+            if not relative_path:
+                continue
+            path = upload_dir / relative_path
+            if path.is_file() and (info or path.stat().st_mtime < cutoff):
+                yield path, path.stat().st_size, None
+    
+    @staticmethod
+    def _used_since(info: Dict[str, str], cutoff: float) -> bool:
+        """上传文件在截止时间之后是否上传过或被任务引用过"""
+        for field in ("uploaded_at", "last_used_at"):
+            if info.get(field) and datetime.fromisoformat(info[field]).timestamp() >= cutoff:
+                return True
+        return False
+    
+    def _delete_file(self, path: Path, remote_path: Optional[str]) -> bool:
+        """
+        删除文件（对象存储同时删除远端对象与本地缓存），并清理上传文件索引
+        
+        Args:
+            path: 本地路径
+            remote_path: 对象存储相对路径
+        
+        Returns:
+            bool: 是否删除成功
+        """
+        try:
+            if remote_path and not asyncio.run(get_storage().delete_file(remote_path)):
+                return False
+            path.unlink(missing_ok=True)
+        except Exception as e:
+            print(f"[Retention] 删除文件失败: {path}: {e}")
+            return False
+        
+        if remote_path or Path(settings.UPLOAD_DIR) in path.parents:
+            get_file_index().forget(path.stem)
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="归档并清理超过保留期的任务")
+    parser.add_argument("--dry-run", action="store_true", help="只统计不归档、不删除")
+    parser.add_argument("--batch-size", type=int, default=None, help="每批处理的任务数")
+    args = parser.parse_args()
+    TaskRetentionJob(batch_size=args.batch_size).run_once(dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Worker 并发槽位
+单个 Worker 进程内用线程池同时处理多个任务，共享同一个 Redis 连接池与 Engine 注册表
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from app.services.tasks.queue import TaskQueue, get_task_queue
+from app.services.tasks.lease import TaskLeaseKeeper
+
+
+class TaskSlotPool:
+    """任务槽位池"""
+
+    def __init__(
+        self,
+        worker_id: str,
+        handler: Callable[[str], None],
+        slots: int = 1,
+        queue: Optional[TaskQueue] = None,
+        lease_keeper: Optional[TaskLeaseKeeper] = None,
+        log_prefix: str = "[Worker]"
+    ):
+        """
+        初始化槽位池
+
+        Args:
+            worker_id: Worker ID
+            handler: 任务处理函数（在槽位线程中执行，需自行标记任务完成/失败）
+            slots: 并发槽位数
+            queue: 任务队列（默认使用全局实例）
+            lease_keeper: 租约维护（处理期间为任务续租）
+            log_prefix: 日志前缀
+        """
+        self.worker_id = worker_id
+        self.handler = handler
+        self.slots = max(1, slots)
+        self.queue = queue or get_task_queue()
+        self.lease_keeper = lease_keeper
+        self.log_prefix = log_prefix
+
+        self._free_slots = threading.Semaphore(self.slots)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self) -> int:
+        """当前处理中的任务数"""
+        with self._lock:
+            return self._in_flight
+
+    def run(self, should_run: Callable[[], bool], pop_timeout: int = 5):
+        """
+        运行取任务循环，直到 should_run() 返回 False
+
+        只有存在空闲槽位时才从队列取任务；停止后不再取新任务，
+        等待所有处理中的任务完成（优雅排空）后返回。
+
+        Args:
+            should_run: 是否继续取任务
+            pop_timeout: 单次阻塞取任务超时（秒）
+        """
+        executor = ThreadPoolExecutor(
+            max_workers=self.slots,
+            thread_name_prefix=f"slot-{self.worker_id}"
+        )
+
+        try:
+            while should_run():
+                # 等待空闲槽位（短超时，便于及时响应停止信号）
+                if not self._free_slots.acquire(timeout=1):
+                    continue
+
+                try:
+                    task_id = self.queue.pop_task(timeout=pop_timeout, worker_id=self.worker_id)
+                except Exception as e:
+                    self._free_slots.release()
+                    print(f"{self.log_prefix} 获取任务失败: {e}")
+                    time.sleep(1)
+                    continue
+
+                if not task_id:
+                    self._free_slots.release()
+                    continue
+
+                if self.lease_keeper:
+                    self.lease_keeper.track(task_id)
+                with self._lock:
+                    self._in_flight += 1
+                executor.submit(self._run_task, task_id)
+        finally:
+            pending = self.in_flight
+            if pending:
+                print(f"{self.log_prefix} 停止取新任务，等待 {pending} 个处理中的任务完成...")
+            executor.shutdown(wait=True)
+
+    def _run_task(self, task_id: str):
+        """在槽位线程中处理任务，结束后释放槽位"""
+        try:
+            self.handler(task_id)
+        except Exception as e:
+            print(f"{self.log_prefix} 槽位处理任务异常: {task_id}, 错误: {e}")
+        finally:
+            if self.lease_keeper:
+                self.lease_keeper.untrack(task_id)
+            with self._lock:
+                self._in_flight -= 1
+            self._free_slots.release()
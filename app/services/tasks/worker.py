@@ -2,6 +2,7 @@
 任务 Worker 工作进程
 负责从队列中获取任务并分发到对应的 Pipeline 处理
 """
+import os
 import time
 import signal
 import sys
@@ -10,21 +11,38 @@ from pathlib import Path
 
 from app.services.tasks.queue import get_task_queue
 from app.services.tasks.manager import get_task_service
+from app.services.tasks.lease import TaskLeaseKeeper
+from app.services.tasks.slots import TaskSlotPool
+from app.services.tasks.retention import TaskRetentionJob
+from app.core.config import settings
 from app.schemas.task import EditMode
-from app.services.image.image_assets import (
-    resolve_uploaded_file,
-    copy_image_to_results,
-    create_comparison_image,
-)
+from app.utils.id_generator import generate_worker_id
+from app.services.image.image_assets import resolve_uploaded_file
+from app.services.image.renditions import render_renditions
 
 
 class TaskWorker:
     """任务 Worker 类"""
     
-    def __init__(self):
-        """初始化 Worker"""
+    def __init__(self, concurrency: Optional[int] = None):
+        """
+        初始化 Worker
+        
+        Args:
+            concurrency: 并发槽位数（默认 WORKER_CONCURRENCY）
+        """
         self.queue = get_task_queue()
         self.task_service = get_task_service()
+        self.worker_id = generate_worker_id()
+        self.lease_keeper = TaskLeaseKeeper(self.worker_id, self.queue, self.task_service)
+        self.slot_pool = TaskSlotPool(
+            self.worker_id,
+            handler=self._handle_task,
+            slots=concurrency or settings.WORKER_CONCURRENCY,
+            queue=self.queue,
+            lease_keeper=self.lease_keeper
+        )
+        self.retention_job = TaskRetentionJob(queue=self.queue)
         self.is_running = False
         self._setup_signal_handlers()
     
@@ -34,33 +52,39 @@ class TaskWorker:
         signal.signal(signal.SIGTERM, self._handle_shutdown)
     
     def _handle_shutdown(self, signum, frame):
-        """处理关闭信号"""
-        print("\n[Worker] 接收到关闭信号，正在停止...")
+        """处理关闭信号（第一次停止取任务并排空，第二次强制退出）"""
+        if not self.is_running:
+            print("\n[Worker] 强制退出，未完成的任务将在租约过期后重新排队")
+            os._exit(1)
+        print("\n[Worker] 接收到关闭信号，正在停止（再次发送信号强制退出）...")
         self.is_running = False
     
     def start(self):
         """启动 Worker 循环"""
-        print("[Worker] 任务 Worker 已启动，等待任务...")
+        print(f"[Worker] 任务 Worker 已启动（{self.worker_id}，{self.slot_pool.slots} 个槽位），等待任务...")
         self.is_running = True
+        self.lease_keeper.start()
+        self.retention_job.start()
         
-        while self.is_running:
-            try:
-                # 从队列中获取任务（阻塞式，超时 5 秒）
-                task_id = self.queue.pop_task(timeout=5)
-                
-                if task_id:
-                    print(f"[Worker] 获取到任务: {task_id}")
-                    self._process_task(task_id)
-                else:
-                    # 超时未获取到任务，继续循环
-                    continue
-                    
-            except Exception as e:
-                print(f"[Worker] Worker 循环出错: {e}")
-                time.sleep(1)  # 出错后等待 1 秒再继续
-        
+        try:
+            # 有空闲槽位时从队列获取任务（阻塞式，超时 5 秒），停止后等待处理中的任务完成
+            self.slot_pool.run(lambda: self.is_running, pop_timeout=5)
+        finally:
+            self.task_service.progress_writer.stop()
+            self.retention_job.stop()
+            self.lease_keeper.stop()
         print("[Worker] 任务 Worker 已停止")
     
+    def _handle_task(self, task_id: str):
+        """
+        槽位线程中处理单个任务
+        
+        Args:
+            task_id: 任务ID
+        """
+        print(f"[Worker] 获取到任务: {task_id}")
+        self._process_task(task_id)
+    
     def _process_task(self, task_id: str):
         """
         处理单个任务
@@ -88,7 +112,8 @@ class TaskWorker:
             self.task_service.update_task_progress(
                 task_id=task_id,
                 progress=0,
-                current_step="任务已开始处理"
+                current_step="任务已开始处理",
+                immediate=True
             )
             
             # 4. 根据模式分发到对应的 Pipeline
@@ -271,36 +296,22 @@ class TaskWorker:
         self.task_service.update_task_progress(task_id, 20, "正在整理输入图片...")
 
         target_path = reference_path or source_path
-        output_file = copy_image_to_results(
-            target_path, f"{task_id}_output{target_path.suffix.lower() or '.jpg'}"
-        )
 
         self.task_service.update_task_progress(task_id, 55, "正在生成合成图像...")
 
-        comparison_file: Optional[Path] = None
-        try:
-            comparison_file = create_comparison_image(
-                before_path=source_path,
-                after_path=target_path,
-                filename=f"{task_id}_comparison.jpg",
-            )
-        except Exception as cmp_err:
-            print(f"[Worker] 生成对比图失败: {cmp_err}")
+        # 原图、缩略图、对比图、预览图一次生成（每张输入只解码一次）
+        renditions = render_renditions(task_id, target_path, before_path=source_path)
 
         self.task_service.update_task_progress(task_id, 90, "正在保存结果...")
 
         result_payload = {
-            "output_image": f"/results/{output_file.name}",
-            "thumbnail": f"/results/{output_file.name}",
-            "metadata": {
-                "width": 0,
-                "height": 0,
-                "format": target_path.suffix.replace(".", "") or "jpeg",
-            }
+            "output_image": renditions.url("full"),
+            "thumbnail": renditions.url("thumbnail") or renditions.url("full"),
+            "metadata": renditions.to_metadata()
         }
 
-        if comparison_file:
-            result_payload["comparison_image"] = f"/results/{comparison_file.name}"
+        if renditions.url("comparison"):
+            result_payload["comparison_image"] = renditions.url("comparison")
             result_payload["metadata"]["comparison_image"] = result_payload["comparison_image"]
 
         return result_payload
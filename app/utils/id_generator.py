@@ -1,8 +1,10 @@
 """
 ID 生成器工具
 """
+import os
 import time
 import random
+import socket
 import string
 
 
@@ -43,3 +45,15 @@ def generate_file_id() -> str:
     timestamp = int(time.time())
     random_str = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
     return f"file_{timestamp}_{random_str}"
+
+
+def generate_worker_id() -> str:
+    """
+    生成 Worker ID
+    格式: worker_<hostname>_<pid>_<random>
+    
+    Returns:
+        str: Worker ID，例如: worker_srv-abc_12345_x1y2z3
+    """
+    random_str = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
+    return f"worker_{socket.gethostname()}_{os.getpid()}_{random_str}"
@@ -4,11 +4,21 @@
 """
 import base64
 import io
+import math
+import os
+import tempfile
 from pathlib import Path
-from typing import Optional, Tuple, Union
+from typing import Iterable, Optional, Tuple, Union
 from PIL import Image
 
 
+# 流式写入的分块大小（字节）
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# 可直接对外提供的图片格式 -> 扩展名（其他格式需要转码）
+WEB_IMAGE_FORMATS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
+
 def load_image(image_path: str) -> Image.Image:
     """
     加载图片
@@ -57,6 +67,94 @@ def save_image(image: Image.Image, output_path: str, format: str = "JPEG", quali
         raise ValueError(f"保存图片失败: {output_path}, 错误: {e}")
 
 
+def stream_to_file(chunks: Iterable[bytes], output_path: str) -> int:
+    """
+    流式写入文件：分块写入同目录下的临时文件，完成后原子重命名
+    
+    写入过程中失败不会留下不完整的目标文件，读取方也不会看到写了一半的文件。
+    
+    Args:
+        chunks: 数据块迭代器（如 response.iter_content()）
+        output_path: 输出路径
+        
+    Returns:
+        int: 写入的字节数
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    
+    fd, temp_path = tempfile.mkstemp(dir=str(output_path.parent), prefix=f".{output_path.name}.", suffix=".part")
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                if chunk:
+                    f.write(chunk)
+                    written += len(chunk)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    
+    return written
+
+
+def sniff_image_format(header: bytes) -> Optional[str]:
+    """
+    按文件头魔数识别图片格式（不依赖客户端声明的 Content-Type）
+    
+    Args:
+        header: 文件开头的字节（至少 12 字节）
+        
+    Returns:
+        Optional[str]: JPEG / PNG / WEBP，无法识别返回 None
+    """
+    if header.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def probe_image_header(data: bytes) -> Optional[Tuple[str, int, int]]:
+    """
+    从文件开头的字节中解析格式与尺寸（只解析文件头，不解码像素）
+    
+    Args:
+        data: 文件开头的字节（可能不完整）
+        
+    Returns:
+        Optional[Tuple[str, int, int]]: (格式, 宽度, 高度)，数据不足以解析文件头时返回 None
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.format or "Unknown", image.width, image.height
+    except Exception:
+        return None
+
+
+def read_image_header(image_path: str) -> Tuple[str, int, int]:
+    """
+    只读取文件头获取格式与尺寸（不解码像素数据）
+    
+    Args:
+        image_path: 图片路径
+        
+    Returns:
+        Tuple[str, int, int]: (格式, 宽度, 高度)
+    """
+    try:
+        with Image.open(image_path) as image:
+            return image.format or "Unknown", image.width, image.height
+    except Exception as e:
+        raise ValueError(f"读取图片头失败: {image_path}, 错误: {e}")
+
+
 def image_to_base64(image: Union[Image.Image, str], format: str = "JPEG", quality: int = 95) -> str:
     """
     将图片转换为 base64 编码字符串
@@ -168,26 +266,70 @@ def resize_image(
     return resized
 
 
+def decode_image(image_path: str, scale: float = 1.0) -> Image.Image:
+    """
+    解码图片（JPEG 在 scale < 1 时使用 draft 模式，直接以 1/2、1/4、1/8 分辨率解码）
+    
+    Args:
+        image_path: 图片路径
+        scale: 所需的最大缩放比例（解码结果不小于原图 * scale）
+        
+    Returns:
+        Image.Image: 已加载的图片（RGB 或 RGBA）
+    """
+    image = load_image(image_path)
+    if scale < 1 and image.format == "JPEG":
+        image.draft("RGB", (max(1, math.ceil(image.width * scale)), max(1, math.ceil(image.height * scale))))
+    if image.mode in ("RGBA", "LA", "P"):
+        return image.convert("RGBA")
+    return image.convert("RGB")
+
+
+def fit_image(image: Image.Image, max_side: int) -> Image.Image:
+    """
+    等比缩小到最长边不超过 max_side（不复制原图，已足够小时直接返回原图）
+    
+    Args:
+        image: PIL Image 对象
+        max_side: 最长边（像素）
+        
+    Returns:
+        Image.Image: 缩小后的图片
+    """
+    width, height = image.size
+    if max(width, height) <= max_side:
+        return image
+    
+    ratio = max_side / max(width, height)
+    size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+    # reducing_gap：先按整数倍快速缩小，再做 LANCZOS 重采样
+    return image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+
 def create_thumbnail(image: Union[Image.Image, str], size: Tuple[int, int] = (256, 256)) -> Image.Image:
     """
     创建缩略图
     
     Args:
-        image: PIL Image 对象或图片路径
+        image: PIL Image 对象或图片路径（路径为 JPEG 时按缩略图尺寸降采样解码）
         size: 缩略图尺寸
         
     Returns:
         Image.Image: 缩略图
     """
-    # 如果是路径，先加载
+    # 如果是路径，按所需尺寸加载（缩略图直接在加载的图片上生成，无需复制）
     if isinstance(image, str):
         image = load_image(image)
+        image.draft("RGB", size)
+        image.thumbnail(size, Image.Resampling.LANCZOS)
+        return image
     
-    # 创建缩略图（保持宽高比）
-    image_copy = image.copy()
-    image_copy.thumbnail(size, Image.Resampling.LANCZOS)
-    
-    return image_copy
+    # 保持宽高比，直接缩放生成新图（不复制原图）
+    ratio = min(size[0] / image.width, size[1] / image.height)
+    if ratio >= 1:
+        return image.copy()
+    target = (max(1, round(image.width * ratio)), max(1, round(image.height * ratio)))
+    return image.resize(target, Image.Resampling.LANCZOS, reducing_gap=3.0)
 
 
 def get_image_info(image: Union[Image.Image, str]) -> dict:
@@ -1,20 +1,106 @@
 """
 Redis 客户端工具
 统一管理 Redis 连接，使用 REDIS_URL 配置
+
+每个进程共享一个同步连接池与一个异步连接池（按需创建、连接懒建立，不在获取客户端时 ping）：
+同步客户端供 Worker 与后台线程使用；API 请求处理使用异步客户端（应用启动时创建），
+Redis 响应慢时不会阻塞事件循环上的其他请求。
+连接池统计（使用中 / 空闲 / 等待次数）通过 get_redis_pool_metrics() 获取，用于评估 Redis 的连接数上限。
 """
+import threading
+import time
+from typing import Any, Dict
+
 import redis
+import redis.asyncio as aioredis
 from app.core.config import settings
 
 
-def get_redis_client() -> redis.Redis:
-    """
-    获取 Redis 客户端实例
+class MeteredConnectionPool(redis.BlockingConnectionPool):
+    """带统计的阻塞连接池：连接数达到上限时等待空闲连接（最多 REDIS_POOL_TIMEOUT 秒）"""
     
-    优先使用 REDIS_URL，如果未配置则从分散的配置项构建连接
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = 0  # 取连接时需要等待的次数
+        self.wait_seconds = 0.0  # 累计等待时间
+        self.timeouts = 0  # 等待超时次数
     
-    Returns:
-        redis.Redis: Redis 客户端实例
+    def get_connection(self, command_name, *keys, **options):
+        # 队列中没有连接也没有可新建的名额时需要等待
+        if self.pool.empty():
+            start = time.monotonic()
+            try:
+                return super().get_connection(command_name, *keys, **options)
+            except redis.ConnectionError:
+                self.timeouts += 1
+                raise
+            finally:
+                self.waits += 1
+                self.wait_seconds += time.monotonic() - start
+        return super().get_connection(command_name, *keys, **options)
+    
+    def metrics(self) -> Dict[str, Any]:
+        """连接池统计"""
+        idle = sum(1 for connection in list(self.pool.queue) if connection is not None)
+        return {
+            "max_connections": self.max_connections,
+            "created": len(self._connections),
+            "in_use": len(self._connections) - idle,
+            "idle": idle,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "timeouts": self.timeouts,
+        }
+
+
+class AsyncMeteredConnectionPool(aioredis.BlockingConnectionPool):
+    """带统计的异步阻塞连接池"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+    
+    async def get_connection(self, command_name, *keys, **options):
+        if self.can_get_connection():
+            return await super().get_connection(command_name, *keys, **options)
         
+        start = time.monotonic()
+        try:
+            return await super().get_connection(command_name, *keys, **options)
+        except aioredis.ConnectionError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.waits += 1
+            self.wait_seconds += time.monotonic() - start
+    
+    def metrics(self) -> Dict[str, Any]:
+        """连接池统计"""
+        in_use = len(self._in_use_connections)
+        idle = len(self._available_connections)
+        return {
+            "max_connections": self.max_connections,
+            "created": in_use + idle,
+            "in_use": in_use,
+            "idle": idle,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "timeouts": self.timeouts,
+        }
+
+
+# 进程内共享的连接池与客户端（"sync" / "async"）
+_pools: Dict[str, Any] = {}
+_clients: Dict[str, Any] = {}
+_registry_lock = threading.Lock()
+
+
+def _pool_options() -> Dict[str, Any]:
+    """
+    连接池参数
+    
     Raises:
         ValueError: 如果 Redis 配置不完整
     """
@@ -30,25 +116,105 @@ def get_redis_client() -> redis.Redis:
             "方式2: 分别设置 REDIS_HOST, REDIS_PORT 等环境变量"
         )
     
-    try:
-        # 使用 REDIS_URL 创建连接
-        redis_client = redis.from_url(
-            redis_url,
-            decode_responses=True,
-            socket_connect_timeout=5,
-            socket_timeout=5
-        )
-        
-        # 测试连接
-        redis_client.ping()
-        print(f"[Redis] ✅ Connected to {redis_url[:30]}...")
-        
-        return redis_client
-        
-    except redis.ConnectionError as e:
-        print(f"[Redis] ❌ Connection failed: {e}")
-        raise ValueError(f"Redis 连接失败: {e}")
-    except Exception as e:
-        print(f"[Redis] ❌ Unexpected error: {e}")
-        raise
+    return {
+        "url": redis_url,
+        "decode_responses": True,
+        "socket_connect_timeout": 5,
+        "socket_timeout": 5,
+        # 空闲超过该时间的连接在使用前先 PING 确认可用（代替每次获取客户端时 ping）
+        "health_check_interval": settings.REDIS_HEALTH_CHECK_INTERVAL,
+        # 连接数达到上限时等待空闲连接的时间（秒）
+        "timeout": settings.REDIS_POOL_TIMEOUT,
+    }
+
+
+def get_redis_client() -> redis.Redis:
+    """
+    获取同步 Redis 客户端（进程内共享同一个连接池，连接在首次执行命令时建立）
+    
+    优先使用 REDIS_URL，如果未配置则从分散的配置项构建连接
+    
+    Returns:
+        redis.Redis: Redis 客户端实例
+    
+    Raises:
+        ValueError: 如果 Redis 配置不完整
+    """
+    client = _clients.get("sync")
+    if client is not None:
+        return client
+    
+    with _registry_lock:
+        if "sync" not in _clients:
+            options = _pool_options()
+            pool = MeteredConnectionPool.from_url(
+                options.pop("url"),
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                **options
+            )
+            _pools["sync"] = pool
+            _clients["sync"] = redis.Redis(connection_pool=pool)
+            print(f"[Redis] Pool ready for {settings.get_redis_url[:30]}... ({settings.REDIS_MAX_CONNECTIONS} max connections)")
+        return _clients["sync"]
+
+
+def init_async_redis() -> aioredis.Redis:
+    """
+    创建共享的异步连接池（应用启动时调用，重复调用返回已创建的客户端）
+    
+    连接在首次使用时建立；连接数达到 REDIS_ASYNC_MAX_CONNECTIONS 时请求等待空闲连接。
+    
+    Returns:
+        aioredis.Redis: 异步 Redis 客户端
+    
+    Raises:
+        ValueError: 如果 Redis 未配置
+    """
+    client = _clients.get("async")
+    if client is not None:
+        return client
+    
+    with _registry_lock:
+        if "async" not in _clients:
+            options = _pool_options()
+            pool = AsyncMeteredConnectionPool.from_url(
+                options.pop("url"),
+                max_connections=settings.REDIS_ASYNC_MAX_CONNECTIONS,
+                **options
+            )
+            _pools["async"] = pool
+            _clients["async"] = aioredis.Redis(connection_pool=pool)
+            print(f"[Redis] Async pool ready ({settings.REDIS_ASYNC_MAX_CONNECTIONS} max connections)")
+        return _clients["async"]
+
+
+def get_async_redis_client() -> aioredis.Redis:
+    """
+    获取共享的异步 Redis 客户端（未在启动时创建则按需创建）
+    
+    Returns:
+        aioredis.Redis: 异步 Redis 客户端
+    """
+    return _clients.get("async") or init_async_redis()
 
+
+async def close_async_redis():
+    """关闭异步连接池（应用关闭时调用）"""
+    with _registry_lock:
+        client = _clients.pop("async", None)
+        pool = _pools.pop("async", None)
+    if client is not None:
+        await client.aclose()
+    if pool is not None:
+        await pool.disconnect()
+
+
+def get_redis_pool_metrics() -> Dict[str, Dict[str, Any]]:
+    """
+    获取本进程连接池统计
+    
+    Returns:
+        Dict: {"sync": {...}, "async": {...}}（未创建的连接池不出现），每项包含
+              max_connections / created / in_use / idle / waits / wait_seconds / timeouts
+    """
+    return {name: pool.metrics() for name, pool in list(_pools.items())}
@@ -2,98 +2,126 @@
 Pipeline Worker - 调用真实的 Pipeline 处理任务
 用于生产环境，执行实际的 AI 处理
 """
-import time
+import os
 import signal
 import sys
+import threading
 from typing import Optional
 from pathlib import Path
 
 from app.services.tasks.queue import get_task_queue
 from app.services.tasks.manager import get_task_service
+from app.services.tasks.lease import TaskLeaseKeeper
+from app.services.tasks.slots import TaskSlotPool
+from app.services.tasks.retention import TaskRetentionJob
 from app.schemas.task import EditMode
+from app.utils.id_generator import generate_worker_id
 from app.services.image.pipelines.pose_change_pipeline import PoseChangePipeline
 from app.services.image.dto import EditTaskInput
+from app.services.image.engines.registry import get_engine_registry
+from app.core.config import settings
 from app.core.error_codes import TaskErrorCode, create_error
 
 
 class PipelineWorker:
     """Pipeline Worker 类 - 调用真实 Pipeline"""
     
-    def __init__(self):
-        """初始化 Worker"""
+    def __init__(self, concurrency: Optional[int] = None):
+        """
+        初始化 Worker
+        
+        Args:
+            concurrency: 并发槽位数（默认 WORKER_CONCURRENCY）
+        """
         self.queue = get_task_queue()
         self.task_service = get_task_service()
+        self.worker_id = generate_worker_id()
+        self.lease_keeper = TaskLeaseKeeper(self.worker_id, self.queue, self.task_service)
+        self.slot_pool = TaskSlotPool(
+            self.worker_id,
+            handler=self._handle_task,
+            slots=concurrency or settings.WORKER_CONCURRENCY,
+            queue=self.queue,
+            lease_keeper=self.lease_keeper
+        )
+        self.retention_job = TaskRetentionJob(queue=self.queue)
         self.is_running = False
         self._setup_signal_handlers()
         
-        # 初始化 Pipelines
-        self.pose_pipeline = PoseChangePipeline()
+        # 初始化共享的 Engine 注册表（所有槽位共用 Engine 实例）
+        # Pipeline 在执行期间保存计时与进度回调，因此每个槽位线程使用独立的 Pipeline 实例
+        get_engine_registry()
+        self._pipelines = threading.local()
         
         print("[Worker] Pipeline Worker 初始化完成")
     
+    @property
+    def pose_pipeline(self) -> PoseChangePipeline:
+        """当前槽位线程的换姿势 Pipeline"""
+        pipeline = getattr(self._pipelines, "pose", None)
+        if pipeline is None:
+            pipeline = PoseChangePipeline()
+            self._pipelines.pose = pipeline
+        return pipeline
+    
     def _setup_signal_handlers(self):
         """设置信号处理器（优雅关闭）"""
         signal.signal(signal.SIGINT, self._handle_shutdown)
         signal.signal(signal.SIGTERM, self._handle_shutdown)
     
     def _handle_shutdown(self, signum, frame):
-        """处理关闭信号"""
-        print("\n[Worker] 接收到关闭信号，正在停止...")
+        """处理关闭信号（第一次停止取任务并排空，第二次强制退出）"""
+        if not self.is_running:
+            print("\n[Worker] 强制退出，未完成的任务将在租约过期后重新排队")
+            os._exit(1)
+        print("\n[Worker] 接收到关闭信号，正在停止（再次按 Ctrl+C 强制退出）...")
         self.is_running = False
     
     def start(self):
         """启动 Worker 循环"""
-        print("[Worker] Pipeline Worker 已启动，等待任务...")
+        print(f"[Worker] Pipeline Worker 已启动（{self.worker_id}），等待任务...")
+        print(f"[Worker] 并发槽位: {self.slot_pool.slots}")
         print("[Worker] 将调用真实的 ComfyUI Pipeline 处理任务")
         print("[Worker] 按 Ctrl+C 停止\n")
         
         self.is_running = True
+        self.lease_keeper.start()
+        self.retention_job.start()
         
-        while self.is_running:
-            try:
-                # 从队列中获取任务（阻塞式，超时 5 秒）
-                task_id = self.queue.pop_task(timeout=5)
-                
-                if task_id:
-                    print(f"\n{'='*60}")
-                    print(f"[Worker] 📥 获取到任务: {task_id}")
-                    print(f"{'='*60}")
-                    
-                    # 立即标记任务为处理中
-                    try:
-                        self.queue.update_task_status(
-                            task_id=task_id,
-                            status="processing",
-                            progress=0,
-                            current_step="Worker 已接收任务，正在初始化..."
-                        )
-                        print(f"[Worker] ✅ 任务状态已更新为 processing")
-                    except Exception as e:
-                        print(f"[Worker] ⚠️  更新任务状态失败: {e}")
-                    
-                    # 处理任务
-                    self._process_task(task_id)
-                else:
-                    # 超时未获取到任务，继续循环
-                    continue
-                    
-            except Exception as e:
-                # 检查是否是 Redis 超时错误（队列空闲）
-                error_msg = str(e).lower()
-                if 'timeout' in error_msg or 'reading from socket' in error_msg:
-                    # 这只是队列暂时没有任务，不是真正的错误
-                    # 静默处理，继续等待
-                    time.sleep(1)
-                    continue
-                
-                # 其他异常才是真正的错误
-                print(f"[Worker] ❌ Worker 循环出错: {e}")
-                import traceback
-                traceback.print_exc()
-                time.sleep(1)
-        
+        try:
+            # 有空闲槽位时从队列获取任务（阻塞式，超时 5 秒），停止后等待处理中的任务完成
+            self.slot_pool.run(lambda: self.is_running, pop_timeout=5)
+        finally:
+            self.task_service.progress_writer.stop()
+            self.retention_job.stop()
+            self.lease_keeper.stop()
         print("[Worker] Pipeline Worker 已停止")
     
+    def _handle_task(self, task_id: str):
+        """
+        槽位线程中处理单个任务（处理期间后台线程持续续租）
+        
+        Args:
+            task_id: 任务ID
+        """
+        print(f"\n{'='*60}")
+        print(f"[Worker] 📥 获取到任务: {task_id}")
+        print(f"{'='*60}")
+        
+        # 立即标记任务为处理中
+        try:
+            self.queue.update_task_status(
+                task_id=task_id,
+                status="processing",
+                progress=0,
+                current_step="Worker 已接收任务，正在初始化..."
+            )
+            print(f"[Worker] ✅ 任务状态已更新为 processing")
+        except Exception as e:
+            print(f"[Worker] ⚠️  更新任务状态失败: {e}")
+        
+        self._process_task(task_id)
+    
     def _process_task(self, task_id: str):
         """
         处理单个任务
@@ -177,6 +205,7 @@ class PipelineWorker:
                 print(f"[Worker] 📸 输出图片: {result.get('output_image')}")
                 if result.get('comparison_image'):
                     print(f"[Worker] 🔀 对比图片: {result.get('comparison_image')}")
+                self._log_http_stats()
             else:
                 error = create_error(
                     TaskErrorCode.PROCESSING_FAILED,
@@ -214,6 +243,15 @@ class PipelineWorker:
             except Exception as fail_error:
                 print(f"[Worker] ⚠️  无法标记任务失败: {fail_error}")
     
+    def _log_http_stats(self):
+        """打印各 Engine 的连接级耗时统计（连接复用情况）"""
+        for engine_name, stats in get_engine_registry().get_http_stats_all().items():
+            print(
+                f"[Worker] 🔌 {engine_name}: 请求 {stats['requests']} 次，"
+                f"新建连接 {stats['new_connections']}（平均 {stats['connect_ms_avg']}ms），"
+                f"复用率 {stats['reuse_ratio']:.0%}"
+            )
+    
     def _dispatch_to_pipeline(
         self,
         task_id: str,
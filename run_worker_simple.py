@@ -4,6 +4,7 @@
 """
 import time
 import asyncio
+from app.core.config import settings
 from app.services.tasks.queue import get_task_queue
 from app.schemas.task import TaskStatus, EditMode
 
@@ -85,6 +86,7 @@ async def worker_loop():
     print("\n🚀 Worker 已启动，等待任务...")
     print("按 Ctrl+C 停止\n")
     
+    last_reconcile = 0.0
     while True:
         try:
             # 从队列取出任务
@@ -96,7 +98,10 @@ async def worker_loop():
                 # 处理任务
                 await process_task_simple(task_id, task_data)
             else:
-                # 没有任务时等待
+                # 没有任务时等待；此脚本不运行租约回收流程，空闲时顺带回收泄漏的用户并发名额
+                if time.time() - last_reconcile >= settings.TASK_REAPER_INTERVAL:
+                    last_reconcile = time.time()
+                    queue.reconcile_user_slots()
                 await asyncio.sleep(1)
                 
         except KeyboardInterrupt:
@@ -0,0 +1,200 @@
+"""
+认证缓存测试脚本
+验证稳定轮询不访问 Redis、跨节点失效通知、令牌过期与加载期间失效的处理
+默认使用 fakeredis；设置 REDIS_TEST_URL 后直接测试真实 Redis
+
+运行: python test_auth_cache.py
+环境变量（可选）:
+    REDIS_TEST_URL=redis://localhost:6379/15
+"""
+import importlib
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import redis
+
+from app.models.user import User
+from app.services.auth.user_cache import UserCache
+
+auth_module = importlib.import_module("app.services.auth.auth_service")
+user_cache_module = importlib.import_module("app.services.auth.user_cache")
+
+
+class CountingRedis(redis.Redis):
+    """统计执行的命令数（Pub/Sub 连接不经过 execute_command，不计入）"""
+
+    commands = 0
+
+    def execute_command(self, *args, **options):
+        CountingRedis.commands += 1
+        return super().execute_command(*args, **options)
+
+
+def create_client() -> redis.Redis:
+    """创建测试用 Redis 客户端"""
+    url = os.getenv("REDIS_TEST_URL")
+    if url:
+        print(f"Redis: {url}")
+        return CountingRedis.from_url(url, decode_responses=True)
+
+    import fakeredis
+
+    class CountingFakeRedis(CountingRedis, fakeredis.FakeRedis):
+        pass
+
+    print("Redis: fakeredis")
+    return CountingFakeRedis(decode_responses=True)
+
+
+def setup(client: redis.Redis):
+    """让认证服务与缓存使用测试客户端（全新的缓存单例）"""
+    auth_module.get_redis_client = lambda: client
+    user_cache_module.get_redis_client = lambda: client
+    user_cache_module._user_cache_instance = UserCache()
+    auth_module._auth_service = None
+
+
+def new_cache() -> UserCache:
+    """另一个 API 节点的缓存（订阅同一失效频道）"""
+    cache = UserCache()
+    cache.start()
+    assert cache._subscribed.wait(5), "订阅失效频道超时"
+    return cache
+
+
+def wait_until(condition, timeout: float = 5.0) -> bool:
+    """等待条件成立（失效通知异步到达）"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def create_user() -> User:
+    user_id = f"test_auth_{uuid.uuid4().hex[:8]}"
+    return User(user_id=user_id, email=f"{user_id}@example.com", current_credits=10)
+
+
+# ============================================
+# 测试用例
+# ============================================
+
+def test_steady_state_polling():
+    """测试 1: 稳定轮询（解码令牌 + 读取用户）不访问 Redis"""
+    print("\n" + "=" * 50)
+    print("测试 1: 稳定轮询")
+    print("=" * 50)
+
+    service = auth_module.get_auth_service()
+    user = create_user()
+    assert service.save_user(user)
+    token = service.create_access_token(user)
+
+    cache = user_cache_module.get_user_cache()
+    cache.start()
+    assert cache._subscribed.wait(5), "订阅失效频道超时"
+
+    assert service.decode_access_token(token)["sub"] == user.user_id
+    assert service.get_user_by_id(user.user_id).email == user.email
+
+    before = CountingRedis.commands
+    for _ in range(100):
+        payload = service.decode_access_token(token)
+        assert service.get_user_by_id(payload["sub"]).user_id == user.user_id
+    assert CountingRedis.commands == before, CountingRedis.commands - before
+    print("✅ 100 次轮询，0 条 Redis 命令")
+
+
+def test_cross_node_invalidation():
+    """测试 2: 用户写入后其他节点的缓存失效"""
+    print("\n" + "=" * 50)
+    print("测试 2: 跨节点失效")
+    print("=" * 50)
+
+    service = auth_module.get_auth_service()
+    user = create_user()
+    assert service.save_user(user)
+
+    other = new_cache()
+    other.put_user(user, other.generation)
+    assert other.get_user(user.user_id) is not None
+
+    user.username = "renamed"
+    assert service.save_user(user)
+    assert wait_until(lambda: other.get_user(user.user_id) is None), "其他节点未收到失效通知"
+    print("✅ save_user 后其他节点删除缓存")
+
+    other.put_user(user, other.generation)
+    # 算力脚本在 Lua 内发布失效通知
+    client = service.redis_client
+    client.set(f"user:id:{user.user_id}", service._dump_user(user))
+    billing_module = importlib.import_module("app.services.billing.billing_service")
+    billing_module.get_redis_client = lambda: client
+    billing = billing_module.BillingService()
+    assert billing.add_credits(user.user_id, 5)
+    assert wait_until(lambda: other.get_user(user.user_id) is None), "算力变动未通知其他节点"
+    print("✅ 算力变动后其他节点删除缓存")
+
+
+def test_claims_expiry_and_generation():
+    """测试 3: 声明不超过令牌过期时间；加载期间发生失效的用户不写入缓存；未订阅时不缓存"""
+    print("\n" + "=" * 50)
+    print("测试 3: 过期与失效代数")
+    print("=" * 50)
+
+    cache = new_cache()
+    cache.put_claims("expired-token", {"sub": "u", "exp": time.time() - 1})
+    assert cache.get_claims("expired-token") is None
+    print("✅ 已过期令牌的声明不会命中")
+
+    user = create_user()
+    generation = cache.generation
+    cache.invalidate(user.user_id, publish=False)
+    cache.put_user(user, generation)
+    assert cache.get_user(user.user_id) is None
+    print("✅ 加载期间发生失效的用户对象不写入缓存")
+
+    unsubscribed = UserCache()
+    unsubscribed._thread = object()  # 不启动订阅线程
+    unsubscribed.put_user(user, unsubscribed.generation)
+    assert unsubscribed.get_user(user.user_id) is None
+    print("✅ 未订阅失效频道时不缓存用户")
+
+
+def cleanup(client: redis.Redis):
+    """删除测试数据"""
+    for pattern in ["user:id:test_auth_*", "user:email:test_auth_*", "user:credits:test_auth_*"]:
+        for key in client.scan_iter(match=pattern):
+            client.delete(key)
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("\n" + "🚀" * 25)
+    print("认证缓存测试")
+    print("🚀" * 25)
+
+    client = create_client()
+    setup(client)
+    try:
+        test_steady_state_polling()
+        test_cross_node_invalidation()
+        test_claims_expiry_and_generation()
+    finally:
+        cleanup(client)
+
+    print("\n" + "=" * 50)
+    print("✅ 所有测试完成！")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,230 @@
+"""
+算力 Lua 脚本测试脚本
+验证预扣 / 结算 / 退还 / 调整脚本的原子性与幂等性
+默认使用 fakeredis（需要 lupa 执行 Lua）；设置 REDIS_TEST_URL 后直接测试真实 Redis
+
+运行: python test_billing_scripts.py
+环境变量（可选）:
+    REDIS_TEST_URL=redis://localhost:6379/15
+"""
+import importlib
+import json
+import os
+import sys
+import threading
+import uuid
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import redis
+
+from app.services.billing.billing_service import BillingService
+
+# 包内同名的 billing_service 是全局实例，按模块路径取模块本身
+billing_module = importlib.import_module("app.services.billing.billing_service")
+
+
+def create_client() -> redis.Redis:
+    """创建测试用 Redis 客户端"""
+    url = os.getenv("REDIS_TEST_URL")
+    if url:
+        print(f"Redis: {url}")
+        return redis.Redis.from_url(url, decode_responses=True)
+
+    import fakeredis
+    print("Redis: fakeredis")
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def create_service(client: redis.Redis) -> BillingService:
+    """创建使用测试客户端的计费服务"""
+    billing_module.get_redis_client = lambda: client
+    return BillingService()
+
+
+def create_user(service: BillingService, credits: int, used: int = 0) -> str:
+    """写入只有用户 JSON（尚无余额 Hash）的测试用户"""
+    user_id = f"test_billing_{uuid.uuid4().hex[:8]}"
+    service.redis_client.set(service._get_user_key(user_id), json.dumps({
+        "user_id": user_id,
+        "email": f"{user_id}@example.com",
+        "current_plan_id": "pro",
+        "current_credits": credits,
+        "total_credits_used": used,
+    }))
+    return user_id
+
+
+def balance_of(service: BillingService, user_id: str) -> dict:
+    """读取余额 Hash"""
+    return service.redis_client.hgetall(service._get_credits_key(user_id))
+
+
+def new_task_id() -> str:
+    return f"task_test_{uuid.uuid4().hex[:12]}"
+
+
+# ============================================
+# 测试用例
+# ============================================
+
+def test_seed_from_user_json(service: BillingService):
+    """测试 1: 余额 Hash 不存在时从用户 JSON 迁移"""
+    print("\n" + "=" * 50)
+    print("测试 1: 余额从用户 JSON 迁移")
+    print("=" * 50)
+
+    user_id = create_user(service, credits=50, used=7)
+    assert not balance_of(service, user_id)
+
+    status, balance, plan_id = service.reserve_credits(user_id, 20, new_task_id())
+    assert (status, balance, plan_id) == ("reserved", 30, "pro"), (status, balance, plan_id)
+    assert balance_of(service, user_id) == {"balance": "30", "used": "27"}, balance_of(service, user_id)
+    print("✅ 预扣时迁移: balance=50-20, used=7+20")
+
+    user_id = create_user(service, credits=40, used=3)
+    assert service.add_credits(user_id, 5)
+    assert balance_of(service, user_id) == {"balance": "45", "used": "3"}, balance_of(service, user_id)
+    print("✅ 调整时迁移: balance=40+5, used=3")
+
+    # 迁移只发生一次：之后用户 JSON 中的旧值不再生效
+    user = json.loads(service.redis_client.get(service._get_user_key(user_id)))
+    user["current_credits"] = 999
+    service.redis_client.set(service._get_user_key(user_id), json.dumps(user))
+    assert service._adjust_balance(user_id, "add", 0) == 45
+    assert service.get_user(user_id).current_credits == 45
+    print("✅ 已迁移后以余额 Hash 为准")
+
+    status, _, _ = service.reserve_credits("test_billing_missing", 1, new_task_id())
+    assert status == "not_found", status
+    assert service._adjust_balance("test_billing_missing", "add", 1) == -1
+    assert not service.redis_client.exists(service._get_credits_key("test_billing_missing"))
+    print("✅ 用户不存在时不创建余额")
+
+
+def test_concurrent_reserve(service: BillingService):
+    """测试 2: 并发预扣不会超扣"""
+    print("\n" + "=" * 50)
+    print("测试 2: 并发预扣")
+    print("=" * 50)
+
+    user_id = create_user(service, credits=100)
+    results = []
+    barrier = threading.Barrier(20)
+
+    def reserve():
+        barrier.wait()
+        results.append(service.reserve_credits(user_id, 30, new_task_id())[0])
+
+    threads = [threading.Thread(target=reserve) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count("reserved") == 3, results
+    assert results.count("insufficient") == 17, results
+    assert balance_of(service, user_id) == {"balance": "10", "used": "90"}, balance_of(service, user_id)
+    print(f"✅ 20 个并发请求各预扣 30: 成功 3 个，余额 10")
+
+
+def test_duplicate_reserve(service: BillingService):
+    """测试 3: 同一任务重复预扣只扣一次"""
+    print("\n" + "=" * 50)
+    print("测试 3: 重复预扣")
+    print("=" * 50)
+
+    user_id = create_user(service, credits=100)
+    task_id = new_task_id()
+
+    assert service.reserve_credits(user_id, 30, task_id)[:2] == ("reserved", 70)
+    assert service.reserve_credits(user_id, 30, task_id)[:2] == ("duplicate", 70)
+    assert balance_of(service, user_id)["balance"] == "70"
+    print("✅ 第二次预扣返回 duplicate，余额不变")
+
+    # 已退还的任务同样不能再次预扣
+    assert service.refund_credits(task_id, user_id, 30)
+    assert service.reserve_credits(user_id, 30, task_id)[:2] == ("duplicate", 100)
+    print("✅ 已退还的任务不会重新预扣")
+
+
+def test_refund_once(service: BillingService):
+    """测试 4: 退还只发生一次，结算后不能退还"""
+    print("\n" + "=" * 50)
+    print("测试 4: 退还与结算")
+    print("=" * 50)
+
+    user_id = create_user(service, credits=100)
+    task_id = new_task_id()
+    service.reserve_credits(user_id, 30, task_id)
+
+    assert service.refund_credits(task_id, user_id, 30)
+    assert not service.refund_credits(task_id, user_id, 30)
+    assert balance_of(service, user_id) == {"balance": "100", "used": "0"}, balance_of(service, user_id)
+    assert not service.commit_credits(task_id)
+    print("✅ 重复退还只退一次，已退还的任务不能结算")
+
+    task_id = new_task_id()
+    service.reserve_credits(user_id, 30, task_id)
+    assert service.commit_credits(task_id)
+    assert not service.commit_credits(task_id)
+    assert not service.refund_credits(task_id, user_id, 30)
+    assert balance_of(service, user_id) == {"balance": "70", "used": "30"}, balance_of(service, user_id)
+    print("✅ 结算后不能退还")
+
+    # 并发退还同一任务
+    task_id = new_task_id()
+    service.reserve_credits(user_id, 30, task_id)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(service.refund_credits(task_id, user_id, 30)))
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(True) == 1, results
+    assert balance_of(service, user_id)["balance"] == "70"
+    print("✅ 10 个并发退还只有 1 个生效")
+
+    # 没有预扣记录的旧任务按传入数量退还，之后同样只退一次
+    task_id = new_task_id()
+    assert service.refund_credits(task_id, user_id, 5)
+    assert not service.refund_credits(task_id, user_id, 5)
+    assert balance_of(service, user_id)["balance"] == "75"
+    print("✅ 无预扣记录的旧任务只退还一次")
+
+
+def cleanup(service: BillingService):
+    """删除测试数据"""
+    patterns = ["user:id:test_billing_*", "user:credits:test_billing_*", "billing:reservation:task_test_*"]
+    for pattern in patterns:
+        for key in service.redis_client.scan_iter(match=pattern):
+            service.redis_client.delete(key)
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("\n" + "🚀" * 25)
+    print("算力 Lua 脚本测试")
+    print("🚀" * 25)
+
+    service = create_service(create_client())
+    try:
+        test_seed_from_user_json(service)
+        test_concurrent_reserve(service)
+        test_duplicate_reserve(service)
+        test_refund_once(service)
+    finally:
+        cleanup(service)
+
+    print("\n" + "=" * 50)
+    print("✅ 所有测试完成！")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,339 @@
+"""
+AsyncComfyUIEngine 测试脚本
+启动本地假 ComfyUI 服务（HTTP + /ws 事件流），验证 WebSocket 完成检测与节点进度上报
+
+运行: python test_comfyui_async_engine.py
+"""
+import asyncio
+import json
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import uvicorn
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Request, Response
+
+from app.services.image.engines import AsyncComfyUIEngine
+
+
+# ============================================
+# 假 ComfyUI 服务
+# ============================================
+
+class FakeComfyUI:
+    """模拟 ComfyUI 的 /prompt、/history、/upload/image 与 /ws 事件流"""
+
+    def __init__(self, steps: int = 5, step_delay: float = 0.05, fail: bool = False):
+        self.steps = steps
+        self.step_delay = step_delay
+        self.fail = fail
+        self.sockets = {}
+        self.history = {}
+        self.history_requests = 0
+        self.uploads = {}
+        self.prompt_clients = []
+        self.app = self._build_app()
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.websocket("/ws")
+        async def ws_endpoint(websocket: WebSocket):
+            client_id = websocket.query_params.get("clientId")
+            await websocket.accept()
+            self.sockets[client_id] = websocket
+            await websocket.send_text(json.dumps({
+                "type": "status",
+                "data": {"status": {"exec_info": {"queue_remaining": 0}}, "sid": client_id}
+            }))
+            try:
+                while True:
+                    await websocket.receive_text()
+            except WebSocketDisconnect:
+                self.sockets.pop(client_id, None)
+
+        @app.post("/upload/image")
+        async def upload_image(image: UploadFile = File(...)):
+            self.uploads[image.filename] = await image.read()
+            return {"name": image.filename, "subfolder": "", "type": "input"}
+
+        @app.api_route("/view", methods=["GET", "HEAD"])
+        async def view(filename: str, type: str = "output"):
+            if type == "input" and filename not in self.uploads:
+                return Response(status_code=404)
+            return Response(content=self.uploads.get(filename, b""), media_type="image/jpeg")
+
+        @app.post("/prompt")
+        async def submit_prompt(request: Request):
+            payload = await request.json()
+            prompt_id = str(uuid.uuid4())
+            self.prompt_clients.append(payload["client_id"])
+            asyncio.create_task(self._run_prompt(prompt_id, payload["prompt"], payload["client_id"]))
+            return {"prompt_id": prompt_id, "number": 1}
+
+        @app.get("/history/{prompt_id}")
+        async def get_history(prompt_id: str):
+            self.history_requests += 1
+            if prompt_id in self.history:
+                return {prompt_id: self.history[prompt_id]}
+            return {}
+
+        return app
+
+    async def _run_prompt(self, prompt_id: str, prompt: dict, client_id: str):
+        websocket = self.sockets[client_id]
+
+        async def send(event_type: str, data: dict):
+            await websocket.send_text(json.dumps({"type": event_type, "data": data}))
+
+        node_ids = list(prompt.keys())
+        cached, executed = node_ids[:1], node_ids[1:]
+
+        await send("execution_start", {"prompt_id": prompt_id})
+        await send("execution_cached", {"nodes": cached, "prompt_id": prompt_id})
+
+        for node_id in executed:
+            await send("executing", {"node": node_id, "prompt_id": prompt_id})
+            if self.fail:
+                await send("execution_error", {
+                    "prompt_id": prompt_id,
+                    "node_id": node_id,
+                    "exception_message": "CUDA out of memory"
+                })
+                return
+            for step in range(1, self.steps + 1):
+                await asyncio.sleep(self.step_delay)
+                await send("progress", {"value": step, "max": self.steps, "prompt_id": prompt_id, "node": node_id})
+            # 预览图（二进制帧）应被忽略
+            await websocket.send_bytes(b"\x00\x00\x00\x01preview")
+            await send("executed", {
+                "node": node_id,
+                "output": {"images": [{"filename": f"{node_id}.png", "subfolder": "", "type": "output"}]},
+                "prompt_id": prompt_id
+            })
+
+        # 历史记录在完成事件之前写入（与 ComfyUI 行为一致）
+        self.history[prompt_id] = {
+            "outputs": {
+                node_ids[-1]: {"images": [{"filename": "result.png", "subfolder": "", "type": "output"}]}
+            },
+            "status": {"status_str": "success", "completed": True}
+        }
+        await send("executing", {"node": None, "prompt_id": prompt_id})
+
+
+def start_fake_server(fake: FakeComfyUI) -> str:
+    """在后台线程启动假服务，返回服务地址"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    server = uvicorn.Server(uvicorn.Config(fake.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("假 ComfyUI 服务启动超时")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def create_test_files(workdir: Path):
+    """生成测试工作流与输入图片"""
+    workflow = {
+        "nodes": [
+            {"id": 1, "type": "LoadImage", "title": "input:raw_image:1", "inputs": {}},
+            {"id": 2, "type": "LoadImage", "title": "input:pose_image:2", "inputs": {}},
+            {"id": 3, "type": "KSampler", "inputs": {}},
+            {"id": 4, "type": "SaveImage", "title": "output:image:1", "inputs": {}}
+        ]
+    }
+    workflow_path = workdir / "workflow.json"
+    workflow_path.write_text(json.dumps(workflow), encoding="utf-8")
+
+    raw_path = workdir / "raw.jpg"
+    pose_path = workdir / "pose.jpg"
+    raw_path.write_bytes(b"\xff\xd8\xff\xe0fake")
+    pose_path.write_bytes(b"\xff\xd8\xff\xe0fake")
+    return workflow_path, raw_path, pose_path
+
+
+# ============================================
+# 测试用例
+# ============================================
+
+def test_completion_and_progress(base_url: str, fake: FakeComfyUI, workdir: Path):
+    """测试 1: 收到完成事件立即返回，节点进度逐步上报"""
+    print("\n" + "=" * 50)
+    print("测试 1: WebSocket 完成检测与节点进度")
+    print("=" * 50)
+
+    workflow_path, raw_path, pose_path = create_test_files(workdir)
+    engine = AsyncComfyUIEngine({
+        "comfyui_url": base_url,
+        "workflow_path": str(workflow_path),
+        "timeout": 30,
+        "poll_interval": 5,
+        "upload_cache": False
+    })
+
+    progress_updates = []
+    start = time.time()
+    result = engine.execute(
+        {"raw_image": str(raw_path), "pose_image": str(pose_path)},
+        progress_callback=lambda progress, step: progress_updates.append((progress, step))
+    )
+    elapsed = time.time() - start
+
+    assert result["output_image"]["filename"] == "result.png", result
+    print(f"✅ 输出图片: {result['output_image']['url']}")
+
+    # 轮询间隔为 5 秒，事件驱动应远早于一次轮询返回
+    assert elapsed < engine.poll_interval, f"耗时 {elapsed:.2f}s"
+    print(f"✅ 完成耗时 {elapsed:.2f}s（轮询间隔 {engine.poll_interval}s）")
+
+    assert fake.history_requests == 1, fake.history_requests
+    print("✅ 只读取了一次执行历史")
+
+    values = [progress for progress, _ in progress_updates]
+    assert values == sorted(values) and len(set(values)) == len(values), values
+    assert values[0] == 25 and values[-1] >= 90, values
+    assert any("KSampler" in step for _, step in progress_updates), progress_updates
+    print(f"✅ 进度上报 {len(values)} 次: {values}")
+
+    # 上传、提交、读取历史共用 Engine 的连接池
+    stats = engine.get_http_stats()
+    assert stats["requests"] == 4 and stats["new_connections"] == 1, stats
+    print(f"✅ 连接复用: {stats}")
+
+
+def test_execution_error(base_url: str, fake: FakeComfyUI, workdir: Path):
+    """测试 2: execution_error 事件立即失败"""
+    print("\n" + "=" * 50)
+    print("测试 2: 执行错误事件")
+    print("=" * 50)
+
+    workflow_path, raw_path, pose_path = create_test_files(workdir)
+    engine = AsyncComfyUIEngine({
+        "comfyui_url": base_url,
+        "workflow_path": str(workflow_path),
+        "timeout": 30,
+        "upload_cache": False
+    })
+
+    fake.fail = True
+    try:
+        engine.execute({"raw_image": str(raw_path), "pose_image": str(pose_path)})
+    except Exception as e:
+        assert "CUDA out of memory" in str(e), e
+        print(f"✅ 捕获执行错误: {e}")
+    else:
+        raise AssertionError("应当抛出执行错误")
+    finally:
+        fake.fail = False
+
+
+def test_concurrent_executions(base_url: str, fake: FakeComfyUI, workdir: Path):
+    """测试 3: 多个任务槽共用同一 Engine 并发执行，各自收到自己的事件流"""
+    print("\n" + "=" * 50)
+    print("测试 3: 共用 Engine 并发执行")
+    print("=" * 50)
+
+    workflow_path, raw_path, pose_path = create_test_files(workdir)
+    engine = AsyncComfyUIEngine({
+        "comfyui_url": base_url,
+        "workflow_path": str(workflow_path),
+        "timeout": 10,
+        "poll_interval": 5,
+        "upload_cache": False
+    })
+
+    fake.prompt_clients.clear()
+    results, errors = [], []
+    barrier = threading.Barrier(2)
+
+    def run():
+        barrier.wait()
+        try:
+            results.append(engine.execute({"raw_image": str(raw_path), "pose_image": str(pose_path)}))
+        except Exception as e:
+            errors.append(e)
+
+    start = time.time()
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    assert not errors, errors
+    assert [result["output_image"]["filename"] for result in results] == ["result.png"] * 2, results
+    assert len(set(fake.prompt_clients)) == 2, fake.prompt_clients
+    assert elapsed < engine.poll_interval, f"耗时 {elapsed:.2f}s"
+    print(f"✅ 两个并发执行均由事件流完成，耗时 {elapsed:.2f}s，clientId 互不相同")
+
+
+def test_upload_dedup(base_url: str, fake: FakeComfyUI, workdir: Path):
+    """测试 4: 相同内容只上传一次，远端文件丢失后重新上传（需要 Redis）"""
+    print("\n" + "=" * 50)
+    print("测试 4: 上传去重缓存")
+    print("=" * 50)
+
+    try:
+        from app.utils.redis_client import get_redis_client
+        get_redis_client()
+    except Exception as e:
+        print(f"⚠️  Redis 不可用，跳过: {e}")
+        return
+
+    _, raw_path, _ = create_test_files(workdir)
+    raw_path.write_bytes(b"\xff\xd8\xff\xe0" + uuid.uuid4().bytes)
+    engine = AsyncComfyUIEngine({"comfyui_url": base_url})
+
+    fake.uploads.clear()
+    first = engine._upload_image_to_comfyui(str(raw_path))
+    second = engine._upload_image_to_comfyui(str(raw_path))
+    assert first == second and len(fake.uploads) == 1, fake.uploads
+    print(f"✅ 第二次命中缓存，未重复上传: {second}")
+
+    # 模拟 ComfyUI 清理了输入目录
+    fake.uploads.clear()
+    third = engine._upload_image_to_comfyui(str(raw_path))
+    assert third == first and first in fake.uploads, fake.uploads
+    print("✅ 远端文件丢失后缓存失效并重新上传")
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("\n" + "🚀" * 25)
+    print("AsyncComfyUIEngine 测试（本地假 ComfyUI 服务）")
+    print("🚀" * 25)
+
+    fake = FakeComfyUI()
+    base_url = start_fake_server(fake)
+    print(f"假 ComfyUI 服务: {base_url}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        test_completion_and_progress(base_url, fake, workdir)
+        test_execution_error(base_url, fake, workdir)
+        test_concurrent_executions(base_url, fake, workdir)
+        test_upload_dedup(base_url, fake, workdir)
+
+    print("\n" + "=" * 50)
+    print("✅ 所有测试完成！")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,163 @@
+"""
+任务进度合并写入测试脚本
+验证高频进度更新被合并为少量批量写入、最终进度不丢失、迟到的进度不会覆盖结束状态
+默认使用 fakeredis（需要 lupa 执行 Lua）；设置 REDIS_TEST_URL 后直接测试真实 Redis
+
+运行: python test_progress_writer.py
+环境变量（可选）:
+    REDIS_TEST_URL=redis://localhost:6379/15
+"""
+import importlib
+import os
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import redis
+
+from app.services.tasks.progress import TaskProgressWriter
+from app.services.tasks.queue import TaskQueue
+
+queue_module = importlib.import_module("app.services.tasks.queue")
+
+
+class CountingRedis(redis.Redis):
+    """统计执行的命令数（每条命令一次往返）"""
+
+    commands = 0
+
+    def execute_command(self, *args, **options):
+        CountingRedis.commands += 1
+        return super().execute_command(*args, **options)
+
+
+def create_queue() -> TaskQueue:
+    """创建使用测试客户端的任务队列"""
+    url = os.getenv("REDIS_TEST_URL")
+    if url:
+        print(f"Redis: {url}")
+        client = CountingRedis.from_url(url, decode_responses=True)
+    else:
+        import fakeredis
+
+        class CountingFakeRedis(CountingRedis, fakeredis.FakeRedis):
+            pass
+
+        print("Redis: fakeredis")
+        client = CountingFakeRedis(decode_responses=True)
+
+    queue_module.get_redis_client = lambda: client
+    return TaskQueue()
+
+
+def create_processing_tasks(queue: TaskQueue, count: int) -> list:
+    """写入处理中的测试任务"""
+    task_ids = [f"task_test_{uuid.uuid4().hex[:12]}" for _ in range(count)]
+    for task_id in task_ids:
+        queue.redis_client.hset(f"{queue.TASK_KEY_PREFIX}{task_id}", mapping={
+            "task_id": task_id, "status": "processing", "progress": 0
+        })
+    return task_ids
+
+
+# ============================================
+# 测试用例
+# ============================================
+
+def test_coalesced_writes(queue: TaskQueue):
+    """测试 1: 50 个任务约 1 秒内发送 5000 次进度，合并为少量批量写入"""
+    print("\n" + "=" * 50)
+    print("测试 1: 合并写入")
+    print("=" * 50)
+
+    min_interval = 0.2
+    task_ids = create_processing_tasks(queue, 50)
+    writer = TaskProgressWriter(queue, min_interval=min_interval)
+
+    def report(task_id: str):
+        for progress in range(100):
+            writer.update(task_id, progress, f"step {progress}")
+            time.sleep(0.01)
+
+    before = CountingRedis.commands
+    start = time.monotonic()
+    threads = [threading.Thread(target=report, args=(task_id,)) for task_id in task_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.stop()
+    elapsed = time.monotonic() - start
+    round_trips = CountingRedis.commands - before
+
+    assert writer.received == 5000, writer.received
+    # 每个任务每个间隔最多写入一次（另加 stop 时的最后一次）
+    max_writes = len(task_ids) * (int(elapsed / min_interval) + 2)
+    assert writer.written <= max_writes, (writer.written, max_writes)
+    assert round_trips < writer.written, (round_trips, writer.written)
+    for task_id in task_ids:
+        data = queue.redis_client.hgetall(f"{queue.TASK_KEY_PREFIX}{task_id}")
+        assert data["progress"] == "99" and data["current_step"] == "step 99", data
+    print(
+        f"✅ {elapsed:.1f}s 内 {writer.received} 次更新 -> {writer.written} 次任务写入，"
+        f"{round_trips} 次往返；每个任务的最终进度都已写入"
+    )
+
+
+def test_late_progress_ignored(queue: TaskQueue):
+    """测试 2: 任务结束后迟到的进度不会覆盖最终状态"""
+    print("\n" + "=" * 50)
+    print("测试 2: 迟到的进度")
+    print("=" * 50)
+
+    task_id = create_processing_tasks(queue, 1)[0]
+    task_key = f"{queue.TASK_KEY_PREFIX}{task_id}"
+    writer = TaskProgressWriter(queue, min_interval=60)
+
+    writer.update(task_id, 40, "rendering")
+    queue.redis_client.hset(task_key, mapping={"status": "done", "progress": 100})
+    writer.flush()
+    data = queue.redis_client.hgetall(task_key)
+    assert data["status"] == "done" and data["progress"] == "100", data
+    print("✅ 已结束的任务跳过批量写入")
+
+    task_id = create_processing_tasks(queue, 1)[0]
+    writer.update(task_id, 40, "rendering")
+    writer.finish(task_id)
+    writer.flush()
+    assert queue.redis_client.hget(f"{queue.TASK_KEY_PREFIX}{task_id}", "progress") == "0"
+    writer.stop()
+    print("✅ finish 丢弃尚未写入的进度")
+
+
+def cleanup(queue: TaskQueue):
+    """删除测试数据"""
+    for key in queue.redis_client.scan_iter(match=f"{queue.TASK_KEY_PREFIX}task_test_*"):
+        queue.redis_client.delete(key)
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("\n" + "🚀" * 25)
+    print("任务进度合并写入测试")
+    print("🚀" * 25)
+
+    queue = create_queue()
+    try:
+        test_coalesced_writes(queue)
+        test_late_progress_ignored(queue)
+    finally:
+        cleanup(queue)
+
+    print("\n" + "=" * 50)
+    print("✅ 所有测试完成！")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    run_all_tests()
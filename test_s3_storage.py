@@ -0,0 +1,204 @@
+"""
+S3Storage 测试脚本
+默认启动本地 S3 兼容服务（moto server，作为 MinIO 的替身）；
+设置 S3_TEST_ENDPOINT 等环境变量后可直接测试真实的 MinIO / OSS
+
+运行: python test_s3_storage.py
+环境变量（可选）:
+    S3_TEST_ENDPOINT=http://127.0.0.1:9000
+    S3_TEST_ACCESS_KEY=minioadmin
+    S3_TEST_SECRET_KEY=minioadmin
+    S3_TEST_BUCKET=formy-test
+"""
+import asyncio
+import importlib.util
+import os
+import socket
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import requests
+
+from app.services.storage.s3_storage import S3Storage, MIN_PART_SIZE
+
+
+def start_stand_in() -> str:
+    """启动本地 S3 兼容服务，返回服务地址"""
+    from moto.server import ThreadedMotoServer
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    return f"http://127.0.0.1:{port}"
+
+
+def create_storage() -> S3Storage:
+    """创建测试用存储（必要时启动本地服务并创建 Bucket）"""
+    endpoint = os.getenv("S3_TEST_ENDPOINT") or start_stand_in()
+    storage = S3Storage(
+        bucket=os.getenv("S3_TEST_BUCKET", "formy-test"),
+        endpoint=endpoint,
+        access_key_id=os.getenv("S3_TEST_ACCESS_KEY", "minioadmin"),
+        access_key_secret=os.getenv("S3_TEST_SECRET_KEY", "minioadmin"),
+        region="us-east-1",
+        addressing_style="path",
+        public_domain="",
+        key_prefix="uploads"
+    )
+    storage.part_size = MIN_PART_SIZE
+
+    try:
+        storage.client.create_bucket(Bucket=storage.bucket)
+    except storage.client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    print(f"S3 服务: {endpoint}  Bucket: {storage.bucket}")
+    return storage
+
+
+async def iter_bytes(total: int, chunk_size: int = 64 * 1024, fail_at: int = None):
+    """生成测试数据块（可在指定位置抛出异常）"""
+    sent = 0
+    while sent < total:
+        if fail_at is not None and sent >= fail_at:
+            raise RuntimeError("客户端中断")
+        size = min(chunk_size, total - sent)
+        yield bytes([sent // chunk_size % 256]) * size
+        sent += size
+
+
+# ============================================
+# 测试用例
+# ============================================
+
+def test_basic_roundtrip(storage: S3Storage):
+    """测试 1: 小文件上传、读取、存在检查、删除"""
+    print("\n" + "=" * 50)
+    print("测试 1: 基本读写")
+    print("=" * 50)
+
+    path = asyncio.run(storage.save_file(b"hello", "file_basic.jpg", "source"))
+    assert path == "source/file_basic.jpg", path
+    assert asyncio.run(storage.get_file(path)) == b"hello"
+    assert storage.file_exists(path)
+    print(f"✅ 上传并读取: {path}")
+
+    assert asyncio.run(storage.delete_file(path))
+    assert not storage.file_exists(path)
+    print("✅ 删除后不存在")
+
+
+def test_multipart_stream(storage: S3Storage):
+    """测试 2: 流式分片上传，异常时中止分片上传"""
+    print("\n" + "=" * 50)
+    print("测试 2: 分片上传")
+    print("=" * 50)
+
+    total = MIN_PART_SIZE * 2 + 123
+    path, size = asyncio.run(storage.save_stream(iter_bytes(total), "file_large.png", "source"))
+    head = storage.client.head_object(Bucket=storage.bucket, Key=storage._key(path))
+    assert size == total and head["ContentLength"] == total, (size, head["ContentLength"])
+    assert head["ETag"].strip('"').endswith("-3"), head["ETag"]
+    print(f"✅ 分 3 片上传 {total} 字节: {head['ETag']}")
+
+    try:
+        asyncio.run(storage.save_stream(iter_bytes(total, fail_at=MIN_PART_SIZE + 1), "file_broken.png", "source"))
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("应当抛出异常")
+    pending = storage.client.list_multipart_uploads(Bucket=storage.bucket).get("Uploads", [])
+    assert not storage.file_exists("source/file_broken.png")
+    assert not [item for item in pending if item["Key"].endswith("file_broken.png")], pending
+    print("✅ 中断后已中止分片上传，未留下对象")
+
+
+def test_presigned_urls(storage: S3Storage):
+    """测试 3: 预签名 POST 直传（大小范围在签名策略中）+ 预签名 GET 下载"""
+    print("\n" + "=" * 50)
+    print("测试 3: 预签名直传与下载")
+    print("=" * 50)
+
+    presigned = storage.generate_upload_url("file_direct.jpg", "reference", content_type="image/jpeg", max_size=1024)
+    assert presigned["method"] == "POST" and presigned["fields"]["Content-Type"] == "image/jpeg", presigned
+    response = requests.post(
+        presigned["upload_url"], data=presigned["fields"], files={"file": ("file_direct.jpg", b"\xff\xd8\xffdirect")}
+    )
+    assert response.status_code in (200, 204), response.text
+    assert storage.file_exists(presigned["path"])
+    print(f"✅ 客户端直传: {presigned['path']}")
+
+    # 大小范围由对象存储按策略校验（moto 不校验 POST 策略，只在真实服务上检查）
+    if os.getenv("S3_TEST_ENDPOINT"):
+        oversized = storage.generate_upload_url("file_oversized.jpg", "reference", content_type="image/jpeg", max_size=1024)
+        response = requests.post(
+            oversized["upload_url"], data=oversized["fields"], files={"file": ("file_oversized.jpg", b"\xff" * 2048)}
+        )
+        assert response.status_code >= 400 and not storage.file_exists(oversized["path"]), response.status_code
+        print("✅ 超过大小上限的直传被拒绝")
+
+    url = storage.get_url(presigned["path"])
+    assert "Signature" in url or "X-Amz-Signature" in url, url
+    response = requests.get(url)
+    assert response.status_code == 200 and response.content == b"\xff\xd8\xffdirect"
+    print("✅ 预签名 GET 下载成功")
+
+    size, header = storage.read_header(presigned["path"], 4)
+    assert size == 9 and header == b"\xff\xd8\xffd", (size, header)
+    try:
+        storage.read_header("reference/file_missing.jpg", 4)
+    except FileNotFoundError:
+        pass
+    else:
+        raise AssertionError("应当抛出 FileNotFoundError")
+    print("✅ 读取对象大小与文件头")
+
+
+def test_download_to_path(storage: S3Storage):
+    """测试 4: 分片下载到本地缓存（临时文件原子重命名，不留下 .part 文件）"""
+    print("\n" + "=" * 50)
+    print("测试 4: 下载到本地")
+    print("=" * 50)
+
+    total = MIN_PART_SIZE + 10
+    path, _ = asyncio.run(storage.save_stream(iter_bytes(total), "file_download.png", "source"))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cached = Path(tmp) / "cache" / path
+        storage.download_to_path(path, str(cached))
+        assert cached.stat().st_size == total
+        assert cached.read_bytes() == asyncio.run(storage.get_file(path))
+        assert not list(cached.parent.glob("*.part")), list(cached.parent.iterdir())
+        print(f"✅ 下载 {total} 字节: {path}")
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("\n" + "🚀" * 25)
+    print("S3Storage 测试（S3 兼容服务）")
+    print("🚀" * 25)
+
+    if not os.getenv("S3_TEST_ENDPOINT") and importlib.util.find_spec("moto") is None:
+        print("⚠️  未安装 moto 且未设置 S3_TEST_ENDPOINT，跳过（pip install -r requirements-dev.txt）")
+        return
+
+    storage = create_storage()
+    test_basic_roundtrip(storage)
+    test_multipart_stream(storage)
+    test_presigned_urls(storage)
+    test_download_to_path(storage)
+
+    print("\n" + "=" * 50)
+    print("✅ 所有测试完成！")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    run_all_tests()